@@ -1,9 +1,12 @@
 import streamlit as st
+from profiling import begin_rerun, end_rerun
 
 st.set_page_config(
     page_title="Readme",
     page_icon="📄",
 )
+# Per-rerun timings when profiling is on (JAARVIS_PROFILE=1 or ?profile=1)
+begin_rerun("readme")
 
 st.write("# DSCI 551 Final Project: Music Streaming App")
 
@@ -319,4 +322,6 @@ st.markdown(
             - All communications between cluster components will be encrypted to prevent unauthorized data access
             - This strategy supports future growth and improves the resilience and efficiency of our database operations
     """
-)
\ No newline at end of file
+)
+
+end_rerun()
@@ -1,21 +1,106 @@
-from google.cloud import storage
-from google.oauth2 import service_account
+import io
+import json
+import os
+import threading
 import uuid
 import requests
+from columnar import decode_list_response, frame_audio_ids
+from http_client import ApiClient
+from gcs_upload import AUDIO_CONTENT_TYPES, GCS_UPLOAD_CHUNK_SIZE, ResumableUpload, audio_extension, blob_exists, public_url, upload_session
+from upload_dedup import DedupStats, DigestIndex, content_digest
+from metrics import registry
+from read_guard import GuardedReader
+from single_flight import SingleFlight
+from response_cache import CACHE_REVALIDATE, ResponseCache, invalidate_for_delete, invalidate_for_update, invalidate_for_upload
 
 # GCP setup
 SERVICE_ACCOUNT_FILE = './dependencies/dsci551-416302-9c06656dc6b8.json'
 BUCKET_NAME = 'dsci551-project'
 
-# Global API endpoint
-# API_BASE_URL = 'http://127.0.0.1:5001' # Choose this if running locally
+# Global API endpoint; set JAARVIS_API_BASE_URL=http://127.0.0.1:5001 to run
+# against a local server (or benchmarks/stub_server.py)
+API_BASE_URL = os.environ.get('JAARVIS_API_BASE_URL', 'https://dsci551-server-production.up.railway.app')
 
-API_BASE_URL = 'https://dsci551-server-production.up.railway.app'
+# Shared pooled keep-alive client; module state survives Streamlit reruns, so
+# connections are reused across reruns and sessions instead of reopened
+api_client = ApiClient(API_BASE_URL)
 
-# Authenticate using service account
-credentials = service_account.Credentials.from_service_account_file(
-    SERVICE_ACCOUNT_FILE)
-client = storage.Client(credentials=credentials, project=credentials.project_id)
+# List and search reads go through this: hedged against slow answers, bounded by
+# a deadline, and failed fast by a per-endpoint circuit breaker (read_guard.py)
+api_reader = GuardedReader(api_client)
+registry.add_collector(api_reader.prometheus_families)
+
+# Identical reads made at the same time, from any session or thread, share one
+# request (single_flight.py); see single_flight_stats()
+read_flight = SingleFlight()
+registry.add_collector(read_flight.prometheus_families)
+
+# Shared cache for list/search reads, invalidated by the mutations below.
+# See response_cache_stats() for hit/miss counters
+response_cache = ResponseCache()
+
+# Uploads are stored under a hash of their content, so re-uploading the same
+# audio reuses the existing blob instead of transferring it again
+DEDUP_UPLOADS = os.environ.get('JAARVIS_UPLOAD_DEDUP', '1') == '1'
+dedup_stats = DedupStats()
+
+# Local copies of the catalog (mirror, search index) subscribe here to stay in sync
+_mutation_listeners = []
+
+# GCS credentials and clients are created on first use rather than at import, so
+# pages that only read the catalog never load google-cloud-storage or need the
+# service account file
+_gcs_lock = threading.Lock()
+_credentials = None
+_client = None
+_gcs_session = None
+_digest_index = None
+
+def get_credentials():
+    global _credentials
+    if _credentials is None:
+        with _gcs_lock:
+            if _credentials is None:
+                from google.oauth2 import service_account
+                # Authenticate using service account
+                _credentials = service_account.Credentials.from_service_account_file(
+                    SERVICE_ACCOUNT_FILE)
+    return _credentials
+
+def get_storage_client():
+    global _client
+    if _client is None:
+        credentials = get_credentials()
+        with _gcs_lock:
+            if _client is None:
+                from google.cloud import storage
+                _client = storage.Client(credentials=credentials, project=credentials.project_id)
+    return _client
+
+def get_gcs_session():
+    # Session used for chunked resumable uploads
+    global _gcs_session
+    if _gcs_session is None:
+        credentials = get_credentials()
+        with _gcs_lock:
+            if _gcs_session is None:
+                _gcs_session = upload_session(credentials)
+    return _gcs_session
+
+def get_digest_index():
+    global _digest_index
+    if _digest_index is None:
+        with _gcs_lock:
+            if _digest_index is None:
+                _digest_index = DigestIndex()
+    return _digest_index
+
+def __getattr__(name):
+    # Keeps the old module attributes (api_calls.client etc.) working, lazily
+    lazy = {'credentials': get_credentials, 'client': get_storage_client, 'gcs_session': get_gcs_session}
+    if name in lazy:
+        return lazy[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def create_uuid():
     # Generate a random UUID
@@ -24,16 +109,73 @@ def create_uuid():
     file_uuid_32 = str(file_uuid).replace('-', '')
     return file_uuid_32
 
-def upload_file_to_gcs(file):
-    bucket = client.bucket(BUCKET_NAME)
-    blob = bucket.blob(create_uuid() + ".wav")
-    blob.upload_from_string(file.getvalue(), content_type=file.type)
+def upload_file_to_gcs(file, streaming=True, chunk_size=GCS_UPLOAD_CHUNK_SIZE, progress=None, dedup=DEDUP_UPLOADS):
+    return store_upload(file, streaming, chunk_size, progress, dedup)[0]
+
+def store_upload(file, streaming=True, chunk_size=GCS_UPLOAD_CHUNK_SIZE, progress=None, dedup=DEDUP_UPLOADS):
+    # upload_file_to_gcs, returning (file URL, outcome, size) where outcome is
+    # 'uploaded', 'local' or 'remote' as in DedupStats.record; for callers that
+    # report on their own uploads rather than the process-wide counters.
+    # The blob keeps the file's real extension and matching content type, so
+    # st.audio and browsers get the right format
+    extension = audio_extension(getattr(file, 'name', None))
+    content_type = AUDIO_CONTENT_TYPES[extension]
+    if not dedup:
+        file_url = _store_blob(file, f"{create_uuid()}.{extension}", content_type, streaming, chunk_size, progress)
+        return file_url, 'uploaded', file.seek(0, os.SEEK_END)
+
+    # One streaming pass hashes the file; the digest names the blob. Content seen
+    # before is answered from the local index, then by a metadata lookup, and only
+    # uploaded when neither knows it
+    digest, size = content_digest(file)
+    blob_name = f"{digest}.{extension}"
+    index = get_digest_index()
+    file_url = index.get(digest)
+    if file_url is not None:
+        outcome = 'local'
+    elif _blob_exists(blob_name, streaming):
+        outcome = 'remote'
+        file_url = public_url(BUCKET_NAME, blob_name)
+    else:
+        outcome = 'uploaded'
+        file_url = _store_blob(file, blob_name, content_type, streaming, chunk_size, progress)
+    if outcome != 'local':
+        index.put(digest, file_url, size)
+    if outcome != 'uploaded' and progress:
+        progress(size, size)
+    dedup_stats.record(outcome, size)
+    return file_url, outcome, size
+
+def _blob_exists(blob_name, streaming):
+    if streaming:
+        return blob_exists(get_gcs_session(), BUCKET_NAME, blob_name)
+    return get_storage_client().bucket(BUCKET_NAME).blob(blob_name).exists()
+
+def _store_blob(file, blob_name, content_type, streaming, chunk_size, progress):
+    if streaming:
+        # Read straight from the file object one chunk at a time through a resumable
+        # session, so memory stays bounded and a dropped connection resumes mid-file
+        file.seek(0)
+        upload = ResumableUpload(get_gcs_session(), BUCKET_NAME, blob_name, content_type,
+                                 chunk_size=chunk_size, progress=progress)
+        return upload.upload(file)
+
+    bucket = get_storage_client().bucket(BUCKET_NAME)
+    blob = bucket.blob(blob_name)
+    blob.upload_from_string(file.getvalue(), content_type=content_type)
 
     return blob.public_url
 
+def upload_blob(data, blob_name, content_type):
+    # Stores small derived objects (previews, manifests) under an exact blob name
+    return _store_blob(io.BytesIO(data), blob_name, content_type, True, GCS_UPLOAD_CHUNK_SIZE, None)
+
+def stored_blob_exists(blob_name):
+    return _blob_exists(blob_name, True)
+
 def send_to_api(track_info):
     # API endpoint URL
-    api_endpoint = f'{API_BASE_URL}/api/audio/upload'
+    api_endpoint = '/api/audio/upload'
     
     # Adjust the JSON payload to match the API's expected format
     json_data = {
@@ -46,21 +188,45 @@ def send_to_api(track_info):
     headers = {'Content-Type': 'application/json'}
     
     # Send a POST request with the JSON payload
-    response = requests.post(api_endpoint, json=json_data, headers=headers)
+    response = api_client.post(api_endpoint, json=json_data, headers=headers)
+    _invalidate('upload', None, json_data)
     
     # Assuming the response's content type is JSON, parse and return the response JSON
-    return response.json()
+    result = response.json()
+    record = result.get('data') if isinstance(result, dict) else None
+    audio_id = record.get('audio_id') if isinstance(record, dict) else None
+    _notify_mutation('upload', audio_id, json_data, result)
+    return result
 
-def fetch_audio_files(page=1, sort_by='created_at', order='desc', limit=10):
-    # Build the API endpoint URL with sorting parameters
-    api_endpoint = f'{API_BASE_URL}/api/audio/list?page={page}&sort_by={sort_by}&order={order}&limit={limit}'
-    response = requests.get(api_endpoint)
-    if response.status_code == 200:
-        return response.json()  # Returns the parsed JSON response
-    else:
-        return None  # In case of a non-successful status code
+def fetch_audio_files(page=1, sort_by='created_at', order='desc', limit=10, stale_ok=False, fresh=False):
+    # stale_ok: when the API fails or its breaker is open, answer with the last
+    # cached copy of this page (marked 'stale': True) instead of None. For what is
+    # shown on screen; catalog walks (export, sync) want a failure instead.
+    # fresh: ask the API even on a cache hit, in a request of its own rather than
+    # one already in flight; for reads that decide whether data may be deleted.
+    cache_key = ('list', page, sort_by, order, limit)
+    if not fresh:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    # Build the query with sorting parameters
+    params = {'page': page, 'sort_by': sort_by, 'order': order, 'limit': limit}
+    return _guarded_read('/api/audio/list', params, cache_key, stale_ok, shared=not fresh)
+
+def fetch_audio_frame(page=1, sort_by='created_at', order='desc', limit=100, stale_ok=False):
+    # fetch_audio_files for large pages: same request, cache and fallbacks, but
+    # 'data' is a DataFrame with the "View Entries" column names, decoded from the
+    # response body column by column (columnar.py)
+    cache_key = ('list', page, sort_by, order, limit)
+    cached = response_cache.get(cache_key, decode=decode_list_response)
+    if cached is not None:
+        return cached
 
-def search_audio_files(artist_name='', track_name=''):
+    params = {'page': page, 'sort_by': sort_by, 'order': order, 'limit': limit}
+    return _guarded_read('/api/audio/list', params, cache_key, stale_ok, decode=decode_list_response)
+
+def search_audio_files(artist_name='', track_name='', stale_ok=False):
     if not artist_name and not track_name:
         print('Please provide an artist name or a track name to search.')
         return None
@@ -71,12 +237,58 @@ def search_audio_files(artist_name='', track_name=''):
     if track_name:
         params['trackName'] = track_name
 
-    api_endpoint = f'{API_BASE_URL}/api/audio/search'
-    response = requests.get(api_endpoint, params=params)
-    if response.status_code == 200:
-        return response.json()  # Returns the parsed JSON response
-    else:
-        return None  # In case of a non-successful status code
+    cache_key = ('search', artist_name, track_name)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    return _guarded_read('/api/audio/search', params, cache_key, stale_ok)
+
+def _read(path, params, headers=None, shared=True):
+    # The response is shared with every caller that joined the same flight;
+    # callers decode their own copy from its body
+    if not shared:
+        return _send_read(path, params, headers)
+    key = (path, tuple(sorted((params or {}).items())), tuple(sorted((headers or {}).items())))
+    return read_flight.do(key, _send_read, path, params, headers)
+
+def _send_read(path, params, headers):
+    try:
+        return api_reader.get(path, params=params, headers=headers)
+    except requests.RequestException as e:
+        print(f"Read of {path} failed: {e}")
+        return None
+
+def _guarded_read(path, params, cache_key, stale_ok, decode=None, shared=True):
+    # decode: body -> result, instead of response.json(). An expired cache entry
+    # with an ETag/Last-Modified is revalidated: a 304 costs headers only and the
+    # stored body is reused. shared=False keeps the read out of single-flight.
+    cached_decode = decode or json.loads
+    headers = response_cache.conditional_headers(cache_key) if CACHE_REVALIDATE else None
+    response = _read(path, params, headers, shared)
+    if response is not None and response.status_code == 304:
+        data = response_cache.revalidated(cache_key, decode=cached_decode)
+        if data is not None:
+            return data
+        # The entry was invalidated while the request was out; fetch it in full
+        response = _read(path, params, shared=shared)
+    if response is not None and response.status_code == 200:
+        if decode is None:
+            data = response.json()  # Returns the parsed JSON response
+            audio_ids = None
+        else:
+            data = decode(response.content)
+            audio_ids = frame_audio_ids(data.get('data'))
+        response_cache.put(cache_key, response.content, data,
+                           response.headers.get('ETag'), response.headers.get('Last-Modified'), audio_ids)
+        return data
+    if stale_ok:
+        stale = response_cache.get_stale(cache_key, decode=cached_decode)
+        if stale is not None:
+            api_reader.note_stale(path)
+            stale['stale'] = True
+            return stale
+    return None  # In case of a non-successful status code
 
 def update_audio_file(audio_id, artist_name=None, track_name=None, file_url=None):
     update_fields = {}
@@ -91,16 +303,78 @@ def update_audio_file(audio_id, artist_name=None, track_name=None, file_url=None
         print("No update fields provided.")
         return None
 
-    api_endpoint = f'{API_BASE_URL}/api/audio/edit/{audio_id}'
-    response = requests.put(api_endpoint, json=update_fields)
-    return response.json()
+    response = api_client.put(f'/api/audio/edit/{audio_id}', json=update_fields)
+    _invalidate('update', audio_id, update_fields)
+    result = response.json()
+    _notify_mutation('update', audio_id, update_fields, result)
+    return result
+
+def delete_audio_file(id, file_url=None):
+    # Pass the track's file_url to also delete its stored blob (and previews) once
+    # no other record refers to it; otherwise blob_gc.collect_orphans reclaims it
+    response = api_client.delete(f'/api/audio/delete/{id}')
+    _invalidate('delete', id, None)
+    result = response.json()
+    _notify_mutation('delete', id, None, result)
+    if file_url and isinstance(result, dict) and result.get('success'):
+        from blob_gc import delete_unreferenced_blob
+        try:
+            result['blobs_deleted'] = delete_unreferenced_blob(file_url)
+        except Exception as e:
+            print(f"Could not delete blob for {id}: {e}")
+    return result
+
+def add_mutation_listener(listener):
+    # listener(kind, audio_id, fields, result) is called after every upload, edit or
+    # delete made through this module; kind is 'upload', 'update' or 'delete'
+    if listener not in _mutation_listeners:
+        _mutation_listeners.append(listener)
+
+def remove_mutation_listener(listener):
+    if listener in _mutation_listeners:
+        _mutation_listeners.remove(listener)
+
+def mutation_sent(kind, audio_id, fields, result):
+    # For clients that send mutations themselves (async_client): the same cache
+    # invalidation and listener calls the functions above make. fields are the
+    # API's field names, e.g. {'artistName': ..., 'trackName': ...}.
+    _invalidate(kind, audio_id, fields)
+    _notify_mutation(kind, audio_id, fields, result)
+
+def _invalidate(kind, audio_id, fields):
+    # Reads already in flight may predate the change, so later ones do not join them
+    read_flight.forget()
+    if kind == 'upload':
+        invalidate_for_upload(response_cache, fields['artistName'], fields['trackName'])
+    elif kind == 'update':
+        invalidate_for_update(response_cache, audio_id, fields)
+    elif kind == 'delete':
+        invalidate_for_delete(response_cache, audio_id)
+
+def _notify_mutation(kind, audio_id, fields, result):
+    for listener in list(_mutation_listeners):
+        try:
+            listener(kind, audio_id, fields, result)
+        except Exception as e:
+            print(f"Mutation listener {listener!r} failed: {e}")
+
+def read_guard_stats():
+    # Hedging, deadline and circuit breaker counters per read endpoint
+    return api_reader.snapshot()
+
+def single_flight_stats():
+    # Catalog reads sent vs. answered by joining an identical one in flight
+    return read_flight.snapshot()
+
+def response_cache_stats():
+    return response_cache.stats()
 
-def delete_audio_file(id):
-    response = requests.delete(f'{API_BASE_URL}/api/audio/delete/{id}')
-    return response.json()
+def upload_dedup_stats():
+    # Uploads answered by the digest index / bucket lookup and the bytes not sent
+    return dedup_stats.snapshot()
 
 def login(username, password):
-    response = requests.post(f"{API_BASE_URL}/api/login", json={"username": username, "password": password})
+    response = api_client.post("/api/login", json={"username": username, "password": password})
     if response.status_code == 200:
         return True
     else:
@@ -108,7 +382,7 @@ def login(username, password):
 
 def register(username, password):
     print(f"Registering user {username} with password {password}")
-    response = requests.post(f"{API_BASE_URL}/api/register", json={"username": username, "password": password})
+    response = api_client.post("/api/register", json={"username": username, "password": password})
     print(response)
     if response.status_code == 201:
         return True
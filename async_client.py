@@ -0,0 +1,305 @@
+import asyncio
+import json
+import os
+import time
+from urllib.parse import quote
+
+import aiohttp
+from yarl import URL
+
+from api_calls import (API_BASE_URL, BUCKET_NAME, DEDUP_UPLOADS, create_uuid, dedup_stats, get_credentials,
+                       get_digest_index, mutation_sent)
+from gcs_upload import (AUDIO_CONTENT_TYPES, CHUNK_ALIGNMENT, GCS_ENDPOINT, GCS_SCOPES, GCS_UPLOAD_CHUNK_SIZE,
+                        MAX_CHUNK_RETRIES, USING_EMULATOR, ResumableUploadError, audio_extension)
+from upload_dedup import content_digest
+from http_client import CONNECT_TIMEOUT, POOL_MAXSIZE, READ_TIMEOUT
+from metrics import endpoint_label, registry
+
+MAX_CONCURRENCY = 10
+
+
+class AsyncJaarvisClient:
+    # Asyncio counterpart to api_calls. All operations share one aiohttp session
+    # (one keep-alive connection pool), a semaphore bounds how many requests are
+    # in flight at once, and every coroutine takes an optional per-call timeout.
+    # Uploads, edits and deletes invalidate api_calls' response cache and reach
+    # its mutation listeners (mirror, search index) like the synchronous ones.
+    #
+    #     async with AsyncJaarvisClient() as client:
+    #         pages = await client.fetch_pages([1, 2, 3])
+
+    def __init__(self, base_url=API_BASE_URL, max_concurrency=MAX_CONCURRENCY, pool_size=POOL_MAXSIZE,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 gcs_endpoint=GCS_ENDPOINT, bucket_name=BUCKET_NAME, credentials=None, gcs_anonymous=USING_EMULATOR):
+        self.base_url = base_url.rstrip('/')
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.gcs_endpoint = gcs_endpoint.rstrip('/')
+        self.bucket_name = bucket_name
+        self.credentials = credentials
+        self.gcs_anonymous = gcs_anonymous
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        self._ensure_session()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _ensure_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=30)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, method, url, timeout=None, **kwargs):
+        # Returns (status, parsed JSON or None)
+        status, headers, body = await self._exchange(method, url, timeout=timeout, **kwargs)
+        return status, body
+
+    async def _exchange(self, method, url, timeout=None, **kwargs):
+        # Returns (status, response headers, parsed JSON or None); the response is
+        # fully read while the semaphore slot is held so the connection goes
+        # straight back to the pool. Every call is recorded in metrics.registry
+        # like the synchronous clients.
+        session = self._ensure_session()
+        if timeout is not None:
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+        endpoint = endpoint_label(method, str(URL(url).with_query(kwargs.get('params') or {})))
+        service = 'gcs' if url.startswith(self.gcs_endpoint) else 'api'
+        data = kwargs.get('data')
+        sent = len(data) if isinstance(data, (bytes, bytearray)) else 0
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                async with session.request(method, url, **kwargs) as response:
+                    raw = await response.read()
+            except Exception as e:
+                registry.record(service, method, endpoint, e.__class__.__name__, time.perf_counter() - started, sent)
+                raise
+            registry.record(service, method, endpoint, response.status, time.perf_counter() - started, sent, len(raw))
+        try:
+            body = json.loads(raw) if raw else None
+        except ValueError:
+            body = None
+        return response.status, response.headers, body
+
+    async def _api(self, method, path, timeout=None, **kwargs):
+        return await self._request(method, f'{self.base_url}{path}', timeout=timeout, **kwargs)
+
+    async def send_to_api(self, track_info, timeout=None):
+        json_data = {
+            "artistName": track_info['artist_name'],
+            "trackName": track_info['track_name'],
+            "fileUrl": track_info['file_url']
+        }
+        status, body = await self._api('POST', '/api/audio/upload', timeout=timeout, json=json_data)
+        record = body.get('data') if isinstance(body, dict) else None
+        mutation_sent('upload', record.get('audio_id') if isinstance(record, dict) else None, json_data, body)
+        return body
+
+    async def fetch_audio_files(self, page=1, sort_by='created_at', order='desc', limit=10, timeout=None):
+        params = {'page': page, 'sort_by': sort_by, 'order': order, 'limit': limit}
+        status, body = await self._api('GET', '/api/audio/list', timeout=timeout, params=params)
+        return body if status == 200 else None
+
+    async def fetch_pages(self, pages, sort_by='created_at', order='desc', limit=10, timeout=None):
+        # Fetch several pages concurrently; results come back in the order requested
+        return await asyncio.gather(*[
+            self.fetch_audio_files(page, sort_by, order, limit, timeout=timeout) for page in pages
+        ])
+
+    async def search_audio_files(self, artist_name='', track_name='', timeout=None):
+        if not artist_name and not track_name:
+            return None
+
+        params = {}
+        if artist_name:
+            params['artistName'] = artist_name
+        if track_name:
+            params['trackName'] = track_name
+
+        status, body = await self._api('GET', '/api/audio/search', timeout=timeout, params=params)
+        return body if status == 200 else None
+
+    async def update_audio_file(self, audio_id, artist_name=None, track_name=None, file_url=None, timeout=None):
+        update_fields = {}
+        if artist_name is not None:
+            update_fields['artistName'] = artist_name
+        if track_name is not None:
+            update_fields['trackName'] = track_name
+        if file_url is not None:
+            update_fields['fileUrl'] = file_url
+
+        if not update_fields:
+            return None
+
+        status, body = await self._api('PUT', f'/api/audio/edit/{audio_id}', timeout=timeout, json=update_fields)
+        mutation_sent('update', audio_id, update_fields, body)
+        return body
+
+    async def delete_audio_file(self, id, timeout=None):
+        status, body = await self._api('DELETE', f'/api/audio/delete/{id}', timeout=timeout)
+        mutation_sent('delete', id, None, body)
+        return body
+
+    async def login(self, username, password, timeout=None):
+        status, body = await self._api('POST', '/api/login', timeout=timeout,
+                                       json={"username": username, "password": password})
+        return status == 200
+
+    async def register(self, username, password, timeout=None):
+        status, body = await self._api('POST', '/api/register', timeout=timeout,
+                                       json={"username": username, "password": password})
+        return status == 201
+
+    async def _gcs_headers(self):
+        if self.gcs_anonymous:
+            return {}
+        if self.credentials is None:
+            self.credentials = get_credentials().with_scopes(GCS_SCOPES)
+        if not self.credentials.valid:
+            # Token refresh is a blocking HTTP call, keep it off the event loop
+            from google.auth.transport.requests import Request
+            await asyncio.get_running_loop().run_in_executor(None, self.credentials.refresh, Request())
+        return {'Authorization': f'Bearer {self.credentials.token}'}
+
+    def public_url(self, blob_name):
+        # Same form as storage.Blob.public_url
+        return f'https://storage.googleapis.com/{self.bucket_name}/{quote(blob_name)}'
+
+    async def upload_file_to_gcs(self, file, blob_name=None, timeout=None, dedup=DEDUP_UPLOADS,
+                                 chunk_size=GCS_UPLOAD_CHUNK_SIZE):
+        # Content-addressed like api_calls.upload_file_to_gcs, sharing its digest
+        # index and dedup counters: content seen before is answered from the index,
+        # then by a metadata lookup, and only uploaded when neither knows it. The
+        # upload goes through a resumable session one chunk at a time. `timeout`
+        # applies to each request. A blob_name skips the dedup and uploads to it.
+        file_url, outcome, size = await self._store_upload(file, blob_name, timeout, dedup, chunk_size)
+        return file_url
+
+    async def _store_upload(self, file, blob_name, timeout, dedup, chunk_size):
+        # Returns (public URL, 'uploaded' | 'local' | 'remote', size)
+        loop = asyncio.get_running_loop()
+        extension = audio_extension(getattr(file, 'name', None))
+        content_type = AUDIO_CONTENT_TYPES[extension]
+        if blob_name is not None or not dedup:
+            blob_name = blob_name or f"{create_uuid()}.{extension}"
+            file_url = await self._resumable_upload(file, blob_name, content_type, chunk_size, timeout)
+            return file_url, 'uploaded', file.seek(0, os.SEEK_END)
+
+        # Hashing reads the whole file, so it runs off the event loop
+        digest, size = await loop.run_in_executor(None, content_digest, file)
+        blob_name = f"{digest}.{extension}"
+        index = get_digest_index()
+        file_url = index.get(digest)
+        if file_url is not None:
+            outcome = 'local'
+        elif await self._blob_exists(blob_name, timeout):
+            outcome = 'remote'
+            file_url = self.public_url(blob_name)
+        else:
+            outcome = 'uploaded'
+            file_url = await self._resumable_upload(file, blob_name, content_type, chunk_size, timeout)
+        if outcome != 'local':
+            index.put(digest, file_url, size)
+        dedup_stats.record(outcome, size)
+        return file_url, outcome, size
+
+    def _object_url(self, blob_name):
+        return f"{self.gcs_endpoint}/storage/v1/b/{self.bucket_name}/o/{quote(blob_name, safe='')}"
+
+    async def _blob_exists(self, blob_name, timeout=None):
+        # Metadata-only lookup, as gcs_upload.blob_exists
+        status, body = await self._request('GET', self._object_url(blob_name), timeout=timeout,
+                                           params={'fields': 'name,size'}, headers=await self._gcs_headers())
+        if status == 200:
+            return True
+        if status == 404:
+            return False
+        raise ResumableUploadError(f'Could not look up {blob_name}: {status}')
+
+    async def _resumable_upload(self, file, blob_name, content_type, chunk_size, timeout=None):
+        # The asyncio side of gcs_upload.ResumableUpload: one chunk in memory at a
+        # time, and after a failed chunk the session is asked how many bytes it
+        # already holds and the upload continues from there
+        loop = asyncio.get_running_loop()
+        chunk_size = max(CHUNK_ALIGNMENT, chunk_size - chunk_size % CHUNK_ALIGNMENT)
+        total = file.seek(0, os.SEEK_END)
+        status, headers, body = await self._exchange(
+            'POST', f'{self.gcs_endpoint}/upload/storage/v1/b/{self.bucket_name}/o', timeout=timeout,
+            params={'uploadType': 'resumable', 'name': blob_name},
+            headers=dict(await self._gcs_headers(), **{
+                'X-Upload-Content-Type': content_type,
+                'X-Upload-Content-Length': str(total),
+            }),
+            json={'name': blob_name, 'contentType': content_type},
+        )
+        if status not in (200, 201):
+            raise ResumableUploadError(f'Could not start upload of {blob_name}: {status}')
+        session_uri = headers['Location']
+
+        def read_chunk(offset):
+            file.seek(offset)
+            return file.read(chunk_size)
+
+        offset = 0
+        failures = 0
+        while True:
+            querying = offset is None
+            try:
+                if querying:
+                    # The previous attempt failed midway; ask where to continue
+                    status, headers, body = await self._exchange(
+                        'PUT', session_uri, timeout=timeout, data=b'',
+                        headers=dict(await self._gcs_headers(), **{'Content-Range': f'bytes */{total}'}))
+                else:
+                    chunk = await loop.run_in_executor(None, read_chunk, offset)
+                    content_range = (f'bytes {offset}-{offset + len(chunk) - 1}/{total}' if chunk
+                                     else f'bytes */{total}')
+                    status, headers, body = await self._exchange(
+                        'PUT', session_uri, timeout=timeout, data=chunk,
+                        headers=dict(await self._gcs_headers(), **{'Content-Range': content_range}))
+                retry = status == 429 or status >= 500
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if failures >= MAX_CHUNK_RETRIES:
+                    raise
+                retry = True
+            if retry:
+                failures += 1
+                if failures > MAX_CHUNK_RETRIES:
+                    raise ResumableUploadError(f'Upload of {blob_name} failed after {MAX_CHUNK_RETRIES} retries')
+                await asyncio.sleep(min(2 ** (failures - 1) * 0.5, 8))
+                offset = None
+                continue
+            if not querying:
+                failures = 0
+            if status in (200, 201):
+                return self.public_url(blob_name)
+            if status != 308:
+                raise ResumableUploadError(f'Chunk upload of {blob_name} failed: {status}')
+            # A 308 carries the range the server has persisted, e.g. "bytes=0-524287"
+            committed = headers.get('Range')
+            offset = int(committed.rsplit('-', 1)[-1]) + 1 if committed else 0
+
+    async def upload_and_register(self, file, artist_name, track_name, timeout=None):
+        # The track is only registered once its file is stored, so a failed upload
+        # never leaves a record pointing at a missing blob. Concurrency comes from
+        # running several of these at once, not from overlapping the two steps.
+        file_url = await self.upload_file_to_gcs(file, timeout=timeout)
+        track_info = {
+            "artist_name": artist_name,
+            "track_name": track_name,
+            "file_url": file_url,
+        }
+        result = await self.send_to_api(track_info, timeout=timeout)
+        return file_url, result
@@ -0,0 +1,560 @@
+import argparse
+import csv
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from benchmarks.fake_gcs import FakeBucketStore, FakeGcsServer
+from benchmarks.stub_server import CollectionContention, FaultInjector, StubApiServer, StubCatalog, parse_latencies
+
+# End-to-end client benchmarks against the local stand-ins: the stub API (with
+# optional latency and error injection) and the fake GCS server run in a child
+# process, the client code under test (api_calls, bulk_ops, catalog_export,
+# upload_pipeline) runs here unchanged. Each scenario starts from a freshly
+# seeded catalog and an empty bucket and reports:
+#   ops/s                operations completed per second of wall time
+#   p50/p95/p99/max ms   latency of every HTTP request the client made (API and
+#                        GCS, retries included), from the metrics registry
+#   KB in/out            response/request body bytes on the wire (compressed
+#                        sizes, headers not counted)
+#   peak MB              peak Python allocations during the run (tracemalloc)
+#
+#   python -m benchmarks.client_bench
+#   python -m benchmarks.client_bench --scenario browse search --latency-ms 40 --jitter-ms 10 --error-rate 0.02
+#   python -m benchmarks.client_bench --save baseline.json
+#   python -m benchmarks.client_bench --compare baseline.json   # exits 1 on a regression
+
+
+def _serve(conn, options):
+    # Child process: both stand-ins plus a small command loop on `conn` for the
+    # untimed parts of a scenario (reseeding, reading back ids)
+    faults = FaultInjector(options['latency'], options['jitter'], options['error_rate'], options['error_status'],
+                           seed=options['seed'], capacity=options['capacity'], queue_limit=options['queue_limit'])
+    contention = CollectionContention(parse_latencies(options['collection_latency']), options['collection_capacity'])
+    api = StubApiServer(faults=faults, contention=contention).start()
+    gcs = FakeGcsServer(store=FakeBucketStore(keep_data=False)).start()
+    gcs.store.latency = options['gcs_latency']
+    conn.send((api.base_url, gcs.endpoint))
+    while True:
+        command, arg = conn.recv()
+        if command == 'stop':
+            break
+        if command == 'reset':
+            # arg: number of catalog records to seed
+            api.httpd.catalog = StubCatalog()
+            api.catalog.seed(arg)
+            with gcs.store.lock:
+                gcs.store.objects.clear()
+                gcs.store.sessions.clear()
+            # Same faults, in the same order, on every run
+            faults.rng.seed(options['seed'])
+            faults.injected_errors = 0
+            faults.shed = 0
+            conn.send(None)
+        elif command == 'ids':
+            with api.catalog.lock:
+                conn.send([record['audio_id'] for record in api.catalog.records.values()])
+        elif command == 'add_user':
+            api.catalog.users[arg[0]] = arg[1]
+            conn.send(None)
+        elif command == 'injected_errors':
+            conn.send(faults.injected_errors + faults.shed)
+    api.stop()
+    gcs.stop()
+
+
+class StandInServers:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, gcs_latency=0.0, seed=551,
+                 capacity=0, queue_limit=0, collection_latency='', collection_capacity=0):
+        self.options = {'latency': latency, 'jitter': jitter, 'error_rate': error_rate,
+                        'error_status': error_status, 'gcs_latency': gcs_latency, 'seed': seed,
+                        'capacity': capacity, 'queue_limit': queue_limit,
+                        'collection_latency': collection_latency, 'collection_capacity': collection_capacity}
+        self.api_url = None
+        self.gcs_url = None
+        self._conn = None
+        self._process = None
+
+    def start(self):
+        # Spawned rather than forked, so the servers never share the client's GIL
+        # or count towards its memory
+        context = multiprocessing.get_context('spawn')
+        self._conn, child = context.Pipe()
+        self._process = context.Process(target=_serve, args=(child, self.options), daemon=True)
+        self._process.start()
+        self.api_url, self.gcs_url = self._conn.recv()
+        return self
+
+    def call(self, command, arg=None):
+        self._conn.send((command, arg))
+        return self._conn.recv()
+
+    def stop(self):
+        self._conn.send(('stop', None))
+        self._process.join(5)
+
+
+class NamedBytesIO(io.BytesIO):
+    # Stands in for a Streamlit UploadedFile
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+def _failed(result):
+    return not isinstance(result, dict) or result.get('success') is False
+
+
+def _csv_file(rows, columns):
+    text = io.StringIO()
+    writer = csv.DictWriter(text, fieldnames=columns)
+    writer.writeheader()
+    writer.writerows(rows)
+    return io.BytesIO(text.getvalue().encode('utf-8'))
+
+
+# Each scenario is (prepare, run). prepare(bench) does the untimed setup and
+# returns the state run(bench, state) needs; run returns (operations, failures).
+
+def prepare_nothing(bench):
+    return None
+
+
+def run_browse(bench, state):
+    from api_calls import fetch_audio_files
+
+    failures = 0
+    for page in range(1, bench.args.ops + 1):
+        failures += _failed(fetch_audio_files(page))
+    return bench.args.ops, failures
+
+
+def run_revisit(bench, state):
+    # The Stream tab going back over the first pages of an unchanged catalog
+    # after they expired from the response cache: every read goes to the API,
+    # which can answer 304 to the cached copy's ETag
+    import api_calls
+
+    ttl = api_calls.response_cache.ttl
+    api_calls.response_cache.ttl = 1e-6
+    try:
+        failures = 0
+        for i in range(bench.args.ops):
+            failures += _failed(api_calls.fetch_audio_files(i % 10 + 1))
+    finally:
+        api_calls.response_cache.ttl = ttl
+    return bench.args.ops, failures
+
+
+def run_stampede(bench, state):
+    # `sessions` Streamlit sessions opening the Stream tab at the same moment, in
+    # `ops` rounds, each with the first page just gone from the response cache.
+    # With single-flight they share one request per round.
+    import api_calls
+
+    sessions = bench.args.sessions
+    barrier = threading.Barrier(sessions)
+    failures = []
+
+    def session():
+        for _ in range(bench.args.ops):
+            barrier.wait()
+            failures.append(_failed(api_calls.fetch_audio_files(1)))
+            if barrier.wait() == 0:
+                api_calls.response_cache.clear()
+
+    threads = [threading.Thread(target=session) for _ in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(failures), sum(failures)
+
+
+def prepare_search(bench):
+    rng = random.Random(bench.args.seed)
+    queries = []
+    for _ in range(bench.args.ops):
+        i = rng.randrange(bench.args.catalog)
+        kind = rng.random()
+        if kind < 0.4:
+            queries.append((f'Artist {i % 97}', ''))
+        elif kind < 0.8:
+            queries.append(('', f'Track {i}'))
+        else:
+            queries.append((f'Artist {i % 97}', f'Track {i}'))
+    return queries
+
+
+def run_search(bench, queries):
+    from api_calls import search_audio_files
+
+    failures = 0
+    for artist_name, track_name in queries:
+        failures += search_audio_files(artist_name, track_name) is None
+    return len(queries), failures
+
+
+def prepare_login(bench):
+    bench.servers.call('add_user', ('bench', 'bench-password'))
+    return None
+
+
+def run_login(bench, state):
+    from api_calls import login
+
+    failures = 0
+    for _ in range(bench.args.ops):
+        failures += not login('bench', 'bench-password')
+    return bench.args.ops, failures
+
+
+def prepare_upload_files(bench):
+    # Distinct random content per file and per run, so every upload goes all the
+    # way to GCS instead of being answered by the digest index
+    rng = random.Random(f'{bench.args.seed}-{bench.scenario}-{bench.run_index}')
+    size = bench.args.file_kb * 1024
+    return [NamedBytesIO(rng.randbytes(size), f'Bench Artist - Track {i}.wav') for i in range(bench.args.files)]
+
+
+def run_upload(bench, files):
+    from upload_pipeline import UploadJob
+
+    failures = 0
+    for i, file in enumerate(files):
+        job = UploadJob(file, 'Bench Artist', f'Track {i}', transcode=False, preview=False).run()
+        failures += job.state == 'failed'
+    return len(files), failures
+
+
+def run_upload_batch(bench, files):
+    # The multi-file Upload tab: all files at once through the upload pool
+    from upload_pipeline import UploadJob, run_uploads
+
+    jobs = [UploadJob(file, 'Bench Artist', f'Track {i}', transcode=False, preview=False)
+            for i, file in enumerate(files)]
+    run_uploads(jobs, poll_interval=0.05)
+    return len(jobs), sum(job.state == 'failed' for job in jobs)
+
+
+def prepare_ids(bench):
+    ids = bench.servers.call('ids')
+    random.Random(bench.args.seed).shuffle(ids)
+    return ids
+
+
+def run_edit(bench, ids):
+    from api_calls import update_audio_file
+
+    ids = ids[:bench.args.ops]
+    failures = 0
+    for i, audio_id in enumerate(ids):
+        failures += _failed(update_audio_file(audio_id, artist_name=f'Edited Artist {i}'))
+    return len(ids), failures
+
+
+def run_delete(bench, ids):
+    from api_calls import delete_audio_file
+
+    ids = ids[:bench.args.ops]
+    failures = 0
+    for audio_id in ids:
+        failures += _failed(delete_audio_file(audio_id))
+    return len(ids), failures
+
+
+def prepare_bulk_upload(bench):
+    rows = [{'artistName': f'Bulk Artist {i % 53}', 'trackName': f'Bulk Track {i}',
+             'fileUrl': f'https://storage.googleapis.com/stub/bulk-{i}.wav'} for i in range(bench.args.rows)]
+    return _csv_file(rows, ['artistName', 'trackName', 'fileUrl'])
+
+
+def prepare_bulk_edit(bench):
+    ids = prepare_ids(bench)[:bench.args.rows]
+    rows = [{'trackID': audio_id, 'artistName': f'Edited Artist {i}', 'trackName': '', 'fileUrl': ''}
+            for i, audio_id in enumerate(ids)]
+    return _csv_file(rows, ['trackID', 'artistName', 'trackName', 'fileUrl'])
+
+
+def prepare_bulk_delete(bench):
+    ids = prepare_ids(bench)[:bench.args.rows]
+    return _csv_file([{'trackID': audio_id} for audio_id in ids], ['trackID'])
+
+
+def _run_bulk(operation):
+    def run(bench, csv_file):
+        from bulk_ops import run_bulk
+
+        report = run_bulk(csv_file, operation)
+        report.close()
+        bench.concurrency = {label: limiter.snapshot() for label, limiter in report.limiters.items()}
+        if report.collections():
+            bench.collections = report.collections()
+        return report.processed, report.failed
+    return run
+
+
+def prepare_export(bench):
+    return tempfile.mkdtemp(prefix='jaarvis-bench-')
+
+
+def run_export(bench, directory):
+    from catalog_export import export_catalog
+
+    path = os.path.join(directory, 'catalog.csv')
+    try:
+        stats = export_catalog(path)
+    except RuntimeError:
+        return 0, 1
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    return stats.rows, 0
+
+
+SCENARIOS = {
+    'browse': (prepare_nothing, run_browse),
+    'revisit': (prepare_nothing, run_revisit),
+    'stampede': (prepare_nothing, run_stampede),
+    'search': (prepare_search, run_search),
+    'login': (prepare_login, run_login),
+    'upload': (prepare_upload_files, run_upload),
+    'upload_batch': (prepare_upload_files, run_upload_batch),
+    'edit': (prepare_ids, run_edit),
+    'delete': (prepare_ids, run_delete),
+    'bulk_upload': (prepare_bulk_upload, _run_bulk('upload')),
+    'bulk_edit': (prepare_bulk_edit, _run_bulk('edit')),
+    'bulk_delete': (prepare_bulk_delete, _run_bulk('delete')),
+    'export': (prepare_export, run_export),
+}
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    rank = q * (len(sorted_values) - 1)
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+class Bench:
+    def __init__(self, args, servers):
+        self.args = args
+        self.servers = servers
+        self.latencies = None
+        self.request_errors = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.scenario = None
+        self.run_index = 0
+        # Limiter states (per collection for planned runs) and per-collection
+        # throughput at the end of the last bulk run
+        self.concurrency = None
+        self.collections = None
+
+    def observe(self, service, method, endpoint, status, seconds):
+        # Metrics observer; called on whichever thread made the request
+        if self.latencies is not None:
+            self.latencies.append(seconds)
+            if not isinstance(status, int) or status >= 500:
+                self.request_errors += 1
+
+    @staticmethod
+    def _wire_bytes():
+        from metrics import registry
+
+        rows = registry.snapshot()
+        return sum(row['bytes_received'] for row in rows), sum(row['bytes_sent'] for row in rows)
+
+    def _run_once(self, name, traced):
+        import api_calls
+
+        prepare, run = SCENARIOS[name]
+        self.servers.call('reset', self.args.catalog)
+        api_calls.response_cache.clear()
+        state = prepare(self)
+        self.latencies = []
+        self.request_errors = 0
+        received, sent = self._wire_bytes()
+        if traced:
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            ops, failed = run(self, state)
+        finally:
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1] if traced else 0
+            if traced:
+                tracemalloc.stop()
+            latencies, self.latencies = self.latencies, None
+        received_after, sent_after = self._wire_bytes()
+        self.bytes_received = received_after - received
+        self.bytes_sent = sent_after - sent
+        return ops, failed, elapsed, peak, latencies
+
+    def run_scenario(self, name):
+        # `repeat` timed runs, then one more under tracemalloc for the memory peak
+        # only, since tracing slows allocation-heavy code down several times
+        self.scenario = name
+        self.concurrency = None
+        self.collections = None
+        operations = failures = requests = request_errors = injected = received = sent = 0
+        elapsed = peak = 0.0
+        latencies = []
+        for self.run_index in range(self.args.repeat):
+            ops, failed, seconds, _, run_latencies = self._run_once(name, traced=False)
+            operations += ops
+            failures += failed
+            elapsed += seconds
+            requests += len(run_latencies)
+            request_errors += self.request_errors
+            received += self.bytes_received
+            sent += self.bytes_sent
+            latencies.extend(run_latencies)
+            injected += self.servers.call('injected_errors')
+        if self.args.memory:
+            self.run_index = self.args.repeat
+            peak = self._run_once(name, traced=True)[3]
+        latencies.sort()
+        result = {
+            'operations': operations,
+            'failures': failures,
+            'seconds': round(elapsed, 3),
+            'ops_per_second': round(operations / elapsed, 2) if elapsed else None,
+            'requests': requests,
+            'request_errors': request_errors,
+            'injected_errors': injected,
+            'kb_received': round(received / 1024, 1),
+            'kb_sent': round(sent / 1024, 1),
+            'peak_mb': round(peak / 1024 / 1024, 2) if self.args.memory else None,
+        }
+        if self.concurrency is not None:
+            result['concurrency'] = self.concurrency
+        if self.collections is not None:
+            result['collections'] = self.collections
+        for label, q in (('p50_ms', 0.50), ('p95_ms', 0.95), ('p99_ms', 0.99), ('max_ms', 1.0)):
+            value = percentile(latencies, q)
+            result[label] = None if value is None else round(value * 1000, 2)
+        return result
+
+
+def regressions(results, baseline, tolerance):
+    # Scenario/metric pairs that got worse than the baseline by more than `tolerance`
+    found = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        checks = [('ops_per_second', -1), ('p95_ms', 1), ('p99_ms', 1), ('peak_mb', 1), ('kb_received', 1),
+                  ('kb_sent', 1)]
+        for metric, direction in checks:
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if change * direction > tolerance:
+                found.append(f'{name}: {metric} {old} -> {new} ({change:+.0%})')
+    return found
+
+
+def print_row(name, result):
+    def fmt(value, digits=1):
+        return '-' if value is None else f'{value:.{digits}f}'
+
+    print(f"{name:>13} {result['operations']:>7} {result['failures']:>6} {fmt(result['ops_per_second']):>9} "
+          f"{result['requests']:>7} {fmt(result['p50_ms']):>8} {fmt(result['p95_ms']):>8} {fmt(result['p99_ms']):>8} "
+          f"{fmt(result['max_ms']):>8} {fmt(result['peak_mb'], 2):>8} {fmt(result.get('kb_received')):>9} "
+          f"{fmt(result.get('kb_sent')):>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Client benchmarks against the local stand-in API and fake GCS')
+    parser.add_argument('--scenario', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS),
+                        help='scenarios to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per scenario, each from a fresh catalog')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='skip the extra traced run that measures peak memory')
+    parser.add_argument('--catalog', type=int, default=2000, help='catalog records seeded before each run')
+    parser.add_argument('--ops', type=int, default=100, help='pages, searches, logins, edits or deletes per run')
+    parser.add_argument('--sessions', type=int, default=20, help='concurrent sessions in the stampede scenario')
+    parser.add_argument('--rows', type=int, default=1000, help='CSV rows per bulk run')
+    parser.add_argument('--files', type=int, default=16, help='files per upload run')
+    parser.add_argument('--file-kb', type=int, default=256, help='size of each uploaded file')
+    parser.add_argument('--latency-ms', type=float, default=0, help='added API latency (/api/audio/*, /api/login)')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='random +/- spread around --latency-ms')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of API requests that fail')
+    parser.add_argument('--error-status', type=int, default=503, help='status returned for injected failures')
+    parser.add_argument('--capacity', type=int, default=0, help='API requests worked on at once (0: no limit)')
+    parser.add_argument('--queue-limit', type=int, default=0, help='queued API requests beyond which new ones fail')
+    parser.add_argument('--collection-latency-ms', default='',
+                        help='write latency per stub collection, e.g. 5,40 for collections 0 and 1')
+    parser.add_argument('--collection-capacity', type=int, default=0,
+                        help='writes worked on at once per stub collection (0: no limit)')
+    parser.add_argument('--gcs-latency-ms', type=float, default=0, help='added latency per fake GCS request')
+    parser.add_argument('--seed', type=int, default=551, help='seed for queries, file contents and injected faults')
+    parser.add_argument('--save', help='write the results as JSON to this path')
+    parser.add_argument('--compare', help='baseline JSON (from --save) to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative change before a regression')
+    args = parser.parse_args()
+
+    servers = StandInServers(args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate, args.error_status,
+                             args.gcs_latency_ms / 1000, args.seed, args.capacity, args.queue_limit,
+                             args.collection_latency_ms, args.collection_capacity).start()
+    # The client reads these at import, so they are set before anything imports api_calls
+    workdir = tempfile.mkdtemp(prefix='jaarvis-bench-')
+    os.environ['JAARVIS_API_BASE_URL'] = servers.api_url
+    os.environ['STORAGE_EMULATOR_HOST'] = servers.gcs_url
+    os.environ['JAARVIS_DIGEST_INDEX'] = os.path.join(workdir, 'upload_digests.sqlite3')
+    os.environ['JAARVIS_MIRROR_PATH'] = os.path.join(workdir, 'catalog_mirror.sqlite3')
+    os.environ['JAARVIS_PROFILE'] = '0'
+
+    # Imported up front so no run pays for first-time imports (numpy, pandas)
+    for module in ('bulk_ops', 'catalog_export', 'pandas', 'upload_pipeline'):
+        importlib.import_module(module)
+    from metrics import registry
+
+    bench = Bench(args, servers)
+    registry.add_observer(bench.observe)
+    results = {}
+    print(f"{'scenario':>13} {'ops':>7} {'failed':>6} {'ops/s':>9} {'reqs':>7} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'max ms':>8} {'peak MB':>8} {'KB in':>9} {'KB out':>9}")
+    try:
+        for name in args.scenario:
+            results[name] = bench.run_scenario(name)
+            print_row(name, results[name])
+    finally:
+        servers.stop()
+
+    if args.save:
+        options = {key: value for key, value in vars(args).items() if key not in ('save', 'compare', 'scenario')}
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'options': options, 'results': results}, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        options = baseline.get('options', {})
+        differing = [key for key, value in options.items() if key not in ('repeat', 'memory', 'tolerance')
+                     and getattr(args, key, value) != value]
+        if differing:
+            print(f"Note: baseline was run with different {', '.join(differing)}")
+        found = regressions(results, baseline.get('results', {}), args.tolerance)
+        if found:
+            print(f'Regressions against {args.compare}:')
+            for line in found:
+                print(f'  {line}')
+            sys.exit(1)
+        print(f'No regressions against {args.compare} (tolerance {args.tolerance:.0%})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Decode time and peak memory for one large list response turned into the
+# "View Entries" DataFrame. Each sample runs in a fresh interpreter, so the peak
+# resident size belongs to that decode alone:
+#   dicts     - response.json(), renaming keys record by record, pd.DataFrame(records)
+#               (what "View Entries" did before)
+#   columnar  - columnar.decode_list_response
+#
+#   python -m benchmarks.decode_bench --rows 100000
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    'dicts': '''
+data = json.loads(body)['data']
+for item in data:
+    item['Artist Name'] = item.pop('artistName')
+    item['Track Name'] = item.pop('trackName')
+    item['URL'] = item.pop('fileUrl')
+    item['Collection Number'] = item.pop('collection_tag')
+    item['Track ID'] = item.pop('audio_id')
+    item['Metadata ID'] = item.pop('_id')
+    item['Upload Date'] = item.pop('created_at', None)
+df = pd.DataFrame(data)
+''',
+    'columnar': '''
+df = decode_list_response(body)['data']
+''',
+}
+
+RUNNER = '''
+import json, resource, time
+import pandas as pd
+from columnar import decode_list_response
+with open({path!r}, 'rb') as f:
+    body = f.read()
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+assert len(df) == {rows}
+print(elapsed, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) / 1024)
+'''
+
+
+def synthetic_body(rows):
+    records = [{
+        '_id': f'{i:024x}',
+        'audio_id': f'{i * 7919:032x}',
+        'artistName': f'Artist {i % 997}',
+        'trackName': f'Track {i}',
+        'fileUrl': f'https://storage.googleapis.com/bench/{i:032x}.mp3',
+        'collection_tag': i % 2,
+        'created_at': f'2024-04-{i % 28 + 1:02d}T12:{i % 60:02d}:00.000Z',
+    } for i in range(rows)]
+    return json.dumps({'success': True, 'data': records}).encode('utf-8')
+
+
+def measure(name, path, rows):
+    output = subprocess.run(
+        [sys.executable, '-c', RUNNER.format(path=path, statement=SCENARIOS[name], rows=rows)],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+    )
+    seconds, peak_mb = output.stdout.strip().splitlines()[-1].split()
+    return float(seconds), float(peak_mb)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='List response decoding benchmark')
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix='jaarvis-decode-'), 'list.json')
+    body = synthetic_body(args.rows)
+    with open(path, 'wb') as f:
+        f.write(body)
+    print(f'{args.rows:,} rows, {len(body) / 1024 / 1024:.1f} MB body')
+    for name in SCENARIOS:
+        samples = [measure(name, path, args.rows) for _ in range(args.runs)]
+        seconds = statistics.median(s for s, _ in samples)
+        peak = statistics.median(p for _, p in samples)
+        print(f'{name:>9}: {seconds * 1000:8.0f} ms  peak +{peak:6.1f} MB')
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+import argparse
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+# Minimal local stand-in for the parts of the GCS JSON API the client uses:
+# simple media uploads, resumable uploads, object metadata lookups, downloads,
+# listings and (batched) deletes. Start it and export
+# STORAGE_EMULATOR_HOST=http://127.0.0.1:<port> to route uploads here.
+
+
+class FakeBucketStore:
+    def __init__(self, keep_data=True):
+        self.lock = threading.Lock()
+        # (bucket, name) -> object metadata (+ 'data' when keep_data is set)
+        self.objects = {}
+        # upload_id -> {'bucket', 'name', 'contentType', 'total', 'buffer'}
+        self.sessions = {}
+        self.keep_data = keep_data
+        # Fault injection: every Nth chunk PUT fails with a 503 (0 disables)
+        self.fail_every_n_chunks = 0
+        # Every Nth chunk PUT keeps only the first half of its bytes and the
+        # connection is dropped without an answer, as when a network cuts out
+        self.cut_every_n_chunks = 0
+        self.chunk_puts = 0
+        # Added delay in seconds before every request is handled
+        self.latency = 0.0
+
+    def put_object(self, bucket, name, data, content_type):
+        metadata = {
+            'bucket': bucket,
+            'name': name,
+            'size': str(len(data)),
+            'contentType': content_type,
+            'timeCreated': datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
+        }
+        with self.lock:
+            self.objects[(bucket, name)] = dict(metadata, data=bytes(data) if self.keep_data else None)
+        return metadata
+
+    def delete_object(self, bucket, name):
+        with self.lock:
+            return self.objects.pop((bucket, name), None) is not None
+
+    def list_objects(self, bucket, prefix='', page_token=None, max_results=1000):
+        # Name-ordered pages; the token is the last name returned
+        with self.lock:
+            names = sorted(n for b, n in self.objects if b == bucket and n.startswith(prefix))
+            if page_token:
+                names = [n for n in names if n > page_token]
+            page = names[:max_results]
+            items = [{k: v for k, v in self.objects[(bucket, n)].items() if k != 'data'} for n in page]
+        token = page[-1] if len(names) > max_results else None
+        return items, token
+
+
+class FakeGcsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def store(self):
+        return self.server.store
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send(self, status, payload=None, headers=None):
+        body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if payload is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self):
+        if self.store.latency:
+            time.sleep(self.store.latency)
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        parts = url.path.strip('/').split('/')
+        return url, query, parts
+
+    def do_GET(self):
+        _, query, parts = self._route()
+        # /storage/v1/b/<bucket>/o (listing)
+        if parts[:2] == ['storage', 'v1'] and len(parts) == 5 and parts[4] == 'o':
+            items, token = self.store.list_objects(unquote(parts[3]), query.get('prefix', ''), query.get('pageToken'),
+                                                   int(query.get('maxResults', 1000)))
+            payload = {'kind': 'storage#objects', 'items': items}
+            if token:
+                payload['nextPageToken'] = token
+            return self._send(200, payload)
+        # /storage/v1/b/<bucket>/o/<name>
+        if parts[:2] != ['storage', 'v1'] or len(parts) != 6 or parts[4] != 'o':
+            return self._send(404, {'error': {'code': 404, 'message': 'Not found'}})
+        with self.store.lock:
+            stored = self.store.objects.get((unquote(parts[3]), unquote(parts[5])))
+        if stored is None:
+            return self._send(404, {'error': {'code': 404, 'message': 'No such object'}})
+        if query.get('alt') == 'media':
+            return self._send_media(stored)
+        self._send(200, {k: v for k, v in stored.items() if k != 'data'})
+
+    def _send_media(self, stored):
+        body = stored.get('data') or b''
+        self.send_response(200)
+        self.send_header('Content-Type', stored.get('contentType') or 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_DELETE(self):
+        _, _, parts = self._route()
+        if parts[:2] != ['storage', 'v1'] or len(parts) != 6 or parts[4] != 'o':
+            return self._send(404, {'error': {'code': 404, 'message': 'Not found'}})
+        if self.store.delete_object(unquote(parts[3]), unquote(parts[5])):
+            return self._send(204)
+        self._send(404, {'error': {'code': 404, 'message': 'No such object'}})
+
+    def _batch(self, body):
+        # multipart/mixed of "DELETE /storage/v1/b/<bucket>/o/<name>" requests, the
+        # only batched call the client makes
+        boundary = self.headers.get('Content-Type', '').split('boundary=')[-1].strip('"')
+        responses = []
+        for part in body.decode('utf-8').split(f'--{boundary}')[1:]:
+            if part.startswith('--'):
+                break
+            content_id = next((line.split(':', 1)[1].strip() for line in part.splitlines()
+                               if line.lower().startswith('content-id:')), '')
+            request_line = next((line for line in part.splitlines() if line.startswith('DELETE ')), None)
+            status = '400 Bad Request'
+            if request_line:
+                path_parts = urlparse(request_line.split()[1]).path.strip('/').split('/')
+                found = len(path_parts) == 6 and self.store.delete_object(unquote(path_parts[3]), unquote(path_parts[5]))
+                status = '204 No Content' if found else '404 Not Found'
+            content_id = content_id.replace('<', '<response-', 1)
+            responses.append(f'Content-Type: application/http\r\nContent-ID: {content_id}\r\n\r\n'
+                             f'HTTP/1.1 {status}\r\nContent-Length: 0\r\n\r\n')
+        reply_boundary = f'batch_{uuid.uuid4().hex}'
+        reply = ''.join(f'--{reply_boundary}\r\n{r}' for r in responses) + f'--{reply_boundary}--\r\n'
+        data = reply.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', f'multipart/mixed; boundary={reply_boundary}')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        url, query, parts = self._route()
+        body = self._read_body()
+        if parts == ['batch', 'storage', 'v1']:
+            return self._batch(body)
+        # /upload/storage/v1/b/<bucket>/o
+        if parts[:3] != ['upload', 'storage', 'v1'] or len(parts) != 6:
+            return self._send(404, {'error': {'code': 404, 'message': 'Not found'}})
+        bucket = unquote(parts[4])
+        upload_type = query.get('uploadType')
+        if upload_type == 'media':
+            metadata = self.store.put_object(bucket, query['name'], body, self.headers.get('Content-Type'))
+            return self._send(200, metadata)
+        if upload_type == 'resumable':
+            name = query.get('name') or json.loads(body or b'{}').get('name')
+            upload_id = uuid.uuid4().hex
+            with self.store.lock:
+                self.store.sessions[upload_id] = {
+                    'bucket': bucket,
+                    'name': name,
+                    'contentType': self.headers.get('X-Upload-Content-Type'),
+                    'buffer': bytearray(),
+                }
+            host = self.headers.get('Host')
+            location = f'http://{host}{url.path}?uploadType=resumable&upload_id={upload_id}'
+            return self._send(200, {}, {'Location': location})
+        self._send(400, {'error': {'code': 400, 'message': f'Unsupported uploadType {upload_type}'}})
+
+    def do_PUT(self):
+        url, query, parts = self._route()
+        body = self._read_body()
+        session = self.store.sessions.get(query.get('upload_id'))
+        if session is None:
+            return self._send(404, {'error': {'code': 404, 'message': 'No such upload session'}})
+
+        # "bytes <start>-<end>/<total>" or "bytes */<total>" (status query / final empty chunk)
+        content_range = self.headers.get('Content-Range', '').replace('bytes ', '')
+        byte_range, total = content_range.split('/')
+        buffer = session['buffer']
+
+        if byte_range != '*':
+            with self.store.lock:
+                self.store.chunk_puts += 1
+                fail = self.store.fail_every_n_chunks and self.store.chunk_puts % self.store.fail_every_n_chunks == 0
+                cut = self.store.cut_every_n_chunks and self.store.chunk_puts % self.store.cut_every_n_chunks == 0
+            if fail:
+                return self._send(503, {'error': {'code': 503, 'message': 'Injected failure'}})
+            start = int(byte_range.split('-')[0])
+            if start != len(buffer):
+                # Client is out of sync; tell it what we have
+                return self._send(308, None, self._range_header(buffer))
+            if cut:
+                buffer.extend(body[:len(body) // 2])
+                self.close_connection = True
+                return
+            buffer.extend(body)
+
+        if total != '*' and len(buffer) >= int(total):
+            metadata = self.store.put_object(session['bucket'], session['name'], buffer, session['contentType'])
+            with self.store.lock:
+                self.store.sessions.pop(query['upload_id'], None)
+            return self._send(200, metadata)
+        self._send(308, None, self._range_header(buffer))
+
+    def _range_header(self, buffer):
+        return {'Range': f'bytes=0-{len(buffer) - 1}'} if buffer else {}
+
+
+class FakeGcsServer:
+    def __init__(self, host='127.0.0.1', port=0, store=None):
+        self.httpd = ThreadingHTTPServer((host, port), FakeGcsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.store = store or FakeBucketStore()
+        self.thread = None
+
+    @property
+    def store(self):
+        return self.httpd.store
+
+    @property
+    def endpoint(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for Google Cloud Storage uploads')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4443)
+    parser.add_argument('--fail-every', type=int, default=0, help='fail every Nth resumable chunk with a 503')
+    parser.add_argument('--cut-every', type=int, default=0,
+                        help='drop the connection halfway through every Nth resumable chunk')
+    parser.add_argument('--latency-ms', type=float, default=0, help='added delay per request')
+    args = parser.parse_args()
+
+    server = FakeGcsServer(args.host, args.port)
+    server.store.fail_every_n_chunks = args.fail_every
+    server.store.cut_every_n_chunks = args.cut_every
+    server.store.latency = args.latency_ms / 1000
+    print(f'Fake GCS listening on {server.endpoint}')
+    server.httpd.serve_forever()
@@ -0,0 +1,98 @@
+import argparse
+import random
+import resource
+import statistics
+import time
+
+from search_index import SearchIndex
+
+# Query latency of the client-side search index over a synthetic catalog.
+#
+#   python -m benchmarks.search_index_bench --tracks 1000000
+
+LETTERS = 'eeeeeaaaaiiiooouunnnrrrsssttllcdmhgbpkywfvjxz'
+VOCABULARY_SIZE = 50_000
+
+
+def vocabulary(rng):
+    return [''.join(rng.choice(LETTERS) for _ in range(rng.randint(3, 9))).capitalize()
+            for _ in range(VOCABULARY_SIZE)]
+
+
+def word(rng, words):
+    # Roughly Zipfian: a few words are very common, most are rare
+    return words[min(int(rng.paretovariate(1.1)) - 1, len(words) - 1)] if rng.random() < 0.5 else rng.choice(words)
+
+
+def synthetic_catalog(count, seed=551):
+    rng = random.Random(seed)
+    words = vocabulary(rng)
+    artists = [' '.join(word(rng, words) for _ in range(rng.randint(1, 2))) for _ in range(max(count // 20, 1))]
+    for i in range(count):
+        yield {
+            'audio_id': f'{i:032x}',
+            'artistName': rng.choice(artists),
+            'trackName': ' '.join(word(rng, words) for _ in range(rng.randint(1, 4))),
+            'fileUrl': f'https://storage.googleapis.com/bench/{i}.wav',
+        }
+
+
+def typo(text, rng):
+    if len(text) < 4:
+        return text
+    i = rng.randrange(1, len(text) - 1)
+    return text[:i] + rng.choice('aeiouxyz') + text[i + 1:]
+
+
+def max_rss_mb():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search index query latency benchmark')
+    parser.add_argument('--tracks', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=500)
+    args = parser.parse_args()
+
+    rss_before = max_rss_mb()
+    index = SearchIndex()
+    start = time.perf_counter()
+    sample = []
+    rng = random.Random(7)
+    batch = []
+    for record in synthetic_catalog(args.tracks):
+        batch.append(record)
+        if len(batch) == 10000:
+            index.add(batch)
+            sample.extend(rng.sample(batch, 5))
+            batch = []
+    index.add(batch)
+    sample.extend(batch[:5])
+    build_seconds = time.perf_counter() - start
+    print(f'built index of {len(index):,} tracks in {build_seconds:.1f}s '
+          f'({len(index) / build_seconds:,.0f} tracks/s), ~{max_rss_mb() - rss_before:,.0f} MB resident')
+
+    kinds = {
+        'prefix': lambda r: (r['artistName'][:rng.randint(2, 5)], ''),
+        'exact': lambda r: ('', r['trackName']),
+        'typo': lambda r: (typo(r['artistName'], rng), typo(r['trackName'], rng)),
+    }
+    for kind, make_query in kinds.items():
+        latencies = []
+        found = 0
+        for _ in range(args.queries):
+            record = rng.choice(sample)
+            artist_name, track_name = make_query(record)
+            t = time.perf_counter()
+            results = index.search(artist_name, track_name, limit=20)
+            latencies.append((time.perf_counter() - t) * 1000)
+            found += any(r['audio_id'] == record['audio_id'] for r in results)
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        print(f'{kind:>7}: p50 {statistics.median(latencies):7.2f} ms  p95 {p95:7.2f} ms  '
+              f'target in top 20: {found / args.queries:.0%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# Cold-start benchmark for api_calls. Each sample runs in a fresh interpreter so
+# nothing is already in sys.modules:
+#   lazy  - `import api_calls` as a read-only page does it now
+#   eager - import plus building the storage client, i.e. what every page paid
+#           at import before GCS setup became lazy
+#
+#   python -m benchmarks.startup_bench --runs 10
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    'lazy': 'import api_calls',
+    'eager': 'import api_calls; api_calls.get_storage_client()',
+    'eager+pandas': 'import api_calls; api_calls.get_storage_client(); import pandas',
+}
+
+TIMER = '''
+import time
+start = time.perf_counter()
+{statement}
+print(time.perf_counter() - start)
+'''
+
+
+def time_cold_import(statement):
+    output = subprocess.run(
+        [sys.executable, '-c', TIMER.format(statement=statement)],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+    )
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold-start import benchmark for api_calls')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    results = {}
+    for name, statement in SCENARIOS.items():
+        try:
+            samples = [time_cold_import(statement) for _ in range(args.runs)]
+        except subprocess.CalledProcessError as e:
+            print(f'{name:>14}: failed ({e.stderr.strip().splitlines()[-1]})')
+            continue
+        results[name] = statistics.median(samples)
+        print(f'{name:>14}: median {results[name] * 1000:8.1f} ms  (min {min(samples) * 1000:.1f} ms over {args.runs} runs)')
+
+    if 'lazy' in results and 'eager' in results:
+        print(f'cold start saved by lazy GCS setup: {(results["eager"] - results["lazy"]) * 1000:.1f} ms '
+              f'({results["eager"] / results["lazy"]:.1f}x faster)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,406 @@
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Local stand-in for the middleware API (/api/audio/* and /api/login, /api/register)
+# backed by an in-memory catalog, so the client can be exercised without the
+# production Railway host. Run it with `python -m benchmarks.stub_server --port 5001`
+# and point JAARVIS_API_BASE_URL at http://127.0.0.1:5001
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Like a typical middleware setup: list/search answers carry an ETag and are
+# answered 304 when it matches If-None-Match, and JSON bodies of at least this
+# many bytes are compressed for clients that accept it
+COMPRESS_MIN_BYTES = 1024
+
+
+def hash_function(artist_name, track_name):
+    # Same placement rule as the middleware: sum the ASCII values of the first/last
+    # initials of artist and track name, even -> collection 0, odd -> collection 1
+    def initials(name):
+        words = (name or '').split()
+        if not words:
+            return ''
+        return words[0][0] + words[-1][0]
+
+    total = sum(ord(c) for c in initials(artist_name) + initials(track_name))
+    return total % 2
+
+
+class StubCatalog:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = {}
+        self.users = {}
+        self.clock = datetime(2024, 1, 1)
+
+    def _next_timestamp(self):
+        self.clock += timedelta(seconds=1)
+        return self.clock.isoformat()
+
+    def add(self, artist_name, track_name, file_url):
+        with self.lock:
+            record = {
+                '_id': uuid.uuid4().hex[:24],
+                'audio_id': uuid.uuid4().hex,
+                'artistName': artist_name,
+                'trackName': track_name,
+                'fileUrl': file_url,
+                'collection_tag': hash_function(artist_name, track_name),
+                'created_at': self._next_timestamp(),
+            }
+            self.records[record['audio_id']] = record
+            return dict(record)
+
+    def seed(self, count):
+        for i in range(count):
+            self.add(f'Artist {i % 97}', f'Track {i}', f'https://storage.googleapis.com/stub/{i}.wav')
+
+    def list(self, page, limit, sort_by, order):
+        with self.lock:
+            records = sorted(self.records.values(), key=lambda r: r.get(sort_by) or '', reverse=order == 'desc')
+        start = (page - 1) * limit
+        return [dict(r) for r in records[start:start + limit]]
+
+    def search(self, artist_name, track_name):
+        with self.lock:
+            records = list(self.records.values())
+        results = []
+        for r in records:
+            if artist_name and artist_name.lower() not in r['artistName'].lower():
+                continue
+            if track_name and track_name.lower() not in r['trackName'].lower():
+                continue
+            results.append(dict(r))
+        return results
+
+    def edit(self, audio_id, fields):
+        with self.lock:
+            record = self.records.get(audio_id)
+            if record is None:
+                return False
+            record.update(fields)
+            record['collection_tag'] = hash_function(record['artistName'], record['trackName'])
+            return True
+
+    def delete(self, audio_id):
+        with self.lock:
+            return self.records.pop(audio_id, None) is not None
+
+    def collection_of(self, audio_id):
+        with self.lock:
+            record = self.records.get(audio_id)
+            return None if record is None else record['collection_tag']
+
+
+class CollectionContention:
+    # Models the middleware's per-collection write locks: writes (upload, edit,
+    # delete) to one collection take latency[tag] seconds each, and with
+    # `capacity` set at most that many run at once per collection; the rest wait.
+    def __init__(self, latency=(), capacity=0):
+        self.latency = tuple(latency)
+        self.capacity = capacity
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, tag):
+        if tag is None or not (self.capacity or self.latency):
+            yield
+            return
+        delay = self.latency[tag] if tag < len(self.latency) else 0.0
+        slots = None
+        if self.capacity:
+            with self._lock:
+                slots = self._slots.setdefault(tag, threading.Semaphore(self.capacity))
+            slots.acquire()
+        try:
+            if delay > 0:
+                time.sleep(delay)
+            yield
+        finally:
+            if slots is not None:
+                slots.release()
+
+
+class FaultInjector:
+    # Makes the stand-in behave like a slow or flaky server: every request to a
+    # path under one of `prefixes` waits latency +/- jitter seconds, and a
+    # fraction `error_rate` of them is answered with `error_status` instead.
+    # With `capacity` set, at most that many requests are worked on at once and
+    # the rest wait their turn, so latency grows with load like a real backend;
+    # beyond `queue_limit` waiting requests, new ones are shed with error_status.
+    # Seeded, so a benchmark run sees the same faults every time.
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503,
+                 prefixes=('/api/audio/', '/api/login'), seed=551, capacity=0, queue_limit=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.prefixes = tuple(prefixes)
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.injected_errors = 0
+        self.capacity = capacity
+        self.queue_limit = queue_limit
+        self.waiting = 0
+        self.shed = 0
+        self._slots = threading.Semaphore(capacity) if capacity else None
+
+    def applies_to(self, path):
+        return path.startswith(self.prefixes)
+
+    def apply(self, path):
+        # Returns the status to fail this request with, or None to serve it
+        if not self.applies_to(path):
+            return None
+        with self.lock:
+            delay = self.latency + (self.rng.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+            fail = self.error_rate and self.rng.random() < self.error_rate
+            if fail:
+                self.injected_errors += 1
+            elif self._slots is not None and self.queue_limit and self.waiting >= self.queue_limit:
+                self.shed += 1
+                return self.error_status
+            if self._slots is not None:
+                self.waiting += 1
+        if self._slots is None:
+            if delay > 0:
+                time.sleep(delay)
+            return self.error_status if fail else None
+        with self._slots:
+            with self.lock:
+                self.waiting -= 1
+            if delay > 0:
+                time.sleep(delay)
+        return self.error_status if fail else None
+
+
+class StubApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this, Nagle plus delayed
+    # ACKs adds ~40ms to every keep-alive request
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def catalog(self):
+        return self.server.catalog
+
+    def _faulted(self):
+        status = self.server.faults.apply(urlparse(self.path).path)
+        if status is None:
+            return False
+        # Drain the body so the keep-alive connection stays usable
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self._send_json(status, {'success': False, 'message': 'Injected failure'})
+        return True
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length))
+
+    def _response_encoding(self, size):
+        if not self.server.compression or size < COMPRESS_MIN_BYTES:
+            return None
+        accepted = {part.split(';')[0].strip().lower() for part in (self.headers.get('Accept-Encoding') or '').split(',')}
+        if 'br' in accepted and brotli is not None:
+            return 'br'
+        if 'gzip' in accepted:
+            return 'gzip'
+        return None
+
+    def _send_json(self, status, payload, etag=False):
+        body = json.dumps(payload).encode('utf-8')
+        tag = None
+        if etag and status == 200 and self.server.conditional:
+            tag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+            if tag in [t.strip() for t in (self.headers.get('If-None-Match') or '').split(',')]:
+                self.send_response(304)
+                self.send_header('ETag', tag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        encoding = self._response_encoding(len(body))
+        if encoding == 'br':
+            body = brotli.compress(body, quality=5)
+        elif encoding == 'gzip':
+            body = gzip.compress(body, compresslevel=6)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if tag is not None:
+            self.send_header('ETag', tag)
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        if self.server.compression:
+            self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self._faulted():
+            return
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path == '/api/audio/list':
+            data = self.catalog.list(
+                int(query.get('page', 1)),
+                int(query.get('limit', 10)),
+                query.get('sort_by', 'created_at'),
+                query.get('order', 'desc'),
+            )
+            self._send_json(200, {'success': True, 'data': data}, etag=True)
+        elif url.path == '/api/audio/search':
+            data = self.catalog.search(query.get('artistName', ''), query.get('trackName', ''))
+            self._send_json(200, {'success': True, 'data': data}, etag=True)
+        else:
+            self._send_json(404, {'success': False, 'message': 'Not found'})
+
+    def do_POST(self):
+        if self._faulted():
+            return
+        path = urlparse(self.path).path
+        payload = self._read_json()
+        if path == '/api/audio/upload':
+            with self.server.contention.hold(hash_function(payload.get('artistName'), payload.get('trackName'))):
+                record = self.catalog.add(payload.get('artistName'), payload.get('trackName'), payload.get('fileUrl'))
+            self._send_json(201, {'success': True, 'data': record})
+        elif path == '/api/register':
+            if payload.get('username') in self.catalog.users:
+                self._send_json(400, {'success': False, 'message': 'Username already exists'})
+            else:
+                self.catalog.users[payload.get('username')] = payload.get('password')
+                self._send_json(201, {'success': True, 'message': 'User registered'})
+        elif path == '/api/login':
+            if self.catalog.users.get(payload.get('username')) == payload.get('password'):
+                self._send_json(200, {'success': True, 'message': 'Logged in'})
+            else:
+                self._send_json(401, {'success': False, 'message': 'Invalid credentials'})
+        else:
+            self._send_json(404, {'success': False, 'message': 'Not found'})
+
+    def do_PUT(self):
+        if self._faulted():
+            return
+        path = urlparse(self.path).path
+        payload = self._read_json()
+        if path.startswith('/api/audio/edit/'):
+            audio_id = path.rsplit('/', 1)[-1]
+            with self.server.contention.hold(self.catalog.collection_of(audio_id)):
+                edited = self.catalog.edit(audio_id, payload)
+            if edited:
+                self._send_json(200, {'success': True, 'message': 'Audio file updated'})
+            else:
+                self._send_json(404, {'success': False, 'message': 'Audio file not found'})
+        else:
+            self._send_json(404, {'success': False, 'message': 'Not found'})
+
+    def do_DELETE(self):
+        if self._faulted():
+            return
+        path = urlparse(self.path).path
+        if path.startswith('/api/audio/delete/'):
+            audio_id = path.rsplit('/', 1)[-1]
+            with self.server.contention.hold(self.catalog.collection_of(audio_id)):
+                deleted = self.catalog.delete(audio_id)
+            if deleted:
+                self._send_json(200, {'success': True, 'message': 'Audio file deleted'})
+            else:
+                self._send_json(404, {'success': False, 'message': 'Audio file not found'})
+        else:
+            self._send_json(404, {'success': False, 'message': 'Not found'})
+
+
+class StubApiServer:
+    def __init__(self, host='127.0.0.1', port=0, catalog=None, faults=None, conditional=True, compression=True,
+                 contention=None):
+        self.httpd = ThreadingHTTPServer((host, port), StubApiHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.catalog = catalog or StubCatalog()
+        self.httpd.faults = faults or FaultInjector()
+        self.httpd.contention = contention or CollectionContention()
+        self.httpd.conditional = conditional
+        self.httpd.compression = compression
+        self.thread = None
+
+    @property
+    def catalog(self):
+        return self.httpd.catalog
+
+    @property
+    def faults(self):
+        return self.httpd.faults
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def parse_latencies(text):
+    # '5,40' -> (0.005, 0.04)
+    return tuple(float(ms) / 1000 for ms in text.split(',') if ms.strip())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the music streaming API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--seed', type=int, default=100, help='number of catalog entries to pre-populate')
+    parser.add_argument('--latency-ms', type=float, default=0, help='added delay per /api/audio/* and /api/login request')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='random +/- spread around --latency-ms')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of those requests that fail')
+    parser.add_argument('--error-status', type=int, default=503, help='status returned for injected failures')
+    parser.add_argument('--capacity', type=int, default=0, help='requests worked on at once; the rest queue (0: no limit)')
+    parser.add_argument('--queue-limit', type=int, default=0, help='queued requests beyond which new ones are shed')
+    parser.add_argument('--collection-latency-ms', default='',
+                        help='comma-separated write latency per collection, e.g. 5,40 for collections 0 and 1')
+    parser.add_argument('--collection-capacity', type=int, default=0,
+                        help='writes worked on at once per collection; the rest wait (0: no limit)')
+    parser.add_argument('--no-etag', dest='conditional', action='store_false',
+                        help='send no ETags and ignore If-None-Match')
+    parser.add_argument('--no-compression', dest='compression', action='store_false',
+                        help='never compress response bodies')
+    args = parser.parse_args()
+
+    faults = FaultInjector(args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate, args.error_status,
+                           capacity=args.capacity, queue_limit=args.queue_limit)
+    contention = CollectionContention(parse_latencies(args.collection_latency_ms), args.collection_capacity)
+    server = StubApiServer(args.host, args.port, faults=faults, conditional=args.conditional,
+                           compression=args.compression, contention=contention)
+    server.catalog.seed(args.seed)
+    print(f'Stub API listening on {server.base_url}')
+    server.httpd.serve_forever()
@@ -0,0 +1,61 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# Bytes on the wire before and after conditional GETs. Runs client_bench twice
+# against the same stand-ins: first as the client behaved before revalidation
+# (no If-None-Match; requests' own Accept-Encoding, so responses are gzipped in
+# both runs), then with the defaults.
+#
+#   python -m benchmarks.wire_bench
+#   python -m benchmarks.wire_bench --scenario browse revisit --ops 300 --latency-ms 20
+
+BEFORE_ENV = {'JAARVIS_CACHE_REVALIDATE': '0'}
+DEFAULT_SCENARIOS = ['browse', 'revisit', 'search', 'export', 'bulk_upload']
+
+
+def run_client_bench(args, extra_env, path):
+    env = dict(os.environ, **extra_env)
+    command = [sys.executable, '-m', 'benchmarks.client_bench', '--scenario', *args.scenario,
+               '--repeat', str(args.repeat), '--no-memory', '--ops', str(args.ops), '--catalog', str(args.catalog),
+               '--rows', str(args.rows), '--latency-ms', str(args.latency_ms), '--save', path]
+    subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['results']
+
+
+def change(before, after):
+    if not before:
+        return '-'
+    return f'{(after - before) / before:+.0%}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='API bytes on the wire with and without revalidation')
+    parser.add_argument('--scenario', nargs='+', default=DEFAULT_SCENARIOS, help='client_bench scenarios to run')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--ops', type=int, default=100)
+    parser.add_argument('--catalog', type=int, default=2000)
+    parser.add_argument('--rows', type=int, default=300)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='jaarvis-wire-')
+    before = run_client_bench(args, BEFORE_ENV, os.path.join(workdir, 'before.json'))
+    after = run_client_bench(args, {}, os.path.join(workdir, 'after.json'))
+
+    print(f"{'scenario':>12} {'reqs':>6} {'KB in before':>13} {'KB in after':>12} {'change':>7} "
+          f"{'KB out before':>14} {'KB out after':>13} {'change':>7} {'ops/s before':>13} {'ops/s after':>12}")
+    for name in args.scenario:
+        b, a = before[name], after[name]
+        print(f"{name:>12} {a['requests']:>6} {b['kb_received']:>13.1f} {a['kb_received']:>12.1f} "
+              f"{change(b['kb_received'], a['kb_received']):>7} {b['kb_sent']:>14.1f} {a['kb_sent']:>13.1f} "
+              f"{change(b['kb_sent'], a['kb_sent']):>7} {b['ops_per_second'] or 0:>13.1f} "
+              f"{a['ops_per_second'] or 0:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+
+from api_calls import BUCKET_NAME, fetch_audio_files, get_digest_index, get_gcs_session
+from catalog_export import iter_catalog_pages
+from catalog_mirror import catalog_references
+from gcs_upload import CHUNK_TIMEOUT, GCS_ENDPOINT
+from previews import blob_name_from_url
+
+# Blobs younger than this are never collected: uploads store the blob before the
+# track is registered, and registration may still be on its way. Age alone does
+# not make a blob unused (deduplicated uploads attach new records to old blobs),
+# so a blob is only deleted when two separate looks at the catalog both found
+# nothing pointing at it: the catalog is walked by page offset, and a delete or
+# upload during a walk shifts records between pages that walk then never sees.
+GC_MIN_AGE_HOURS = float(os.environ.get('JAARVIS_GC_MIN_AGE_HOURS', 24))
+# GCS accepts at most 100 calls per batch request
+GC_BATCH_SIZE = 100
+GC_DELETES_PER_SECOND = float(os.environ.get('JAARVIS_GC_DELETES_PER_SECOND', 50))
+GC_LIST_PAGE_SIZE = 1000
+GC_CATALOG_PAGE_SIZE = 100
+# Orphans listed by name in a dry-run report (counts and bytes cover all of them)
+GC_REPORT_LIMIT = 10_000
+
+
+class GcReport:
+    def __init__(self, dry_run):
+        self.dry_run = dry_run
+        self.catalog_records = 0
+        self.referenced = 0
+        self.scanned = 0
+        self.skipped_recent = 0
+        # Candidates the second catalog pass found a record for
+        self.kept_on_recheck = 0
+        self.orphans = []
+        self.orphan_count = 0
+        self.orphan_bytes = 0
+        self.deleted = 0
+        self.failed = []
+        self.elapsed = 0.0
+        self.started = time.perf_counter()
+
+    def add_orphan(self, item):
+        self.orphan_count += 1
+        self.orphan_bytes += int(item.get('size') or 0)
+        if len(self.orphans) < GC_REPORT_LIMIT:
+            self.orphans.append((item['name'], int(item.get('size') or 0), item.get('timeCreated')))
+
+
+class RateLimiter:
+    # Token bucket: acquire(n) blocks until n more operations fit in the rate
+    def __init__(self, per_second):
+        self.per_second = per_second
+        self.allowance = per_second
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, n=1):
+        if not self.per_second:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self.allowance = min(self.per_second, self.allowance + (now - self.last) * self.per_second)
+            self.last = now
+            self.allowance -= n
+            wait = -self.allowance / self.per_second if self.allowance < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+def derived_from(name):
+    # "<stem>.preview.json" / "<stem>.preview.<ext>" belong to the original "<stem>.*"
+    marker = name.rfind('.preview.')
+    return name[:marker] if marker != -1 else None
+
+
+def fetch_fresh(page, **kwargs):
+    # Catalog pages straight from the API, never from the response cache
+    return fetch_audio_files(page, fresh=True, **kwargs)
+
+
+def referenced_blobs(fetch=fetch_fresh, report=None):
+    # Every bucket blob the catalog points at, streamed page by page. Returns
+    # (blob names, stems of those names) - the stems keep preview objects alive.
+    names = set()
+    for records in iter_catalog_pages(GC_CATALOG_PAGE_SIZE, fetch=fetch):
+        for record in records:
+            name = blob_name_from_url(record.get('fileUrl'))
+            if name is not None:
+                names.add(name)
+        if report is not None:
+            report.catalog_records += len(records)
+    return names, {os.path.splitext(name)[0] for name in names}
+
+
+def list_blobs(session=None, bucket_name=BUCKET_NAME, prefix='', page_size=GC_LIST_PAGE_SIZE, endpoint=GCS_ENDPOINT):
+    # Yields the bucket listing one page (a list of object dicts) at a time
+    session = session or get_gcs_session()
+    params = {'maxResults': page_size, 'fields': 'items(name,size,timeCreated),nextPageToken'}
+    if prefix:
+        params['prefix'] = prefix
+    while True:
+        response = session.get(f"{endpoint.rstrip('/')}/storage/v1/b/{bucket_name}/o", params=params,
+                               timeout=CHUNK_TIMEOUT)
+        response.raise_for_status()
+        payload = response.json()
+        yield payload.get('items') or []
+        token = payload.get('nextPageToken')
+        if not token:
+            break
+        params['pageToken'] = token
+
+
+def batch_delete(names, session=None, bucket_name=BUCKET_NAME, endpoint=GCS_ENDPOINT):
+    # Deletes up to GC_BATCH_SIZE objects in one multipart/mixed batch request.
+    # Returns {name: HTTP status}; 404 means it was already gone.
+    session = session or get_gcs_session()
+    boundary = f'gc_{uuid.uuid4().hex}'
+    parts = []
+    for i, name in enumerate(names):
+        parts.append(
+            f'--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <{i}>\r\n\r\n'
+            f"DELETE /storage/v1/b/{bucket_name}/o/{quote(name, safe='')} HTTP/1.1\r\n\r\n"
+        )
+    body = ''.join(parts) + f'--{boundary}--\r\n'
+    response = session.post(f"{endpoint.rstrip('/')}/batch/storage/v1", data=body.encode('utf-8'),
+                            headers={'Content-Type': f'multipart/mixed; boundary={boundary}'},
+                            timeout=CHUNK_TIMEOUT)
+    response.raise_for_status()
+
+    statuses = {}
+    reply_boundary = response.headers.get('Content-Type', '').split('boundary=')[-1].strip('"')
+    for part in response.text.split(f'--{reply_boundary}'):
+        content_id = status = None
+        for line in part.splitlines():
+            if line.lower().startswith('content-id:'):
+                content_id = line.split(':', 1)[1].strip().strip('<>').replace('response-', '')
+            elif line.startswith('HTTP/') and status is None:
+                status = int(line.split()[1])
+        if content_id is not None and content_id.isdigit() and status is not None:
+            statuses[names[int(content_id)]] = status
+    return statuses
+
+
+def _forget(names):
+    # Content-addressed blobs are named by digest; drop them from the local digest
+    # index so a re-upload stores the audio again instead of pointing at nothing
+    index = get_digest_index()
+    for name in names:
+        if derived_from(name) is None:
+            index.discard(os.path.splitext(name)[0])
+
+
+def delete_blobs(names, report=None, limiter=None, session=None):
+    names = list(names)
+    for start in range(0, len(names), GC_BATCH_SIZE):
+        batch = names[start:start + GC_BATCH_SIZE]
+        if limiter is not None:
+            limiter.acquire(len(batch))
+        statuses = batch_delete(batch, session=session)
+        gone = [name for name in batch if statuses.get(name) in (200, 204, 404)]
+        _forget(gone)
+        if report is not None:
+            report.deleted += len(gone)
+            report.failed.extend((name, statuses.get(name)) for name in batch if name not in gone)
+
+
+def _unreferenced(name, names, stems):
+    owner = derived_from(name)
+    return name not in names and (owner is None or owner not in stems)
+
+
+def collect_orphans(dry_run=True, min_age_hours=GC_MIN_AGE_HOURS, deletes_per_second=GC_DELETES_PER_SECOND,
+                    fetch=fetch_fresh, progress=None):
+    # Compares the bucket against the catalog and deletes blobs nothing refers to:
+    # originals whose fileUrl is in no record (deleted tracks, replaced URLs) and
+    # previews of those. The catalog is read (names only), the bucket listing is
+    # streamed to collect candidates, and the catalog is read a second time; only
+    # candidates both passes missed are orphans, deleted in rate-limited batches.
+    # dry_run only reports.
+    report = GcReport(dry_run)
+    names, stems = referenced_blobs(fetch, report)
+    report.referenced = len(names)
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=min_age_hours)
+    session = get_gcs_session()
+    candidates = []
+
+    for items in list_blobs(session):
+        for item in items:
+            report.scanned += 1
+            if not _unreferenced(item['name'], names, stems):
+                continue
+            created = item.get('timeCreated')
+            if created and datetime.fromisoformat(created.replace('Z', '+00:00')) > cutoff:
+                report.skipped_recent += 1
+                continue
+            candidates.append({'name': item['name'], 'size': item.get('size'), 'timeCreated': created})
+        if progress:
+            progress(report)
+
+    if candidates:
+        names, stems = referenced_blobs(fetch)
+    limiter = RateLimiter(deletes_per_second)
+    pending = []
+    for item in candidates:
+        if not _unreferenced(item['name'], names, stems):
+            report.kept_on_recheck += 1
+            continue
+        report.add_orphan(item)
+        if not dry_run:
+            pending.append(item['name'])
+        if len(pending) >= GC_BATCH_SIZE:
+            delete_blobs(pending, report, limiter, session)
+            pending = []
+            if progress:
+                progress(report)
+    if pending:
+        delete_blobs(pending, report, limiter, session)
+    report.elapsed = time.perf_counter() - report.started
+    if progress:
+        progress(report)
+    return report
+
+
+def _seen_urls(file_urls, fetch):
+    # Those of file_urls found in one catalog walk, which stops once all are seen
+    seen = set()
+    for records in iter_catalog_pages(GC_CATALOG_PAGE_SIZE, fetch=fetch):
+        seen.update(record.get('fileUrl') for record in records if record.get('fileUrl') in file_urls)
+        if len(seen) == len(file_urls):
+            break
+    return seen
+
+
+def unreferenced_urls(file_urls, fetch=fetch_fresh):
+    # Those of file_urls no catalog record points at. Two looks must agree: the
+    # catalog mirror after a sync (or, with the mirror off, a first catalog walk),
+    # then an uncached catalog walk over what is left.
+    remaining = {url for url in file_urls if blob_name_from_url(url) is not None}
+    if not remaining:
+        return set()
+    referenced = catalog_references(remaining)
+    remaining -= referenced if referenced is not None else _seen_urls(remaining, fetch)
+    if remaining:
+        remaining -= _seen_urls(remaining, fetch)
+    return remaining
+
+
+def delete_unreferenced_blobs(file_urls, fetch=fetch_fresh):
+    # Deletes the blobs behind just-deleted tracks, and their previews, unless
+    # another record still points at them (content-addressed uploads share
+    # blobs). Checking many URLs costs the same catalog walks as checking one, so
+    # bulk deletes pass all of theirs at once. Returns the number of objects deleted.
+    session = get_gcs_session()
+    doomed = []
+    for file_url in sorted(unreferenced_urls(file_urls, fetch)):
+        name = blob_name_from_url(file_url)
+        doomed.append(name)
+        for items in list_blobs(session, prefix=f'{os.path.splitext(name)[0]}.preview.'):
+            doomed.extend(item['name'] for item in items)
+    if not doomed:
+        return 0
+    report = GcReport(dry_run=False)
+    delete_blobs(doomed, report, session=session)
+    return report.deleted
+
+
+def delete_unreferenced_blob(file_url, fetch=fetch_fresh):
+    return delete_unreferenced_blobs([file_url], fetch)
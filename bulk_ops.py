@@ -0,0 +1,256 @@
+import csv
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from api_calls import delete_audio_file, send_to_api, update_audio_file
+from bulk_planner import BULK_PLAN, COLLECTION_MAX_CONCURRENCY, plan_bulk
+from concurrency_limit import BULK_ADAPTIVE, AdaptiveLimiter
+
+# Rows are read this many at a time, so memory does not grow with the CSV size
+CHUNK_SIZE = 1000
+# Number of API calls in flight at once when adaptive concurrency is off
+# (JAARVIS_BULK_ADAPTIVE=0); otherwise concurrency_limit sets it as it goes
+MAX_WORKERS = 8
+# Planned runs keep up to this many rows read ahead, grouped by collection, so
+# a collection that is going slowly does not stop rows for the others being read
+PLAN_BUFFER_ROWS = 10 * CHUNK_SIZE
+
+
+def _value(row, column):
+    # Empty cells come through as '' and are treated as "not provided"
+    value = row.get(column, '')
+    return value if value != '' else None
+
+
+def upload_row(row):
+    track_info = {
+        'artist_name': row.get('artistName', ''),
+        'track_name': row.get('trackName', ''),
+        'file_url': row.get('fileUrl', '')
+    }
+    return send_to_api(track_info)
+
+
+def edit_row(row):
+    return update_audio_file(row.get('trackID', ''), _value(row, 'artistName'), _value(row, 'trackName'),
+                             _value(row, 'fileUrl'))
+
+
+def delete_row(row):
+    # An optional fileUrl column also deletes the stored audio, once for the whole
+    # run at the end (see run_bulk) rather than with a catalog check per row
+    return delete_audio_file(row.get('trackID', ''))
+
+
+# operation name -> (required columns, function applied to each row)
+OPERATIONS = {
+    'upload': (['artistName', 'trackName', 'fileUrl'], upload_row),
+    'edit': (['trackID', 'artistName', 'trackName', 'fileUrl'], edit_row),
+    'delete': (['trackID'], delete_row),
+}
+
+
+class BulkReport:
+    def __init__(self, operation, columns):
+        self.operation = operation
+        self.columns = columns
+        self.processed = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self.limiter = None
+        # Planned runs: the bulk_planner.BulkPlan, with a limiter per collection
+        self.plan = None
+        # Approximate progress, from how far into the CSV the reader has got
+        self.fraction = 0.0
+        # Deletes: fileUrls of deleted rows, whose blobs are removed after the run
+        self.blob_urls = set()
+        self.blobs_deleted = 0
+        self.blob_error = None
+        # Failed rows are spilled to disk as they happen instead of kept in memory
+        self.failures_file = tempfile.NamedTemporaryFile('w+', newline='', suffix='.csv', delete=False)
+        self._writer = csv.writer(self.failures_file)
+        self._writer.writerow(['row'] + columns + ['error'])
+
+    @property
+    def limiters(self):
+        # Label -> limiter: one per collection for planned runs
+        if self.plan is not None:
+            return {str(collection): limiter for collection, limiter in self.plan.limiters.items()}
+        return {'all': self.limiter} if self.limiter is not None else {}
+
+    @property
+    def concurrency(self):
+        # Current limit on API calls in flight
+        limiters = self.limiters.values()
+        return sum(limiter.limit for limiter in limiters) if limiters else None
+
+    def collections(self):
+        # Per-collection rows, failures and throughput (planned runs only)
+        return self.plan.summary() if self.plan is not None else []
+
+    @property
+    def rows_per_second(self):
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    def record(self, row_number, row, error):
+        self.processed += 1
+        if error is None:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+            self._writer.writerow([row_number] + [row.get(c, '') for c in self.columns] + [error])
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        self.failures_file.flush()
+
+    def failures_csv(self):
+        with open(self.failures_file.name, 'rb') as f:
+            return f.read()
+
+    def close(self):
+        self.failures_file.close()
+        os.remove(self.failures_file.name)
+
+
+def read_rows(csv_file, chunk_size=CHUNK_SIZE):
+    # Yields (row_number, dict) pairs, reading the CSV one chunk at a time
+    import pandas as pd
+
+    row_number = 0
+    for chunk in pd.read_csv(csv_file, chunksize=chunk_size, dtype=str, keep_default_na=False):
+        for row in chunk.to_dict('records'):
+            row_number += 1
+            yield row_number, row
+
+
+def read_columns(csv_file):
+    import pandas as pd
+
+    columns = list(pd.read_csv(csv_file, nrows=0).columns)
+    csv_file.seek(0)
+    return columns
+
+
+def _outcome(future):
+    try:
+        result = future.result()
+    except Exception as e:
+        return str(e) or e.__class__.__name__
+    if not result:
+        return 'No response from API'
+    if not result.get('success'):
+        return result.get('message') or 'API reported failure'
+    return None
+
+
+def run_bulk(csv_file, operation, max_workers=MAX_WORKERS, chunk_size=CHUNK_SIZE, progress=None, limiter=None,
+             planned=None):
+    # Applies `operation` ('upload', 'edit' or 'delete') to every row of the CSV
+    # through a thread pool. Planned runs (the default unless a limiter is given;
+    # JAARVIS_BULK_PLAN=0 turns them off) group rows by target collection with a
+    # limiter each (bulk_planner.py); otherwise rows go in file order with as
+    # many calls in flight as `limiter` allows (adaptive by default, fixed at
+    # max_workers with JAARVIS_BULK_ADAPTIVE=0). `progress(report)` is called
+    # from the calling thread after each completed row. Raises ValueError when
+    # columns are missing.
+    required, fn = OPERATIONS[operation]
+    columns = read_columns(csv_file)
+    missing = [c for c in required if c not in columns]
+    if missing:
+        raise ValueError(f"Missing required column(s): {', '.join(missing)}")
+
+    if planned is None:
+        planned = BULK_PLAN and limiter is None
+    report = BulkReport(operation, required)
+    if planned:
+        report.plan = plan_bulk(operation, read_rows(csv_file, chunk_size) if operation != 'upload' else ())
+        csv_file.seek(0)
+    else:
+        if limiter is None:
+            if BULK_ADAPTIVE:
+                limiter = AdaptiveLimiter()
+            else:
+                limiter = AdaptiveLimiter(initial=max_workers, minimum=max_workers, maximum=max_workers,
+                                          adaptive=False)
+        report.limiter = limiter
+    total_bytes = csv_file.seek(0, os.SEEK_END) or 1
+    csv_file.seek(0)
+    in_flight = {}
+
+    def drain(futures):
+        for future in futures:
+            row_number, row, collection = in_flight.pop(future)
+            error = _outcome(future)
+            report.record(row_number, row, error)
+            if operation == 'delete' and error is None and _value(row, 'fileUrl'):
+                report.blob_urls.add(row['fileUrl'])
+            if collection is not None:
+                report.plan.finished(collection, error)
+            report.fraction = min(csv_file.tell() / total_bytes, 1.0)
+            if progress:
+                progress(report)
+
+    rows = read_rows(csv_file, chunk_size)
+    if not planned:
+        with ThreadPoolExecutor(max_workers=limiter.maximum) as pool:
+            for row_number, row in rows:
+                # Rows are only handed to the pool once the limiter has room, so
+                # nothing queues behind the calls in flight
+                while not limiter.try_acquire():
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    drain(done)
+                in_flight[pool.submit(limiter.call, fn, row)] = (row_number, row, None)
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                drain(done)
+    else:
+        plan = report.plan
+        queues = {}
+        queued = 0
+        exhausted = False
+        # Threads are started on demand, so this only bounds the worst case of
+        # every collection at its ceiling
+        with ThreadPoolExecutor(max_workers=COLLECTION_MAX_CONCURRENCY * 4) as pool:
+            while True:
+                # Read ahead while under a chunk, or while some collection has
+                # run dry, up to PLAN_BUFFER_ROWS
+                while not exhausted and (queued < chunk_size or (
+                        queued < PLAN_BUFFER_ROWS and any(not queue for queue in queues.values()))):
+                    item = next(rows, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    collection = plan.collection(item[1])
+                    queues.setdefault(collection, deque()).append(item)
+                    plan.limiter(collection)
+                    queued += 1
+                for collection, queue in queues.items():
+                    collection_limiter = plan.limiter(collection)
+                    while queue and collection_limiter.try_acquire():
+                        row_number, row = queue.popleft()
+                        queued -= 1
+                        plan.started(collection)
+                        in_flight[pool.submit(collection_limiter.call, fn, row)] = (row_number, row, collection)
+                if not in_flight:
+                    if exhausted and not queued:
+                        break
+                    continue
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                drain(done)
+
+    if report.blob_urls:
+        from blob_gc import delete_unreferenced_blobs
+        try:
+            report.blobs_deleted = delete_unreferenced_blobs(report.blob_urls)
+        except Exception as e:
+            report.blob_error = str(e) or e.__class__.__name__
+            print(f"Could not delete blobs after bulk delete: {e}")
+    report.fraction = 1.0
+    report.finish()
+    return report
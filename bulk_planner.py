@@ -0,0 +1,158 @@
+import os
+import time
+
+from catalog_export import iter_catalog_pages
+from catalog_mirror import MIRROR_ENABLED, get_mirror
+from concurrency_limit import BULK_ADAPTIVE, BULK_INITIAL_CONCURRENCY, BULK_MIN_CONCURRENCY, AdaptiveLimiter
+
+# The middleware stores each track in one of two MongoDB collections picked by
+# hash_function below, and writes to one collection contend for its locks. Bulk
+# CSV rows are therefore grouped by the collection they touch and each group
+# gets its own concurrency limit, so a slow or locked collection backs off on
+# its own instead of dragging the other one down with it.
+BULK_PLAN = os.environ.get('JAARVIS_BULK_PLAN', '1') == '1'
+# Per-collection limit: the adaptive ceiling, or the fixed value with
+# JAARVIS_BULK_ADAPTIVE=0
+COLLECTION_MAX_CONCURRENCY = int(os.environ.get('JAARVIS_BULK_COLLECTION_MAX_CONCURRENCY', 16))
+COLLECTION_FIXED_CONCURRENCY = int(os.environ.get('JAARVIS_BULK_COLLECTION_CONCURRENCY', 4))
+# Edits and deletes need each track's current collection_tag. Without the
+# catalog mirror it takes a catalog scan, which only pays off for larger files;
+# smaller ones run as a single group. The scan stops after PLAN_SCAN_MAX_PAGES
+# pages, so a trackID that is not in the catalog does not cost a walk of all of
+# it; rows not found by then run in the unknown group.
+PLAN_SCAN_MIN_ROWS = int(os.environ.get('JAARVIS_BULK_PLAN_SCAN_MIN_ROWS', 200))
+PLAN_SCAN_MAX_PAGES = int(os.environ.get('JAARVIS_BULK_PLAN_SCAN_MAX_PAGES', 50))
+PLAN_SCAN_PAGE_SIZE = 100
+# Group label for rows whose collection could not be determined
+UNKNOWN = 'unknown'
+
+
+def hash_function(artist_name, track_name):
+    # Client-side copy of the middleware's placement rule: sum the ASCII values
+    # of the first/last initials of artist and track name, even -> collection 0,
+    # odd -> collection 1
+    def initials(name):
+        words = (name or '').split()
+        if not words:
+            return ''
+        return words[0][0] + words[-1][0]
+
+    total = sum(ord(c) for c in initials(artist_name) + initials(track_name))
+    return total % 2
+
+
+def collection_tags(audio_ids, scan=True):
+    # audio_id -> collection_tag for as many of audio_ids as can be found: from
+    # the catalog mirror when it is enabled, otherwise (with scan) from one
+    # streamed catalog walk that stops once every id has been seen or after
+    # PLAN_SCAN_MAX_PAGES pages
+    wanted = set(audio_ids)
+    if not wanted:
+        return {}
+    if MIRROR_ENABLED:
+        mirror = get_mirror()
+        try:
+            mirror.maybe_sync()
+        except Exception as e:
+            print(f"Catalog mirror sync failed, planning from local copy: {e}")
+        return mirror.collection_tags(wanted)
+    found = {}
+    if not scan:
+        return found
+    try:
+        for page, records in enumerate(iter_catalog_pages(PLAN_SCAN_PAGE_SIZE), 1):
+            for record in records:
+                if record.get('audio_id') in wanted:
+                    found[record['audio_id']] = record.get('collection_tag')
+            if len(found) == len(wanted):
+                break
+            if page >= PLAN_SCAN_MAX_PAGES:
+                print(f"Bulk planning scan stopped after {page} pages; "
+                      f"{len(wanted) - len(found)} rows run in the unknown group")
+                break
+    except RuntimeError as e:
+        # Planning is an optimisation; rows not found run in the unknown group
+        print(f"Catalog scan for bulk planning failed: {e}")
+    return found
+
+
+class CollectionStats:
+    def __init__(self):
+        self.processed = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.first_started = None
+        self.last_finished = None
+
+    @property
+    def elapsed(self):
+        if self.first_started is None or self.last_finished is None:
+            return 0.0
+        return self.last_finished - self.first_started
+
+    @property
+    def rows_per_second(self):
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+
+class BulkPlan:
+    # Which collection each row of one bulk run touches, and a limiter per
+    # collection created as rows for it show up
+    def __init__(self, operation, tags=None):
+        self.operation = operation
+        self.tags = tags or {}
+        self.limiters = {}
+        self.stats = {}
+
+    def collection(self, row):
+        if self.operation == 'upload':
+            return hash_function(row.get('artistName', ''), row.get('trackName', ''))
+        tag = self.tags.get(row.get('trackID', ''))
+        return UNKNOWN if tag is None else tag
+
+    def limiter(self, collection):
+        limiter = self.limiters.get(collection)
+        if limiter is None:
+            if BULK_ADAPTIVE:
+                limiter = AdaptiveLimiter(initial=min(BULK_INITIAL_CONCURRENCY, COLLECTION_MAX_CONCURRENCY),
+                                          minimum=BULK_MIN_CONCURRENCY, maximum=COLLECTION_MAX_CONCURRENCY)
+            else:
+                limiter = AdaptiveLimiter(initial=COLLECTION_FIXED_CONCURRENCY, minimum=COLLECTION_FIXED_CONCURRENCY,
+                                          maximum=COLLECTION_FIXED_CONCURRENCY, adaptive=False)
+            self.limiters[collection] = limiter
+            self.stats[collection] = CollectionStats()
+        return limiter
+
+    def started(self, collection):
+        stats = self.stats[collection]
+        if stats.first_started is None:
+            stats.first_started = time.perf_counter()
+
+    def finished(self, collection, error):
+        stats = self.stats[collection]
+        stats.processed += 1
+        if error is None:
+            stats.succeeded += 1
+        else:
+            stats.failed += 1
+        stats.last_finished = time.perf_counter()
+
+    def summary(self):
+        # One row per collection, for the report
+        return [{
+            'collection': str(collection),
+            'rows': stats.processed,
+            'failed': stats.failed,
+            'seconds': round(stats.elapsed, 2),
+            'rows_per_second': round(stats.rows_per_second, 1),
+            'limit': self.limiters[collection].limit,
+        } for collection, stats in sorted(self.stats.items(), key=lambda item: str(item[0]))]
+
+
+def plan_bulk(operation, rows):
+    # rows: (row_number, row) pairs of the whole CSV, only read for edits and
+    # deletes to collect their trackIDs
+    if operation == 'upload':
+        return BulkPlan(operation)
+    audio_ids = {row.get('trackID', '') for _, row in rows} - {''}
+    return BulkPlan(operation, collection_tags(audio_ids, scan=len(audio_ids) >= PLAN_SCAN_MIN_ROWS))
@@ -0,0 +1,157 @@
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib.util import find_spec
+
+from api_calls import fetch_audio_files
+from columnar import COLUMN_NAMES, arrow_schema
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+EXPORT_PAGE_SIZE = 100
+# Pages requested ahead of the one being written
+EXPORT_CONCURRENCY = 4
+# Parquet rows are buffered into row groups of this size
+PARQUET_ROW_GROUP = 10_000
+# Exports larger than this are not offered as a download on the management
+# page, since Streamlit holds a download's whole body in memory
+EXPORT_DOWNLOAD_MAX_BYTES = int(os.environ.get('JAARVIS_EXPORT_DOWNLOAD_MAX_MB', 100)) * 1024 * 1024
+
+
+def peak_rss():
+    # High-water mark of this process's resident memory in bytes, or None where
+    # the resource module is missing. ru_maxrss is KiB on Linux, bytes on macOS.
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class ExportStats:
+    def __init__(self):
+        self.rows = 0
+        self.pages = 0
+        self.elapsed = 0.0
+        # Process peak RSS after the export, and how much the export raised it
+        # (0 when the process had already peaked higher before it started)
+        self.peak_rss = None
+        self.rss_growth = None
+        self.started = time.perf_counter()
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+class CsvSink:
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(COLUMN_NAMES.values())
+
+    def write(self, records):
+        self.writer.writerows([record.get(field) for field in COLUMN_NAMES] for record in records)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSink:
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = arrow_schema(pa)
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.buffer = []
+
+    def write(self, records):
+        self.buffer.extend(records)
+        if len(self.buffer) >= PARQUET_ROW_GROUP:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        columns = {
+            name: [record.get(field) for record in self.buffer]
+            for field, name in COLUMN_NAMES.items()
+        }
+        try:
+            table = self.pa.table(columns, schema=self.schema)
+        except (self.pa.ArrowInvalid, self.pa.ArrowTypeError, OverflowError) as e:
+            # A Parquet file has one schema, so unlike FrameBuilder this cannot
+            # switch types part way through; CSV keeps the values as they are
+            raise ValueError(f'Catalog values do not fit the Parquet schema ({e}); export as CSV instead') from e
+        self.writer.write_table(table)
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+SINKS = {'csv': CsvSink, 'parquet': ParquetSink}
+
+
+def export_formats():
+    # The formats export_catalog can write here: Parquet needs pyarrow, which is
+    # optional. find_spec checks without paying for the import.
+    return [fmt for fmt in SINKS if fmt != 'parquet' or find_spec('pyarrow') is not None]
+
+
+def iter_catalog_pages(page_size=EXPORT_PAGE_SIZE, concurrency=EXPORT_CONCURRENCY, fetch=fetch_audio_files):
+    # Yields every catalog page (a list of records) in created_at order, oldest
+    # first, keeping `concurrency` requests in flight; at most that many pages are
+    # held in memory. Uploads made during the walk land after what was yielded.
+    def load(page):
+        result = fetch(page, sort_by='created_at', order='asc', limit=page_size)
+        if result is None:
+            raise RuntimeError(f'Failed to fetch catalog page {page}')
+        return result.get('data') or []
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        in_flight = [pool.submit(load, page) for page in range(1, concurrency + 1)]
+        next_page = concurrency + 1
+        try:
+            while in_flight:
+                records = in_flight.pop(0).result()
+                yield records
+                if len(records) < page_size:
+                    # Last page; anything requested beyond it is empty
+                    break
+                in_flight.append(pool.submit(load, next_page))
+                next_page += 1
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+
+def export_catalog(path, fmt='csv', page_size=EXPORT_PAGE_SIZE, concurrency=EXPORT_CONCURRENCY,
+                   fetch=fetch_audio_files, progress=None):
+    # Streams every catalog page into a CSV or Parquet file at `path`, page by page
+    # in catalog order (see iter_catalog_pages)
+    stats = ExportStats()
+    rss_before = peak_rss()
+    sink = SINKS[fmt](path)
+
+    try:
+        for records in iter_catalog_pages(page_size, concurrency, fetch):
+            sink.write(records)
+            stats.rows += len(records)
+            stats.pages += 1
+            if progress:
+                progress(stats)
+    finally:
+        sink.close()
+        stats.elapsed = time.perf_counter() - stats.started
+        stats.peak_rss = peak_rss()
+        if stats.peak_rss is not None:
+            stats.rss_growth = stats.peak_rss - rss_before
+    return stats
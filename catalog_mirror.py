@@ -0,0 +1,321 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from api_calls import add_mutation_listener, fetch_audio_frame, fetch_audio_files
+from columnar import FrameBuilder
+
+# The mirror is opt-in: set JAARVIS_CATALOG_MIRROR=1 to serve catalog reads locally
+MIRROR_ENABLED = os.environ.get('JAARVIS_CATALOG_MIRROR') == '1'
+MIRROR_PATH = os.environ.get('JAARVIS_MIRROR_PATH', './catalog_mirror.sqlite3')
+# Page size used while walking the API during a sync
+SYNC_PAGE_SIZE = 100
+# How often reads trigger a delta sync, and how often a full resync picks up
+# edits and deletes made by other clients
+DELTA_SYNC_INTERVAL = float(os.environ.get('JAARVIS_MIRROR_DELTA_INTERVAL', 30))
+FULL_SYNC_INTERVAL = float(os.environ.get('JAARVIS_MIRROR_FULL_INTERVAL', 6 * 3600))
+
+COLUMNS = ['audio_id', '_id', 'artistName', 'trackName', 'fileUrl', 'collection_tag', 'created_at']
+SORTABLE = {'created_at': 'created_ts', 'artistName': 'artistName', 'trackName': 'trackName'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    audio_id TEXT PRIMARY KEY,
+    _id TEXT,
+    artistName TEXT,
+    trackName TEXT,
+    fileUrl TEXT,
+    collection_tag INTEGER,
+    created_at TEXT,
+    created_ts REAL
+);
+CREATE INDEX IF NOT EXISTS tracks_created ON tracks (created_ts, audio_id);
+CREATE INDEX IF NOT EXISTS tracks_artist ON tracks (artistName, audio_id);
+CREATE INDEX IF NOT EXISTS tracks_track ON tracks (trackName, audio_id);
+CREATE INDEX IF NOT EXISTS tracks_url ON tracks (fileUrl);
+CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value);
+"""
+
+
+def created_timestamp(value):
+    # created_at arrives either ISO-8601 or as an HTTP date (Flask's datetime
+    # encoding); normalise to epoch seconds so it sorts and compares correctly
+    if not value:
+        return 0.0
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        try:
+            parsed = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return 0.0
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _row(record):
+    return tuple(record.get(c) for c in COLUMNS) + (created_timestamp(record.get('created_at')),)
+
+
+class CatalogMirror:
+    # SQLite copy of the catalog. The first sync walks every page; later syncs
+    # only pull records newer than the stored created_at cursor, using the API's
+    # created_at ordering. Uploads, edits and deletes made through api_calls are
+    # applied locally as they happen.
+
+    def __init__(self, path=MIRROR_PATH, page_size=SYNC_PAGE_SIZE):
+        self.path = path
+        self.page_size = page_size
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.last_delta_sync = 0.0
+
+    def _state(self, key, default=None):
+        with self._lock:
+            row = self._db.execute('SELECT value FROM sync_state WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_state(self, key, value):
+        self._db.execute('INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)', (key, value))
+
+    @property
+    def cursor(self):
+        return self._state('cursor')
+
+    @property
+    def last_full_sync(self):
+        return self._state('last_full_sync', 0.0)
+
+    def count(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM tracks').fetchone()[0]
+
+    def _upsert(self, records):
+        placeholders = ', '.join('?' * (len(COLUMNS) + 1))
+        self._db.executemany(
+            f'INSERT OR REPLACE INTO tracks ({", ".join(COLUMNS)}, created_ts) VALUES ({placeholders})',
+            [_row(r) for r in records if r.get('audio_id')],
+        )
+
+    def full_sync(self):
+        # Pages are staged in a side table and swapped in at the end, so readers
+        # keep seeing the old copy until the new one is complete
+        with self._sync_lock:
+            with self._lock:
+                self._db.execute('DROP TABLE IF EXISTS tracks_sync')
+                self._db.execute('CREATE TABLE tracks_sync AS SELECT * FROM tracks WHERE 0')
+                self._db.commit()
+            newest = ''
+            page = 1
+            while True:
+                # Not through the response cache: a copy built from pages of
+                # different ages could miss records altogether
+                result = fetch_audio_files(page, sort_by='created_at', order='desc', limit=self.page_size,
+                                           fresh=True)
+                if result is None:
+                    raise RuntimeError(f'Catalog sync failed on page {page}')
+                records = result.get('data') or []
+                with self._lock:
+                    self._db.executemany(
+                        f'INSERT OR REPLACE INTO tracks_sync VALUES ({", ".join("?" * (len(COLUMNS) + 1))})',
+                        [_row(r) for r in records if r.get('audio_id')],
+                    )
+                    self._db.commit()
+                if page == 1 and records:
+                    newest = records[0].get('created_at')
+                if len(records) < self.page_size:
+                    break
+                page += 1
+            with self._lock:
+                self._db.execute('DELETE FROM tracks')
+                self._db.execute('INSERT OR REPLACE INTO tracks SELECT * FROM tracks_sync')
+                self._db.execute('DROP TABLE tracks_sync')
+                self._set_state('cursor', newest)
+                self._set_state('last_full_sync', time.time())
+                self._db.commit()
+            self.last_delta_sync = time.monotonic()
+        return self.count()
+
+    def delta_sync(self):
+        # Walks created_at desc from the newest record and stops at the first one
+        # older than the cursor; records at the cursor itself are re-upserted
+        cursor = self.cursor
+        if cursor is None:
+            return self.full_sync()
+        cursor_ts = created_timestamp(cursor)
+        added = 0
+        with self._sync_lock:
+            page = 1
+            newest = cursor
+            while True:
+                result = fetch_audio_files(page, sort_by='created_at', order='desc', limit=self.page_size,
+                                           fresh=True)
+                if result is None:
+                    raise RuntimeError(f'Catalog delta sync failed on page {page}')
+                records = result.get('data') or []
+                fresh = [r for r in records if created_timestamp(r.get('created_at')) >= cursor_ts]
+                if page == 1 and records:
+                    newest = records[0].get('created_at')
+                with self._lock:
+                    self._upsert(fresh)
+                    self._db.commit()
+                added += len(fresh)
+                if len(fresh) < len(records) or len(records) < self.page_size:
+                    break
+                page += 1
+            with self._lock:
+                self._set_state('cursor', newest)
+                self._db.commit()
+            self.last_delta_sync = time.monotonic()
+        return added
+
+    def sync(self):
+        if self.cursor is None or time.time() - self.last_full_sync > FULL_SYNC_INTERVAL:
+            return self.full_sync()
+        return self.delta_sync()
+
+    def maybe_sync(self):
+        if self.cursor is None or time.monotonic() - self.last_delta_sync > DELTA_SYNC_INTERVAL:
+            self.sync()
+
+    def apply_mutation(self, kind, audio_id, fields, result):
+        # api_calls mutation listener: keep the local copy in line with our own writes
+        if not isinstance(result, dict) or not result.get('success'):
+            return
+        with self._lock:
+            if kind == 'upload' and isinstance(result.get('data'), dict):
+                self._upsert([result['data']])
+            elif kind == 'update' and audio_id:
+                columns = [c for c in ('artistName', 'trackName', 'fileUrl') if c in fields]
+                if columns:
+                    self._db.execute(
+                        f'UPDATE tracks SET {", ".join(f"{c} = ?" for c in columns)} WHERE audio_id = ?',
+                        [fields[c] for c in columns] + [audio_id],
+                    )
+            elif kind == 'delete' and audio_id:
+                self._db.execute('DELETE FROM tracks WHERE audio_id = ?', (audio_id,))
+            self._db.commit()
+
+    def _page_rows(self, page, sort_by, order, limit):
+        column = SORTABLE.get(sort_by, 'created_ts')
+        direction = 'ASC' if order == 'asc' else 'DESC'
+        with self._lock:
+            return self._db.execute(
+                f'SELECT {", ".join(COLUMNS)} FROM tracks ORDER BY {column} {direction}, audio_id {direction} '
+                'LIMIT ? OFFSET ?',
+                (limit, (page - 1) * limit),
+            ).fetchall()
+
+    def fetch_audio_files(self, page=1, sort_by='created_at', order='desc', limit=10):
+        # Same arguments and response shape as api_calls.fetch_audio_files
+        rows = self._page_rows(page, sort_by, order, limit)
+        return {'success': True, 'data': [dict(zip(COLUMNS, row)) for row in rows]}
+
+    def fetch_audio_frame(self, page=1, sort_by='created_at', order='desc', limit=100):
+        # Same as api_calls.fetch_audio_frame; rows go into columns without dicts
+        rows = self._page_rows(page, sort_by, order, limit)
+        builder = FrameBuilder()
+        builder.add_columns({field: [row[i] for row in rows] for i, field in enumerate(COLUMNS)})
+        return {'success': True, 'data': builder.frame()}
+
+    def collection_tags(self, audio_ids):
+        # audio_id -> collection_tag for those of audio_ids in the mirror
+        audio_ids = list(audio_ids)
+        found = {}
+        with self._lock:
+            for start in range(0, len(audio_ids), 500):
+                chunk = audio_ids[start:start + 500]
+                found.update(self._db.execute(
+                    f'SELECT audio_id, collection_tag FROM tracks WHERE audio_id IN ({", ".join("?" * len(chunk))})',
+                    chunk,
+                ).fetchall())
+        return found
+
+    def references(self, file_url):
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM tracks WHERE fileUrl = ? LIMIT 1', (file_url,)).fetchone() is not None
+
+    def referenced_urls(self, file_urls):
+        # Those of file_urls some mirrored record points at
+        file_urls = list(file_urls)
+        found = set()
+        with self._lock:
+            for start in range(0, len(file_urls), 500):
+                chunk = file_urls[start:start + 500]
+                found.update(url for url, in self._db.execute(
+                    f'SELECT DISTINCT fileUrl FROM tracks WHERE fileUrl IN ({", ".join("?" * len(chunk))})',
+                    chunk,
+                ))
+        return found
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_mirror = None
+_mirror_lock = threading.Lock()
+
+
+def get_mirror():
+    # Process-wide mirror, created and subscribed to api_calls mutations on first use
+    global _mirror
+    if _mirror is None:
+        with _mirror_lock:
+            if _mirror is None:
+                mirror = CatalogMirror()
+                add_mutation_listener(mirror.apply_mutation)
+                _mirror = mirror
+    return _mirror
+
+
+def fetch_catalog_page(page=1, sort_by='created_at', order='desc', limit=10, stale_ok=False):
+    # Reads from the local mirror when it is enabled (syncing first if it is due),
+    # otherwise straight from the API (stale_ok as for api_calls.fetch_audio_files)
+    if not MIRROR_ENABLED:
+        return fetch_audio_files(page, sort_by=sort_by, order=order, limit=limit, stale_ok=stale_ok)
+    mirror = get_mirror()
+    try:
+        mirror.maybe_sync()
+    except Exception as e:
+        if mirror.cursor is None:
+            # Never synced, so there is no local copy to fall back on
+            return fetch_audio_files(page, sort_by=sort_by, order=order, limit=limit, stale_ok=stale_ok)
+        print(f"Catalog mirror sync failed, serving local copy: {e}")
+    return mirror.fetch_audio_files(page, sort_by, order, limit)
+
+
+def fetch_catalog_frame(page=1, sort_by='created_at', order='desc', limit=100, stale_ok=False):
+    # fetch_catalog_page with 'data' as a DataFrame (see api_calls.fetch_audio_frame)
+    if not MIRROR_ENABLED:
+        return fetch_audio_frame(page, sort_by=sort_by, order=order, limit=limit, stale_ok=stale_ok)
+    mirror = get_mirror()
+    try:
+        mirror.maybe_sync()
+    except Exception as e:
+        if mirror.cursor is None:
+            return fetch_audio_frame(page, sort_by=sort_by, order=order, limit=limit, stale_ok=stale_ok)
+        print(f"Catalog mirror sync failed, serving local copy: {e}")
+    return mirror.fetch_audio_frame(page, sort_by, order, limit)
+
+
+def catalog_references(file_urls):
+    # Those of file_urls some record points at, answered from the mirror after a
+    # sync when it is enabled; None when only a catalog scan could tell. A sync
+    # walks pages by offset and can miss records that moved meanwhile, so a miss
+    # here is not proof on its own that nothing refers to a URL.
+    if not MIRROR_ENABLED:
+        return None
+    mirror = get_mirror()
+    try:
+        mirror.sync()
+    except Exception as e:
+        print(f"Catalog mirror sync failed: {e}")
+        return None
+    return mirror.referenced_urls(file_urls)
@@ -0,0 +1,171 @@
+import json
+import re
+
+# Column-at-a-time decoding of catalog list/search responses into a DataFrame.
+# response.json() builds one dict per record, and renaming keys record by
+# record before pd.DataFrame(records) copies everything again. Here the
+# records array is parsed one record at a time (the stdlib's C scanner through
+# JSONDecoder.raw_decode) and every DECODE_BATCH_ROWS records are turned into
+# columns, so only one batch of dicts exists at any time. Columns are named once
+# through COLUMN_NAMES rather than per record. With pyarrow installed, each batch
+# becomes an Arrow record batch with compact string buffers; otherwise plain
+# lists are used.
+
+# API field -> column header, as shown in "View Entries" and in exports.
+# Fields outside this schema are not kept.
+COLUMN_NAMES = {
+    'artistName': 'Artist Name',
+    'trackName': 'Track Name',
+    'fileUrl': 'URL',
+    'collection_tag': 'Collection Number',
+    'audio_id': 'Track ID',
+    '_id': 'Metadata ID',
+    'created_at': 'Upload Date',
+}
+INTEGER_FIELDS = frozenset(['collection_tag'])
+DECODE_BATCH_ROWS = 5000
+
+_decoder = json.JSONDecoder()
+_scan = _decoder.scan_once
+_WHITESPACE = ' \t\n\r'
+# What may follow an array element: the next one or the end of the array
+_ELEMENT_END = re.compile(r'[ \t\n\r]*([,\]])[ \t\n\r]*')
+
+
+def arrow_schema(pa):
+    return pa.schema([
+        (name, pa.int64() if field in INTEGER_FIELDS else pa.string())
+        for field, name in COLUMN_NAMES.items()
+    ])
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        return None
+    return pyarrow
+
+
+class FrameBuilder:
+    # Accumulates columns batch by batch and hands back one DataFrame
+    def __init__(self):
+        self.pa = _pyarrow()
+        self.schema = arrow_schema(self.pa) if self.pa is not None else None
+        self.batches = []
+        self.columns = {field: [] for field in COLUMN_NAMES}
+
+    def add_columns(self, columns):
+        # columns: API field -> list of values, all the same length
+        count = len(next(iter(columns.values()), []))
+        if not count:
+            return
+        if self.pa is not None:
+            try:
+                self.batches.append(self.pa.record_batch(
+                    [self.pa.array(columns.get(field) or [None] * count, type=self.schema.field(name).type)
+                     for field, name in COLUMN_NAMES.items()],
+                    schema=self.schema,
+                ))
+                return
+            except (self.pa.ArrowInvalid, self.pa.ArrowTypeError, OverflowError):
+                # A value that does not fit the schema, e.g. a non-integer
+                # collection_tag: keep the rest of the decode on plain lists
+                self._drop_arrow()
+        for field, values in self.columns.items():
+            values.extend(columns.get(field) or [None] * count)
+
+    def _drop_arrow(self):
+        for batch in self.batches:
+            for field, name in COLUMN_NAMES.items():
+                self.columns[field].extend(batch.column(name).to_pylist())
+        self.pa = None
+        self.schema = None
+        self.batches = []
+
+    def add(self, records):
+        if records:
+            self.add_columns({field: [record.get(field) for record in records] for field in COLUMN_NAMES})
+
+    def frame(self):
+        import pandas as pd
+
+        if self.pa is None:
+            return pd.DataFrame({name: self.columns[field] for field, name in COLUMN_NAMES.items()},
+                                columns=list(COLUMN_NAMES.values()))
+        return self.pa.Table.from_batches(self.batches, schema=self.schema).to_pandas()
+
+
+def frame_from_records(records):
+    builder = FrameBuilder()
+    builder.add(records)
+    return builder.frame()
+
+
+def frame_audio_ids(frame):
+    # The audio_ids a decoded page shows, for response cache invalidation
+    if frame is None or COLUMN_NAMES['audio_id'] not in frame:
+        return frozenset()
+    return frozenset(frame[COLUMN_NAMES['audio_id']].dropna())
+
+
+def _skip(text, i):
+    while i < len(text) and text[i] in _WHITESPACE:
+        i += 1
+    return i
+
+
+def _expect(text, i, char):
+    i = _skip(text, i)
+    if not text.startswith(char, i):
+        raise json.JSONDecodeError(f'Expecting {char!r}', text, i)
+    return i + 1
+
+
+def _decode_records(text, i, batch_rows):
+    # text[i] is the '[' of the records array; returns (DataFrame, offset after ']')
+    builder = FrameBuilder()
+    i = _skip(text, i + 1)
+    batch = []
+    if text.startswith(']', i):
+        i += 1
+    else:
+        while True:
+            try:
+                record, i = _scan(text, i)
+            except StopIteration as e:
+                raise json.JSONDecodeError('Expecting value', text, e.value) from None
+            if isinstance(record, dict):
+                batch.append(record)
+                if len(batch) >= batch_rows:
+                    builder.add(batch)
+                    batch = []
+            match = _ELEMENT_END.match(text, i)
+            if match is None:
+                raise json.JSONDecodeError("Expecting ',' delimiter", text, i)
+            i = match.end()
+            if match.group(1) == ']':
+                break
+    builder.add(batch)
+    return builder.frame(), i
+
+
+def decode_list_response(body, batch_rows=DECODE_BATCH_ROWS):
+    # The dict response.json() would give for a list/search response, except that
+    # 'data' is a DataFrame with COLUMN_NAMES headers
+    text = body.decode('utf-8') if isinstance(body, (bytes, bytearray)) else body
+    result = {}
+    i = _skip(text, _expect(text, 0, '{'))
+    if text.startswith('}', i):
+        return result
+    while True:
+        key, i = _decoder.raw_decode(text, _skip(text, i))
+        i = _skip(text, _expect(text, i, ':'))
+        if key == 'data' and text.startswith('[', i):
+            result[key], i = _decode_records(text, i, batch_rows)
+        else:
+            result[key], i = _decoder.raw_decode(text, i)
+        i = _skip(text, i)
+        if text.startswith('}', i):
+            return result
+        i = _expect(text, i, ',')
@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+
+from metrics import registry
+
+# Adaptive concurrency for bulk API calls (AIMD, as in TCP congestion control):
+# every call that comes back healthy while the limit is in use raises the limit
+# by 1/limit (so about +1 per full window of calls), and an overloaded call -
+# 429, 5xx, a connection error or a latency spike - halves it, at most once per
+# round trip so one burst of failures is not counted several times.
+BULK_ADAPTIVE = os.environ.get('JAARVIS_BULK_ADAPTIVE', '1') == '1'
+BULK_MIN_CONCURRENCY = int(os.environ.get('JAARVIS_BULK_MIN_CONCURRENCY', 1))
+BULK_MAX_CONCURRENCY = int(os.environ.get('JAARVIS_BULK_MAX_CONCURRENCY', 32))
+BULK_INITIAL_CONCURRENCY = int(os.environ.get('JAARVIS_BULK_INITIAL_CONCURRENCY', 4))
+# A call is a latency spike when its API time exceeds the baseline by this
+# factor plus LATENCY_SLACK (which keeps millisecond-level noise on a fast
+# server from counting)
+LATENCY_TOLERANCE = float(os.environ.get('JAARVIS_BULK_LATENCY_TOLERANCE', 1.5))
+LATENCY_SLACK = 0.01
+BACKOFF_FACTOR = 0.5
+# Smoothing for the latency average, and how fast the baseline (the lowest
+# average seen) drifts up again so a server that got slower for good is re-learned
+SMOOTHING = 0.2
+BASELINE_DRIFT = 0.01
+# Limit changes kept for charting
+HISTORY_SIZE = 2000
+
+OVERLOAD_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+_current = threading.local()
+
+
+class AdaptiveLimiter:
+    def __init__(self, initial=BULK_INITIAL_CONCURRENCY, minimum=BULK_MIN_CONCURRENCY,
+                 maximum=BULK_MAX_CONCURRENCY, latency_tolerance=LATENCY_TOLERANCE, adaptive=True):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self._limit = float(min(max(initial, self.minimum), self.maximum))
+        self.latency_tolerance = latency_tolerance
+        self.adaptive = adaptive
+        self.in_flight = 0
+        self.smoothed = None
+        self.baseline = None
+        self.increases = 0
+        self.decreases = 0
+        self.overloads = 0
+        self.completed = 0
+        self.started = time.perf_counter()
+        self._last_decrease = 0.0
+        # (seconds since start, limit) at the start and after every change
+        self.history = [(0.0, self.limit)]
+        self._lock = threading.Condition()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def try_acquire(self):
+        with self._lock:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def acquire(self):
+        with self._lock:
+            while self.in_flight >= self.limit:
+                self._lock.wait()
+            self.in_flight += 1
+
+    def release(self, seconds=None, overloaded=False):
+        # seconds: time the call spent on API requests, None when it made none
+        with self._lock:
+            saturated = self.in_flight >= self.limit
+            self.in_flight -= 1
+            self.completed += 1
+            if seconds is not None and not overloaded:
+                spike = self._observe(seconds)
+            else:
+                spike = False
+            if overloaded or spike:
+                self.overloads += 1
+                self._decrease()
+            elif saturated and seconds is not None:
+                # Only a limit that is actually in use is evidence it can grow
+                self._increase()
+            self._lock.notify_all()
+
+    def _observe(self, seconds):
+        # Returns True for a latency spike. Spikes enter the average clipped to the
+        # threshold, so a few very slow calls (e.g. ones that sat out retry
+        # backoff) do not hide the next ones, while a server that stays slower
+        # still pulls the average, and then the baseline, up.
+        threshold = None if self.baseline is None else self.baseline * self.latency_tolerance + LATENCY_SLACK
+        spike = threshold is not None and seconds > threshold
+        sample = min(seconds, threshold) if spike else seconds
+        if self.smoothed is None:
+            self.smoothed = sample
+        else:
+            self.smoothed += SMOOTHING * (sample - self.smoothed)
+        if self.baseline is None or self.smoothed < self.baseline:
+            self.baseline = self.smoothed
+        else:
+            self.baseline *= 1 + BASELINE_DRIFT * SMOOTHING
+        return spike
+
+    def _increase(self):
+        if not self.adaptive or self._limit >= self.maximum:
+            return
+        before = self.limit
+        self._limit = min(self.maximum, self._limit + 1 / self._limit)
+        if self.limit != before:
+            self.increases += 1
+            self._record()
+
+    def _decrease(self):
+        if not self.adaptive:
+            return
+        now = time.perf_counter()
+        # One cut per round trip: calls already in flight when the limit was cut
+        # report the same congestion
+        if now - self._last_decrease < (self.smoothed or 0.0):
+            return
+        self._last_decrease = now
+        before = self.limit
+        self._limit = max(self.minimum, self._limit * BACKOFF_FACTOR)
+        if self.limit != before:
+            self.decreases += 1
+            self._record()
+
+    def _record(self):
+        self.history.append((round(time.perf_counter() - self.started, 3), self.limit))
+        if len(self.history) > HISTORY_SIZE:
+            del self.history[1:len(self.history) - HISTORY_SIZE + 1]
+
+    def call(self, fn, *args):
+        # Runs fn in an already acquired slot and releases it, classifying the
+        # outcome from the API requests fn made on this thread
+        _current.calls = calls = []
+        try:
+            return fn(*args)
+        finally:
+            _current.calls = None
+            seconds = sum(s for _, s in calls) if calls else None
+            # Connection errors and timeouts are recorded with the exception name
+            overloaded = any(not isinstance(status, int) or status in OVERLOAD_STATUSES for status, _ in calls)
+            self.release(seconds, overloaded)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'in_flight': self.in_flight,
+                'min': self.minimum,
+                'max': self.maximum,
+                'adaptive': self.adaptive,
+                'baseline_ms': None if self.baseline is None else round(self.baseline * 1000, 2),
+                'smoothed_ms': None if self.smoothed is None else round(self.smoothed * 1000, 2),
+                'completed': self.completed,
+                'increases': self.increases,
+                'decreases': self.decreases,
+                'overloads': self.overloads,
+            }
+
+
+def _note_request(service, method, endpoint, status, seconds):
+    # Attributes API requests to the limited call running on this thread
+    calls = getattr(_current, 'calls', None)
+    if calls is not None and service == 'api':
+        calls.append((status, seconds))
+
+
+registry.add_observer(_note_request)
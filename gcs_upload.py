@@ -0,0 +1,194 @@
+import os
+import time
+from urllib.parse import quote
+
+import requests
+
+from metrics import instrument_session
+
+# Point STORAGE_EMULATOR_HOST at a local fake (e.g. benchmarks/fake_gcs.py) to
+# exercise uploads offline; google-cloud-storage honours the same variable
+GCS_ENDPOINT = os.environ.get('STORAGE_EMULATOR_HOST', 'https://storage.googleapis.com').rstrip('/')
+USING_EMULATOR = 'STORAGE_EMULATOR_HOST' in os.environ
+GCS_SCOPES = ['https://www.googleapis.com/auth/devstorage.read_write']
+
+# Resumable chunks must be a multiple of 256 KiB; one chunk is all we hold in memory
+CHUNK_ALIGNMENT = 256 * 1024
+GCS_UPLOAD_CHUNK_SIZE = int(os.environ.get('JAARVIS_GCS_CHUNK_SIZE', 8 * 1024 * 1024))
+MAX_CHUNK_RETRIES = 5
+CHUNK_TIMEOUT = (3.05, 120)
+
+
+# Extension -> content type stored on the blob (and served to st.audio)
+AUDIO_CONTENT_TYPES = {
+    'mp3': 'audio/mpeg',
+    'ogg': 'audio/ogg',
+    'wav': 'audio/wav',
+}
+DEFAULT_AUDIO_EXTENSION = 'wav'
+
+
+def audio_extension(filename):
+    extension = os.path.splitext(filename or '')[1].lstrip('.').lower()
+    return extension if extension in AUDIO_CONTENT_TYPES else DEFAULT_AUDIO_EXTENSION
+
+
+class ResumableUploadError(Exception):
+    pass
+
+
+def public_url(bucket_name, blob_name):
+    # Same form as storage.Blob.public_url
+    return f'https://storage.googleapis.com/{bucket_name}/{quote(blob_name)}'
+
+
+def blob_exists(session, bucket_name, blob_name, endpoint=GCS_ENDPOINT):
+    # Metadata-only lookup; no object bytes are transferred
+    response = session.get(
+        f"{endpoint.rstrip('/')}/storage/v1/b/{bucket_name}/o/{quote(blob_name, safe='')}",
+        params={'fields': 'name,size'},
+        timeout=CHUNK_TIMEOUT,
+    )
+    if response.status_code == 200:
+        return True
+    if response.status_code == 404:
+        return False
+    raise ResumableUploadError(f'Could not look up {blob_name}: {response.status_code}')
+
+
+def _aligned(chunk_size):
+    return max(CHUNK_ALIGNMENT, chunk_size - chunk_size % CHUNK_ALIGNMENT)
+
+
+def _file_size(file):
+    position = file.tell()
+    size = file.seek(0, os.SEEK_END)
+    file.seek(position)
+    return size
+
+
+class ResumableUpload:
+    # Streams a seekable file object to GCS through the resumable upload protocol.
+    # Only one chunk is read into memory at a time; when a chunk fails, the session
+    # is asked how many bytes it already has and the upload continues from there.
+
+    def __init__(self, session, bucket_name, blob_name, content_type=None, chunk_size=GCS_UPLOAD_CHUNK_SIZE,
+                 endpoint=GCS_ENDPOINT, max_retries=MAX_CHUNK_RETRIES, progress=None):
+        self.session = session
+        self.bucket_name = bucket_name
+        self.blob_name = blob_name
+        self.content_type = content_type or 'application/octet-stream'
+        self.chunk_size = _aligned(chunk_size)
+        self.endpoint = endpoint.rstrip('/')
+        self.max_retries = max_retries
+        self.progress = progress
+        self.session_uri = None
+        self.total_size = None
+        self.bytes_uploaded = 0
+        self.retries = 0
+
+    @property
+    def public_url(self):
+        return public_url(self.bucket_name, self.blob_name)
+
+    def start(self, total_size):
+        self.total_size = total_size
+        response = self.session.post(
+            f'{self.endpoint}/upload/storage/v1/b/{self.bucket_name}/o',
+            params={'uploadType': 'resumable', 'name': self.blob_name},
+            headers={
+                'X-Upload-Content-Type': self.content_type,
+                'X-Upload-Content-Length': str(total_size),
+            },
+            json={'name': self.blob_name, 'contentType': self.content_type},
+            timeout=CHUNK_TIMEOUT,
+        )
+        if response.status_code not in (200, 201):
+            raise ResumableUploadError(f'Could not start upload of {self.blob_name}: {response.status_code}')
+        self.session_uri = response.headers['Location']
+        return self.session_uri
+
+    def _committed_offset(self, response):
+        # A 308 carries the range the server has persisted, e.g. "bytes=0-524287"
+        committed = response.headers.get('Range')
+        if not committed:
+            return 0
+        return int(committed.rsplit('-', 1)[-1]) + 1
+
+    def query_offset(self):
+        response = self.session.put(
+            self.session_uri,
+            headers={'Content-Range': f'bytes */{self.total_size}', 'Content-Length': '0'},
+            timeout=CHUNK_TIMEOUT,
+        )
+        if response.status_code in (200, 201):
+            return self.total_size
+        if response.status_code == 308:
+            return self._committed_offset(response)
+        raise ResumableUploadError(f'Upload session for {self.blob_name} is no longer valid: {response.status_code}')
+
+    def _send_chunk(self, file, offset):
+        file.seek(offset)
+        chunk = file.read(self.chunk_size)
+        if chunk:
+            content_range = f'bytes {offset}-{offset + len(chunk) - 1}/{self.total_size}'
+        else:
+            content_range = f'bytes */{self.total_size}'
+        response = self.session.put(
+            self.session_uri,
+            data=chunk,
+            headers={'Content-Range': content_range},
+            timeout=CHUNK_TIMEOUT,
+        )
+        if response.status_code in (200, 201):
+            return self.total_size
+        if response.status_code == 308:
+            return self._committed_offset(response)
+        if response.status_code == 429 or response.status_code >= 500:
+            raise requests.ConnectionError(f'Retryable status {response.status_code}')
+        raise ResumableUploadError(f'Chunk upload of {self.blob_name} failed: {response.status_code}')
+
+    def upload(self, file):
+        # Uploads from the file's start; call resume() to continue an existing session
+        if self.session_uri is None:
+            self.start(_file_size(file))
+        offset = self.bytes_uploaded
+        failures = 0
+        finished = False
+        while not finished:
+            try:
+                if offset is None:
+                    # The previous attempt failed midway; ask where to continue
+                    offset = self.query_offset()
+                offset = self._send_chunk(file, offset)
+                failures = 0
+            except (requests.ConnectionError, requests.Timeout):
+                failures += 1
+                self.retries += 1
+                if failures > self.max_retries:
+                    raise
+                time.sleep(min(2 ** (failures - 1) * 0.5, 8))
+                offset = None
+                continue
+            self.bytes_uploaded = offset
+            if self.progress:
+                self.progress(offset, self.total_size)
+            finished = offset >= self.total_size
+        return self.public_url
+
+    def resume(self, file, session_uri, total_size=None):
+        # Continues an upload started earlier (e.g. before a page rerun) from
+        # whatever the server already holds
+        self.session_uri = session_uri
+        self.total_size = total_size if total_size is not None else _file_size(file)
+        self.bytes_uploaded = self.query_offset()
+        return self.upload(file)
+
+
+def upload_session(credentials):
+    # Emulators accept anonymous requests; real GCS needs an OAuth-authorized session
+    if USING_EMULATOR:
+        return instrument_session(requests.Session(), 'gcs')
+    from google.auth.transport.requests import AuthorizedSession
+
+    return instrument_session(AuthorizedSession(credentials.with_scopes(GCS_SCOPES)), 'gcs')
@@ -0,0 +1,78 @@
+import os
+import requests
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+
+from metrics import InstrumentedAdapter
+
+# Connection pool and timeout defaults, overridable through environment variables
+POOL_CONNECTIONS = int(os.environ.get('JAARVIS_POOL_CONNECTIONS', 4))
+POOL_MAXSIZE = int(os.environ.get('JAARVIS_POOL_MAXSIZE', 32))
+CONNECT_TIMEOUT = float(os.environ.get('JAARVIS_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT = float(os.environ.get('JAARVIS_READ_TIMEOUT', 30))
+MAX_RETRIES = int(os.environ.get('JAARVIS_MAX_RETRIES', 3))
+BACKOFF_FACTOR = float(os.environ.get('JAARVIS_BACKOFF_FACTOR', 0.3))
+
+# Only these methods are replayed after a read error or a retryable status.
+# POST (upload, login, register) is never replayed because the server may
+# already have applied it; connection errors are still retried since the
+# request never left the client.
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'])
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+# Response encodings offered to the server: requests' own "gzip, deflate", plus
+# br (and zstd) when the brotli (zstandard) package is installed to decode them
+ACCEPT_ENCODING = make_headers(accept_encoding=True)['accept-encoding']
+
+
+class ApiClient:
+    # Thin wrapper around a requests.Session with a keep-alive connection pool.
+    # One instance is shared per process (see api_calls.api_client), so every
+    # Streamlit rerun and session reuses the same warm TCP+TLS connections.
+
+    def __init__(self, base_url, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 max_retries=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.headers.update({'Connection': 'keep-alive', 'Accept-Encoding': ACCEPT_ENCODING})
+
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=IDEMPOTENT_METHODS,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        # Records latency, status, sizes and retries per endpoint (see metrics.py)
+        adapter = InstrumentedAdapter('api', pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                      max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def url(self, path):
+        return f'{self.base_url}{path}'
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, self.url(path), **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    def close(self):
+        self.session.close()
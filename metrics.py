@@ -0,0 +1,298 @@
+import bisect
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from requests.adapters import HTTPAdapter
+
+# Per-endpoint request metrics for every API and GCS call, kept in process
+# memory. Shown on the Diagnostics page and exported in the Prometheus text
+# format (set JAARVIS_METRICS_PORT to serve it on http://<host>:<port>/metrics).
+METRICS_PORT = int(os.environ.get('JAARVIS_METRICS_PORT', 0))
+METRIC_PREFIX = 'jaarvis'
+
+# Histogram bucket upper bounds in seconds, ~1.5x apart from 1 ms to 60 s;
+# percentiles are interpolated within a bucket, as Prometheus does
+LATENCY_BUCKETS = tuple(round(0.001 * 1.5 ** i, 6) for i in range(28))
+
+# Concrete URL paths -> low-cardinality endpoint labels
+_ENDPOINT_PATTERNS = [
+    (re.compile(r'^/api/audio/(edit|delete)/[^/]+$'), r'/api/audio/\1/{id}'),
+    (re.compile(r'^/upload/storage/v1/b/[^/]+/o$'), 'upload'),
+    (re.compile(r'^/storage/v1/b/[^/]+/o$'), 'list'),
+    (re.compile(r'^/storage/v1/b/[^/]+/o/.+$'), 'object'),
+    (re.compile(r'^/batch/storage/v1$'), 'batch'),
+]
+
+
+def endpoint_label(method, url):
+    parsed = urlparse(url)
+    path = parsed.path
+    for pattern, replacement in _ENDPOINT_PATTERNS:
+        if pattern.match(path):
+            label = pattern.sub(replacement, path)
+            break
+    else:
+        return path or '/'
+    query = parse_qs(parsed.query)
+    if label == 'upload':
+        # Initiating a resumable upload vs. sending its chunks (PUT to the session URI)
+        kind = query.get('uploadType', [''])[0]
+        return f'upload ({kind} chunk)' if method == 'PUT' else f'upload ({kind})'
+    if label == 'object' and query.get('alt') == ['media']:
+        return 'object (download)'
+    return label
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # One count per bucket plus the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.statuses = {}
+        self.errors = 0
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self.started = time.time()
+        self._observers = []
+        self._collectors = []
+
+    def add_collector(self, collector):
+        # collector() returns extra families for the Prometheus export, as a list
+        # of (name, 'counter' | 'gauge', help, [(labels dict, value), ...])
+        if collector not in self._collectors:
+            self._collectors.append(collector)
+
+    def add_observer(self, observer):
+        # observer(service, method, endpoint, status, seconds) is called for every
+        # recorded request, on the thread that made it
+        if observer not in self._observers:
+            self._observers.append(observer)
+
+    def record(self, service, method, endpoint, status, seconds, bytes_sent=0, bytes_received=0, retries=0):
+        # status is the HTTP status code, or an exception class name when the call
+        # never got a response. 4xx/5xx and exceptions count as errors, except a 404
+        # on a read, which is an answer (e.g. "no such blob") rather than a failure.
+        key = (service, method, endpoint)
+        with self._lock:
+            stats = self._endpoints.get(key)
+            if stats is None:
+                stats = self._endpoints[key] = EndpointStats()
+            stats.latency.observe(seconds)
+            stats.statuses[str(status)] = stats.statuses.get(str(status), 0) + 1
+            if not isinstance(status, int) or (status >= 400 and not (status == 404 and method in ('GET', 'HEAD'))):
+                stats.errors += 1
+            stats.retries += retries
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+        for observer in self._observers:
+            observer(service, method, endpoint, status, seconds)
+
+    def latency_percentile(self, service, method, endpoint, q, min_count=1):
+        # Seconds, or None with fewer than min_count requests recorded
+        with self._lock:
+            stats = self._endpoints.get((service, method, endpoint))
+            if stats is None or stats.latency.count < min_count:
+                return None
+            return stats.latency.percentile(q)
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+            self.started = time.time()
+
+    def snapshot(self):
+        # One row per (service, method, endpoint), latencies in milliseconds
+        with self._lock:
+            rows = []
+            for (service, method, endpoint), stats in sorted(self._endpoints.items()):
+                latency = stats.latency
+                rows.append({
+                    'service': service,
+                    'method': method,
+                    'endpoint': endpoint,
+                    'requests': latency.count,
+                    'error_rate': stats.errors / latency.count if latency.count else 0.0,
+                    'p50_ms': _ms(latency.percentile(0.50)),
+                    'p95_ms': _ms(latency.percentile(0.95)),
+                    'p99_ms': _ms(latency.percentile(0.99)),
+                    'mean_ms': _ms(latency.total / latency.count if latency.count else None),
+                    'retries': stats.retries,
+                    'bytes_sent': stats.bytes_sent,
+                    'bytes_received': stats.bytes_received,
+                    'statuses': dict(stats.statuses),
+                })
+            return rows
+
+    def prometheus_text(self):
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {METRIC_PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {METRIC_PREFIX}_{name} {kind}')
+
+        with self._lock:
+            items = sorted(self._endpoints.items())
+            family('request_duration_seconds', 'histogram', 'Client-side request latency, including retries.')
+            for key, stats in items:
+                labels = _labels(key)
+                cumulative = 0
+                for bound, count in zip(stats.latency.buckets, stats.latency.counts):
+                    cumulative += count
+                    lines.append(f'{METRIC_PREFIX}_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{METRIC_PREFIX}_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.latency.count}')
+                lines.append(f'{METRIC_PREFIX}_request_duration_seconds_sum{{{labels}}} {stats.latency.total:.6f}')
+                lines.append(f'{METRIC_PREFIX}_request_duration_seconds_count{{{labels}}} {stats.latency.count}')
+            family('requests_total', 'counter', 'Requests by final status (or exception name).')
+            for key, stats in items:
+                for status, count in sorted(stats.statuses.items()):
+                    lines.append(f'{METRIC_PREFIX}_requests_total{{{_labels(key)},status="{_escape(status)}"}} {count}')
+            family('request_retries_total', 'counter', 'Retries made by the HTTP client.')
+            for key, stats in items:
+                lines.append(f'{METRIC_PREFIX}_request_retries_total{{{_labels(key)}}} {stats.retries}')
+            family('request_bytes_total', 'counter', 'Request and response body bytes.')
+            for key, stats in items:
+                labels = _labels(key)
+                lines.append(f'{METRIC_PREFIX}_request_bytes_total{{{labels},direction="sent"}} {stats.bytes_sent}')
+                lines.append(f'{METRIC_PREFIX}_request_bytes_total{{{labels},direction="received"}} {stats.bytes_received}')
+        for collector in self._collectors:
+            for name, kind, help_text, samples in collector():
+                family(name, kind, help_text)
+                for labels, value in samples:
+                    label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                    lines.append(f'{METRIC_PREFIX}_{name}{{{label_text}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(key):
+    service, method, endpoint = key
+    return f'service="{_escape(service)}",method="{method}",endpoint="{_escape(endpoint)}"'
+
+
+def _body_size(body):
+    if body is None:
+        return 0
+    if isinstance(body, (bytes, bytearray, str)):
+        return len(body)
+    return 0
+
+
+registry = MetricsRegistry()
+
+
+class InstrumentedAdapter(HTTPAdapter):
+    # Transport adapter that records every request sent through a session: total
+    # time (including urllib3 retries and their backoff), final status, body sizes
+    # and the number of retries
+    def __init__(self, service, *args, **kwargs):
+        self.service = service
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, stream=False, **kwargs):
+        endpoint = endpoint_label(request.method, request.url)
+        sent = _body_size(request.body)
+        started = time.perf_counter()
+        try:
+            response = super().send(request, stream=stream, **kwargs)
+        except Exception as e:
+            registry.record(self.service, request.method, endpoint, e.__class__.__name__,
+                            time.perf_counter() - started, sent)
+            raise
+        retries = getattr(getattr(response.raw, 'retries', None), 'history', ()) or ()
+        length = response.headers.get('Content-Length')
+        if length is not None and length.isdigit():
+            received = int(length)
+        else:
+            received = 0 if stream else len(response.content)
+        registry.record(self.service, request.method, endpoint, response.status_code,
+                        time.perf_counter() - started, sent, received, len(retries))
+        return response
+
+
+def instrument_session(session, service, **adapter_kwargs):
+    adapter = InstrumentedAdapter(service, **adapter_kwargs)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if urlparse(self.path).path != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def start_exporter(port=METRICS_PORT, host='0.0.0.0'):
+    # Serves /metrics for Prometheus from a daemon thread; once per process
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _exporter.daemon_threads = True
+            threading.Thread(target=_exporter.serve_forever, name='metrics-exporter', daemon=True).start()
+    return _exporter
+
+
+if METRICS_PORT:
+    try:
+        start_exporter()
+    except OSError as e:
+        # Another process (e.g. a second Streamlit worker) already holds the port
+        print(f"Metrics exporter not started on port {METRICS_PORT}: {e}")
@@ -0,0 +1,353 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+from api_calls import delete_audio_file, send_to_api, update_audio_file
+from metrics import registry
+
+# Optional write-behind for metadata changes. With JAARVIS_WRITE_BEHIND=1,
+# uploads (track registration), edits and deletes made from the pages are written
+# to a local SQLite journal and the page returns at once; a background worker
+# sends them to the API in order, retrying with backoff while the API is down.
+# Pending changes to the same track are merged before they are sent: edits fold
+# into one, and a delete drops the edits queued ahead of it.
+WRITE_BEHIND = os.environ.get('JAARVIS_WRITE_BEHIND') == '1'
+JOURNAL_PATH = os.environ.get('JAARVIS_JOURNAL_PATH', './mutation_journal.sqlite3')
+# Retry delay after the n-th failed attempt: RETRY_BASE * 2**n, capped
+RETRY_BASE = 1.0
+RETRY_MAX = 60.0
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+# An entry claimed this long ago by a worker that never finished it (process
+# killed mid-send) may or may not have reached the API. Edits and deletes are
+# idempotent and are handed out again; an upload sent twice would register the
+# track twice, so it is marked failed for someone to check the catalog and then
+# retry or discard it.
+SENDING_TIMEOUT = 300
+STALE_UPLOAD_ERROR = ('Interrupted while sending; the track may already be registered. '
+                      'Check the catalog, then retry or discard.')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    audio_id TEXT,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    claimed_at REAL,
+    last_error TEXT,
+    merged INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS journal_track ON journal (audio_id, state);
+CREATE INDEX IF NOT EXISTS journal_state ON journal (state, seq);
+"""
+
+ENTRY_COLUMNS = ['seq', 'kind', 'audio_id', 'payload', 'state', 'attempts', 'next_attempt', 'last_error',
+                 'merged', 'created']
+
+_current = threading.local()
+
+
+class JournalStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self):
+        with self._lock:
+            return {'queued': self.queued, 'coalesced': self.coalesced, 'sent': self.sent,
+                    'retries': self.retries, 'failed': self.failed}
+
+
+class MutationJournal:
+    # Entries move pending -> sending -> (removed | pending again with a later
+    # next_attempt | failed). Only the oldest pending entry is ever sent, so the
+    # API sees changes in the order they were made; a failed entry (the API
+    # rejected it, or an upload was interrupted mid-send) steps out of the queue
+    # and waits for retry() or discard().
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._worker = None
+        self.stats = JournalStats()
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so a second process
+        # sharing the journal cannot interleave between a read and its update
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    def append(self, kind, audio_id=None, payload=None):
+        # Queues a change and returns its entry's seq (an earlier entry's, when
+        # the change was merged into it)
+        payload = payload or {}
+        with self._transaction() as db:
+            latest = None
+            if audio_id is not None:
+                latest = db.execute(
+                    "SELECT seq, kind, payload FROM journal WHERE audio_id = ? AND state = 'pending' "
+                    "ORDER BY seq DESC LIMIT 1", (audio_id,)).fetchone()
+            if kind == 'update' and latest is not None and latest[1] == 'update':
+                merged = dict(json.loads(latest[2]), **payload)
+                db.execute('UPDATE journal SET payload = ?, merged = merged + 1 WHERE seq = ?',
+                           (json.dumps(merged), latest[0]))
+                seq, coalesced = latest[0], 1
+            elif kind == 'delete' and latest is not None and latest[1] == 'delete':
+                seq, coalesced = latest[0], 1
+            else:
+                coalesced = 0
+                if kind == 'delete' and audio_id is not None:
+                    # Edits still waiting are pointless once the track is deleted
+                    coalesced = db.execute("DELETE FROM journal WHERE audio_id = ? AND kind = 'update' "
+                                           "AND state = 'pending'", (audio_id,)).rowcount
+                seq = db.execute(
+                    'INSERT INTO journal (kind, audio_id, payload, merged, created) VALUES (?, ?, ?, ?, ?)',
+                    (kind, audio_id, json.dumps(payload), coalesced, time.time())).lastrowid
+        self.stats.add(queued=1, coalesced=coalesced)
+        self._wake.set()
+        return seq
+
+    def entries(self, states=('pending', 'sending', 'failed')):
+        placeholders = ', '.join('?' * len(states))
+        with self._lock:
+            rows = self._db.execute(f'SELECT {", ".join(ENTRY_COLUMNS)} FROM journal WHERE state IN ({placeholders}) '
+                                    'ORDER BY seq', tuple(states)).fetchall()
+        entries = []
+        for row in rows:
+            entry = dict(zip(ENTRY_COLUMNS, row))
+            entry['payload'] = json.loads(entry['payload'])
+            entries.append(entry)
+        return entries
+
+    def counts(self):
+        with self._lock:
+            rows = self._db.execute('SELECT state, COUNT(*) FROM journal GROUP BY state').fetchall()
+        return dict(rows)
+
+    def retry(self, seq):
+        # Puts a failed entry back in the queue at its original position
+        with self._transaction() as db:
+            db.execute("UPDATE journal SET state = 'pending', next_attempt = 0 WHERE seq = ? AND state = 'failed'",
+                       (seq,))
+        self._wake.set()
+
+    def discard(self, seq):
+        with self._transaction() as db:
+            db.execute("DELETE FROM journal WHERE seq = ? AND state IN ('pending', 'failed')", (seq,))
+        self._wake.set()
+
+    def _claim(self):
+        # Returns (entry, None) for the entry to send now, or (None, seconds to
+        # wait) when the head of the queue is backing off or held by another worker
+        now = time.time()
+        with self._transaction() as db:
+            db.execute("UPDATE journal SET state = 'pending' WHERE state = 'sending' AND claimed_at < ? "
+                       "AND kind != 'upload'", (now - SENDING_TIMEOUT,))
+            stale_uploads = db.execute("UPDATE journal SET state = 'failed', last_error = ? WHERE state = 'sending' "
+                                       "AND claimed_at < ? AND kind = 'upload'",
+                                       (STALE_UPLOAD_ERROR, now - SENDING_TIMEOUT)).rowcount
+            if stale_uploads:
+                self.stats.add(failed=stale_uploads)
+            row = db.execute(f'SELECT {", ".join(ENTRY_COLUMNS)} FROM journal WHERE state IN (\'pending\', \'sending\') '
+                             'ORDER BY seq LIMIT 1').fetchone()
+            if row is None:
+                return None, None
+            entry = dict(zip(ENTRY_COLUMNS, row))
+            if entry['state'] == 'sending':
+                return None, 1.0
+            if entry['next_attempt'] > now:
+                return None, entry['next_attempt'] - now
+            db.execute("UPDATE journal SET state = 'sending', claimed_at = ? WHERE seq = ?", (now, entry['seq']))
+        entry['payload'] = json.loads(entry['payload'])
+        return entry, None
+
+    def _finish(self, entry, outcome, error):
+        with self._transaction() as db:
+            if outcome == 'sent':
+                db.execute('DELETE FROM journal WHERE seq = ?', (entry['seq'],))
+            elif outcome == 'retry':
+                attempts = entry['attempts'] + 1
+                delay = min(RETRY_MAX, RETRY_BASE * 2 ** (attempts - 1))
+                db.execute("UPDATE journal SET state = 'pending', attempts = ?, next_attempt = ?, last_error = ? "
+                           "WHERE seq = ?", (attempts, time.time() + delay, error, entry['seq']))
+            else:
+                db.execute("UPDATE journal SET state = 'failed', attempts = attempts + 1, last_error = ? "
+                           "WHERE seq = ?", (error, entry['seq']))
+        counter = {'sent': 'sent', 'retry': 'retries', 'failed': 'failed'}[outcome]
+        self.stats.add(**{counter: 1})
+
+    def flush_once(self):
+        # Sends the head entry if it is due. Returns None when the queue is empty,
+        # otherwise how long to wait before calling again (0 to go on at once).
+        entry, wait = self._claim()
+        if entry is None:
+            return wait
+        outcome, error = send_entry(entry)
+        self._finish(entry, outcome, error)
+        return 0
+
+    def flush(self, timeout=None):
+        # Sends everything that is due, on the calling thread; for scripts and tests
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while deadline is None or time.monotonic() < deadline:
+            wait = self.flush_once()
+            if wait is None:
+                return True
+            if wait:
+                time.sleep(min(wait, 0.5) if deadline is None else max(0, min(wait, deadline - time.monotonic())))
+        return False
+
+    def start(self):
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name='mutation-journal', daemon=True)
+            self._worker.start()
+        return self
+
+    def _run(self):
+        while True:
+            try:
+                wait = self.flush_once()
+            except Exception as e:
+                print(f"Mutation journal worker error: {e}")
+                wait = RETRY_BASE
+            if wait == 0:
+                continue
+            self._wake.wait(wait)
+            self._wake.clear()
+
+
+def _apply(entry):
+    payload = entry['payload']
+    if entry['kind'] == 'upload':
+        return send_to_api(payload)
+    if entry['kind'] == 'update':
+        return update_audio_file(entry['audio_id'], payload.get('artistName'), payload.get('trackName'),
+                                 payload.get('fileUrl'))
+    return delete_audio_file(entry['audio_id'], file_url=payload.get('file_url'))
+
+
+def send_entry(entry):
+    # Returns ('sent' | 'retry' | 'failed', error). Unreachable API, timeouts,
+    # 429 and 5xx are retried; any other rejection fails the entry.
+    _current.statuses = statuses = []
+    try:
+        result = _apply(entry)
+    except (requests.RequestException, ValueError) as e:
+        result, error = None, str(e) or e.__class__.__name__
+    else:
+        error = None
+    finally:
+        _current.statuses = None
+    status = statuses[-1] if statuses else None
+    if isinstance(result, dict) and result.get('success'):
+        return 'sent', None
+    if entry['kind'] == 'delete' and status == 404:
+        # Already gone; deletes are idempotent
+        return 'sent', None
+    if error is None:
+        error = (result or {}).get('message') if isinstance(result, dict) else 'No response from API'
+        error = error or f'API answered {status}'
+    if status is None or not isinstance(status, int) or status in RETRY_STATUSES:
+        return 'retry', error
+    return 'failed', error
+
+
+def _note_request(service, method, endpoint, status, seconds):
+    statuses = getattr(_current, 'statuses', None)
+    if statuses is not None and service == 'api':
+        statuses.append(status)
+
+
+registry.add_observer(_note_request)
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    # Process-wide journal with its worker running; created on first use
+    global _journal
+    if _journal is None:
+        with _journal_lock:
+            if _journal is None:
+                _journal = MutationJournal().start()
+    return _journal
+
+
+def _queued(seq):
+    return {'success': True, 'pending': True, 'journal_seq': seq,
+            'message': 'Saved locally; it will be sent to the server in the background'}
+
+
+def _direct(fn, *args, **kwargs):
+    # Sends right away, turning "no answer" into a failed result instead of an
+    # exception or None, so callers can always read result['success']
+    try:
+        result = fn(*args, **kwargs)
+    except (requests.RequestException, ValueError) as e:
+        return {'success': False, 'message': f'Could not reach the server: {e}'}
+    if not isinstance(result, dict):
+        return {'success': False, 'message': 'No response from the server'}
+    result.setdefault('success', False)
+    if not result['success']:
+        result.setdefault('message', 'The server rejected the change')
+    return result
+
+
+def submit_upload(track_info, write_behind=WRITE_BEHIND):
+    # Registers an uploaded track (track_info as for send_to_api)
+    if not write_behind:
+        return _direct(send_to_api, track_info)
+    return _queued(get_journal().append('upload', None, dict(track_info)))
+
+
+def submit_update(audio_id, artist_name=None, track_name=None, file_url=None, write_behind=WRITE_BEHIND):
+    fields = {'artistName': artist_name, 'trackName': track_name, 'fileUrl': file_url}
+    fields = {k: v for k, v in fields.items() if v is not None}
+    if not fields:
+        return {'success': False, 'message': 'No update fields provided'}
+    if not write_behind:
+        return _direct(update_audio_file, audio_id, artist_name, track_name, file_url)
+    return _queued(get_journal().append('update', audio_id, fields))
+
+
+def submit_delete(audio_id, file_url=None, write_behind=WRITE_BEHIND):
+    if not write_behind:
+        return _direct(delete_audio_file, audio_id, file_url=file_url)
+    return _queued(get_journal().append('delete', audio_id, {'file_url': file_url} if file_url else {}))
+
+
+def journal_stats():
+    # Counts by state plus this process's counters; empty when write-behind is off
+    if not WRITE_BEHIND and _journal is None:
+        return {}
+    journal = get_journal()
+    return dict(journal.stats.snapshot(), **{f'{state}_entries': n for state, n in journal.counts().items()})
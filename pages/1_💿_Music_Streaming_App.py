@@ -1,10 +1,17 @@
 import streamlit as st
-from api_calls import create_uuid, upload_file_to_gcs, send_to_api, fetch_audio_files, search_audio_files, login, register
+from api_calls import search_audio_files, login, register
+from stream_pager import StreamPager
+from search_index import get_search_index
+from upload_form import upload_form
+from previews import load_previews, waveform_svg
+from profiling import begin_rerun, end_rerun, section
 
 st.set_page_config(
     page_title="Music Streaming App",
     page_icon="💿",
 )
+# Per-rerun timings when profiling is on (JAARVIS_PROFILE=1 or ?profile=1)
+begin_rerun("music_streaming_app")
 
 st.title('💿 Music Streaming App')
 
@@ -36,6 +43,38 @@ def register_page():
             else:
                 st.error("An error occurred.")
 
+# Selectbox label -> (sort_by, order) for the Stream tab
+SORT_OPTIONS = {
+    'Recently Uploaded': ('created_at', 'desc'),
+    'Artist Name': ('artistName', 'asc'),
+    'Track Name': ('trackName', 'asc'),
+}
+
+def get_pager(sort):
+    # One pager per sort order, kept in session state so loaded pages survive reruns
+    # (until a mutation or StreamPager's PAGE_MAX_AGE makes them refetch)
+    pagers = st.session_state.setdefault("stream_pagers", {})
+    if sort not in pagers:
+        sort_by, order = SORT_OPTIONS[sort]
+        pagers[sort] = StreamPager(sort_by, order)
+    return pagers[sort]
+
+def show_tracks(files, key):
+    # Lists tracks with their waveform and short preview clip; the full file is
+    # only put on the page when asked for. Tracks without a preview play in full.
+    previews = load_previews([file['fileUrl'] for file in files])
+    for file, preview in zip(files, previews):
+        st.markdown(f"### Artist: {file['artistName']} | Track: {file['trackName']}")
+        if preview is None:
+            st.audio(file['fileUrl'])
+        else:
+            st.markdown(waveform_svg(preview['peaks']), unsafe_allow_html=True)
+            st.audio(preview['preview_url'])
+            track_key = f"{key}_full_{file.get('audio_id') or file['fileUrl']}"
+            if st.toggle(f"Full track ({int(preview['duration'] // 60)}:{int(preview['duration'] % 60):02d})", key=track_key):
+                st.audio(file['fileUrl'])
+        st.markdown('---')
+
 # Add authentication check before rendering the main content
 if "logged_in" not in st.session_state:
     st.session_state.logged_in = False
@@ -56,70 +95,62 @@ else:
 
     with tab1:
         # sort by most recent
-        sort = st.selectbox('Sort by', ['Recently Uploaded', 'Artist Name', 'Track Name'])
-        if sort == 'Recently Uploaded':
-            audio_files = fetch_audio_files()
-            for file in audio_files['data']:
-                st.markdown(f"### Artist: {file['artistName']} | Track: {file['trackName']}")
-                st.audio(file['fileUrl'])
-                st.markdown('---')
-        elif sort == 'Artist Name':
-            audio_files = fetch_audio_files(sort_by='artistName', order='asc')
-            for file in audio_files['data']:
-                st.markdown(f"### Artist: {file['artistName']} | Track: {file['trackName']}")
-                st.audio(file['fileUrl'])
-                st.markdown('---')
-        elif sort == 'Track Name':
-            audio_files = fetch_audio_files(sort_by='trackName', order='asc')
-            for file in audio_files['data']:
-                st.markdown(f"### Artist: {file['artistName']} | Track: {file['trackName']}")
-                st.audio(file['fileUrl'])
-                st.markdown('---')
+        sort = st.selectbox('Sort by', list(SORT_OPTIONS))
+        pager = get_pager(sort)
+        # Shows the current page and starts fetching the next one in the background
+        with section("stream: fetch"):
+            audio_files = pager.show()
+        if audio_files is None:
+            st.error('Could not load tracks, please try again.')
+        else:
+            if pager.is_stale():
+                st.warning('The catalog is not responding; showing the last copy of this page.')
+            if not audio_files:
+                st.info('No more tracks.')
+            with section("stream: render"):
+                show_tracks(audio_files, "stream")
+
+        prev_col, page_col, next_col = st.columns([1, 2, 1])
+        prev_col.button('← Previous', key="stream_prev", disabled=pager.current == 1, on_click=pager.go, args=(-1,))
+        page_col.markdown(f"<div style='text-align: center'>Page {pager.current}</div>", unsafe_allow_html=True)
+        next_col.button('Next →', key="stream_next", disabled=not pager.has_next(), on_click=pager.go, args=(1,))
 
     with tab2:
         # Search by artist name or track name
         artist_name = st.text_input('Artist Name', key="search_artist")
         track_name = st.text_input('Track Name', key="search_track")
-        search_button = st.button('Search', disabled=not (artist_name or track_name))
-
-        if search_button:
-            search_results = search_audio_files(artist_name, track_name)
-            if search_results:
-                if not search_results['data']:
+        # Once the local index has been built, results update as the fields change;
+        # until then fall back to the API search button
+        index = get_search_index()
+        search_button = False
+        if index.ready:
+            if artist_name or track_name:
+                with section("search: index"):
+                    results = index.search(artist_name, track_name)
+                if not results:
                     st.warning('No results found')
-                else:
-                    for file in search_results['data']:
-                        st.markdown(f"### Artist: {file['artistName']} | Track: {file['trackName']}")
+                with section("search: render"):
+                    show_tracks(results, "search")
+        else:
+            search_button = st.button('Search', disabled=not (artist_name or track_name))
 
-                        st.audio(file['fileUrl'])
-                        st.markdown('---')
-            else:
+        if search_button:
+            # Kept in session state so the "Full track" toggles survive their rerun
+            with section("search: api"):
+                search_results = search_audio_files(artist_name, track_name, stale_ok=True)
+            st.session_state.api_search_results = search_results['data'] if search_results else []
+            st.session_state.api_search_stale = bool(search_results and search_results.get('stale'))
+        if not index.ready and "api_search_results" in st.session_state:
+            if st.session_state.get("api_search_stale"):
+                st.warning('Search is not responding; showing the last results for this search.')
+            if not st.session_state.api_search_results:
                 st.warning('No results found')
+            else:
+                with section("search: render"):
+                    show_tracks(st.session_state.api_search_results, "search")
 
     with tab3:
-        # Artist and Track name input
-        artist_name = st.text_input('Artist Name', key="upload_artist")
-        track_name = st.text_input('Track Name', key="upload_track")
-        uploaded_file = st.file_uploader("Choose a file")
-
-        submit_button = st.button('Submit Song', disabled=not (artist_name and track_name and uploaded_file and file))
-
-        if submit_button and uploaded_file is not None and artist_name and track_name:
-            file_extension = uploaded_file.name.split('.')[-1]
-            if file_extension.lower() in ['mp3', 'ogg', 'wav']:
-                file_url = upload_file_to_gcs(uploaded_file)
-                st.success('File successfully uploaded')
-                
-                # Creating JSON object
-                track_info = {
-                    "artist_name": artist_name,
-                    "track_name": track_name,
-                    "file_url": file_url,
-                }
-                
-                st.audio(file_url)
-                send_to_api(track_info)
-            else:
-                st.warning("Please choose a file with .mp3, .ogg, or .wav extension.")
-        elif submit_button:
-            st.warning("Please enter an artist name, a track name, and choose a file to upload.")
\ No newline at end of file
+        with section("upload"):
+            upload_form("upload")
+
+end_rerun()
@@ -1,12 +1,22 @@
 import streamlit as st
-import requests
-import pandas as pd
-from api_calls import upload_file_to_gcs, send_to_api, fetch_audio_files, search_audio_files, update_audio_file, delete_audio_file, login, register
+import os
+import tempfile
+import time
+from api_calls import login, register
+from bulk_ops import run_bulk
+from mutation_journal import WRITE_BEHIND, get_journal, submit_delete, submit_update
+from catalog_mirror import fetch_catalog_frame, fetch_catalog_page
+from catalog_export import EXPORT_DOWNLOAD_MAX_BYTES, export_catalog, export_formats
+from upload_form import upload_form
+from blob_gc import GC_DELETES_PER_SECOND, GC_MIN_AGE_HOURS, collect_orphans
+from profiling import begin_rerun, end_rerun, section
 
 st.set_page_config(
     page_title="Music Streaming Database Management",
     page_icon="💾",
 )
+# Per-rerun timings when profiling is on (JAARVIS_PROFILE=1 or ?profile=1)
+begin_rerun("db_management")
 
 st.title("💾 Music Streaming Database Management")
 
@@ -39,6 +49,111 @@ def register_page():
             else:
                 st.error("An error occurred.")
 
+def run_bulk_csv(csv_file, operation, label):
+    # Runs a bulk operation with one progress bar and a downloadable failure report
+    # instead of one message per row
+    with section(f"bulk: {operation}"):
+        _run_bulk_csv(csv_file, operation, label)
+
+def _run_bulk_csv(csv_file, operation, label):
+    progress_bar = st.progress(0.0, text=f"{label}: starting...")
+    last_update = [0.0]
+
+    def on_progress(report):
+        # Streamlit round trips are expensive, so refresh at most a few times a second
+        now = time.perf_counter()
+        if now - last_update[0] < 0.25:
+            return
+        last_update[0] = now
+        progress_bar.progress(report.fraction,
+                              text=f"{label}: {report.processed} rows processed, {report.failed} failed, "
+                                   f"{report.concurrency} in flight")
+
+    try:
+        report = run_bulk(csv_file, operation, progress=on_progress)
+    except ValueError as e:
+        progress_bar.empty()
+        st.error(f"Please check the .csv file: {e}")
+        return
+    except Exception as e:
+        progress_bar.empty()
+        st.error(f"Failed to process .csv file: {e}")
+        return
+
+    progress_bar.progress(1.0, text=f"{label}: done")
+    summary = f"{report.succeeded} of {report.processed} rows succeeded in {report.elapsed:.1f}s ({report.rows_per_second:.0f} rows/s)"
+    if report.failed:
+        st.warning(f"{summary}; {report.failed} failed.")
+        st.download_button(
+            "Download failed rows as .csv",
+            report.failures_csv(),
+            f"{operation}_failures.csv",
+            "text/csv",
+            key=f"download-{operation}-failures"
+        )
+    else:
+        st.success(summary)
+    if report.blob_error:
+        st.warning(f"Tracks were deleted, but their stored files were not: {report.blob_error}")
+    elif report.blob_urls:
+        st.info(f"Deleted {report.blobs_deleted} stored file(s) no other track refers to.")
+    collections = report.collections()
+    if collections:
+        # Planned runs: rows were grouped by the collection they touch
+        with st.expander(f"Throughput per collection ({len(collections)} groups)"):
+            st.dataframe(collections, hide_index=True, use_container_width=True)
+    for label, limiter in report.limiters.items():
+        snapshot = limiter.snapshot()
+        if not snapshot['adaptive']:
+            continue
+        title = "Concurrency" if label == 'all' else f"Collection {label} concurrency"
+        with st.expander(f"{title}: ended at {snapshot['limit']} calls in flight "
+                         f"({snapshot['increases']} increases, {snapshot['decreases']} backoffs)"):
+            import pandas as pd
+
+            history = pd.DataFrame(limiter.history, columns=["Seconds", "Calls in flight"])
+            st.line_chart(history, x="Seconds", y="Calls in flight")
+            st.json(snapshot)
+    report.close()
+
+def pending_changes():
+    # Uploads, edits and deletes saved in the mutation journal and not yet
+    # accepted by the server, with retry/discard for the ones it rejected
+    journal = get_journal()
+    entries = journal.entries()
+    if not entries:
+        return
+    failed = [entry for entry in entries if entry['state'] == 'failed']
+    waiting = len(entries) - len(failed)
+    label = f"{waiting} change(s) waiting to be sent"
+    if failed:
+        label += f", {len(failed)} rejected by the server"
+    with st.expander(label, expanded=bool(failed)):
+        for entry in entries:
+            payload = entry['payload']
+            if entry['kind'] == 'upload':
+                what = f"Upload {payload.get('artist_name')} — {payload.get('track_name')}"
+            elif entry['kind'] == 'update':
+                what = f"Edit {entry['audio_id']}: " + ', '.join(f"{k} = {v}" for k, v in payload.items())
+            else:
+                what = f"Delete {entry['audio_id']}"
+            if entry['merged']:
+                what += f" (merged {entry['merged']} earlier change(s))"
+            if entry['state'] == 'failed':
+                col1, col2, col3 = st.columns([6, 1, 1])
+                col1.error(f"{what}: {entry['last_error']}")
+                if col2.button("Retry", key=f"journal-retry-{entry['seq']}"):
+                    journal.retry(entry['seq'])
+                    st.rerun()
+                if col3.button("Discard", key=f"journal-discard-{entry['seq']}"):
+                    journal.discard(entry['seq'])
+                    st.rerun()
+            else:
+                status = "sending" if entry['state'] == 'sending' else "waiting"
+                if entry['attempts']:
+                    status += f", {entry['attempts']} failed attempt(s): {entry['last_error']}"
+                st.markdown(f"- {what} ({status})")
+
 # Add authentication check before rendering the main content
 if "logged_in" not in st.session_state:
     st.session_state.logged_in = False
@@ -57,6 +172,9 @@ if not st.session_state.logged_in:
 
 else:
 
+    if WRITE_BEHIND:
+        pending_changes()
+
     tab1, tab2, tab3, tab4 = st.tabs(["View Entries", "Upload Entries", "Edit Entries", "Delete Entries"])
 
     with tab1:
@@ -64,22 +182,17 @@ else:
         entries_per_page = st.selectbox("Entries per page", [10, 25, 50, 100], index=1)
         view_button = st.button("View Audio Files", disabled=not entries_per_page and not page)
         if view_button:
-            result = fetch_audio_files(page, limit=entries_per_page)
-            if result['success']:
-                data = result['data']
-                print(data[0])
-                # rename columns
-                for item in data:
-                    item['Artist Name'] = item.pop('artistName')
-                    item['Track Name'] = item.pop('trackName')
-                    item['URL'] = item.pop('fileUrl')
-                    item['Collection Number'] = item.pop('collection_tag')
-                    item['Track ID'] = item.pop('audio_id')
-                    item['Metadata ID'] = item.pop('_id')
-                    item['Upload Date'] = item.pop('created_at', None)
-                df = pd.DataFrame(data)
-                st.dataframe(df)
-                csv = df.to_csv(index=False).encode('utf-8')
+            with section("view: fetch"):
+                # Decoded straight into columns with the display names (columnar.py)
+                result = fetch_catalog_frame(page, limit=entries_per_page, stale_ok=True)
+            if result is not None and result.get('success', True) and 'data' in result:
+                if result.get('stale'):
+                    st.warning('The catalog is not responding; showing the last copy of this page.')
+                df = result['data']
+                with section("view: render"):
+                    st.dataframe(df)
+                with section("view: csv"):
+                    csv = df.to_csv(index=False).encode('utf-8')
                 st.download_button(
                     "Download as .csv",
                     csv,
@@ -90,35 +203,58 @@ else:
             else:
                 st.error("Failed to fetch audio files.")
 
+        st.header("Export Entire Catalog")
+        # Parquet is only offered when pyarrow is installed
+        export_format = st.selectbox("Export format", export_formats(), key="export_format")
+        export_button = st.button("Export All Audio Files")
+        if export_button:
+            # Rows are streamed to a temporary file page by page instead of being
+            # collected into one DataFrame
+            export_status = st.empty()
+            with tempfile.TemporaryDirectory(prefix="jaarvis-export-") as export_dir:
+                export_path = os.path.join(export_dir, f"catalog.{export_format}")
+                try:
+                    with section("export"):
+                        stats = export_catalog(
+                            export_path,
+                            export_format,
+                            fetch=fetch_catalog_page,
+                            progress=lambda stats: export_status.text(f"Exported {stats.rows} rows..."),
+                        )
+                except Exception as e:
+                    st.error(f"Failed to export audio files: {e}")
+                else:
+                    export_status.empty()
+                    memory = ""
+                    if stats.peak_rss is not None:
+                        memory = (f", peak RSS {stats.peak_rss / 1024 / 1024:.0f} MB, "
+                                  f"+{stats.rss_growth / 1024 / 1024:.0f} MB during export")
+                    st.success(f"Exported {stats.rows} rows in {stats.elapsed:.1f}s "
+                               f"({stats.rows_per_second:.0f} rows/s{memory})")
+                    # The download button keeps the whole file in server memory for the
+                    # session, so very large exports are not offered
+                    export_size = os.path.getsize(export_path)
+                    if export_size > EXPORT_DOWNLOAD_MAX_BYTES:
+                        st.warning(f"The export is {export_size / 1024 / 1024:.0f} MB, over the "
+                                   f"{EXPORT_DOWNLOAD_MAX_BYTES / 1024 / 1024:.0f} MB download limit "
+                                   f"(JAARVIS_EXPORT_DOWNLOAD_MAX_MB)."
+                                   + (" The Parquet export is much smaller." if export_format == "csv"
+                                      and "parquet" in export_formats() else ""))
+                    else:
+                        with open(export_path, 'rb') as export_file:
+                            st.download_button(
+                                f"Download catalog as .{export_format}",
+                                export_file,
+                                f"catalog.{export_format}",
+                                "text/csv" if export_format == "csv" else "application/octet-stream",
+                                key='download-export'
+                            )
+
 
     with tab2:
-        st.header("Upload Audio File")
-        # Artist and Track name input
-        artist_name = st.text_input('Artist Name', key="upload_artist")
-        track_name = st.text_input('Track Name', key="upload_track")
-        uploaded_file = st.file_uploader("Choose a file", key="upload_from_db_manager")
-
-        submit_button = st.button('Submit Song', disabled=not (artist_name and track_name and uploaded_file))
-
-        if submit_button and uploaded_file is not None and artist_name and track_name:
-            file_extension = uploaded_file.name.split('.')[-1]
-            if file_extension.lower() in ['mp3', 'ogg', 'wav']:
-                file_url = upload_file_to_gcs(uploaded_file)
-                st.success('File successfully uploaded')
-                
-                # Creating JSON object
-                track_info = {
-                    "artist_name": artist_name,
-                    "track_name": track_name,
-                    "file_url": file_url,
-                }
-                
-                st.audio(file_url)
-                send_to_api(track_info)
-            else:
-                st.warning("Please choose a file with .mp3, .ogg, or .wav extension.")
-        elif submit_button:
-            st.warning("Please enter an artist name, a track name, and choose a file to upload.")
+        st.header("Upload Audio Files")
+        with section("upload"):
+            upload_form("db_upload")
 
         st.header("Bulk Upload via .csv")
         # Upload CSV file
@@ -126,25 +262,7 @@ else:
         upload_button = st.button("Upload CSV", disabled=not uploaded_file)
 
         if upload_button:
-            df = pd.read_csv(uploaded_file)
-            # make sure the columns are named artistName, trackName, fileUrl
-            if not all(col in df.columns for col in ['artistName', 'trackName', 'fileUrl']):
-                st.error("Please make sure the .csv file has columns named 'artistName', 'trackName', and 'fileUrl'.")
-            else:
-                try:
-                    for index, row in df.iterrows():
-                        track_info = {
-                            'artist_name': row.get('artistName', ''),
-                            'track_name': row.get('trackName', ''),
-                            'file_url': row.get('fileUrl', '')
-                        }
-                        result = send_to_api(track_info)
-                        if result['success']:
-                            st.success(f"Uploaded audio file for {track_info['artist_name']} - {track_info['track_name']}")
-                        else:
-                            st.error(f"Failed to upload audio file for {track_info['artist_name']} - {track_info['track_name']}")
-                except Exception as e:
-                    st.error(f"Failed to upload audio files: {e}")
+            run_bulk_csv(uploaded_file, 'upload', "Uploading")
 
     with tab3:
         st.header("Edit Audio File")
@@ -155,58 +273,79 @@ else:
         edit_button = st.button("Edit Audio File", disabled=not (artist_name or file_url or track_name))
 
         if edit_button:
-            result = update_audio_file(track_id, artist_name, track_name, file_url)
-            if result['success']:
+            result = submit_update(track_id, artist_name, track_name, file_url)
+            if result.get('pending'):
+                st.info(f"Update for ID {track_id} saved; it will be sent to the server in the background.")
+            elif result['success']:
                 st.success(f"Updated audio file with ID {track_id}")
             else:
-                st.error(f"Could not update audio file with ID {track_id} — check if the ID is correct.")
+                st.error(f"Could not update audio file with ID {track_id} — check if the ID is correct. ({result['message']})")
 
         st.header("Bulk Edit via .csv")
         edit_file = st.file_uploader("Upload a .csv file with columns 'trackID', 'artistName', 'trackName', and 'fileUrl' to edit multiple audio files.")
         edit_button = st.button("Edit Audio Files", disabled=not edit_file)
         
         if edit_button:
-            df = pd.read_csv(edit_file)
-            if not all(col in df.columns for col in ['trackID', 'artistName', 'trackName', 'fileUrl']):
-                st.error("Please make sure the .csv file has columns named 'trackID', 'artistName', 'trackName', and 'fileUrl'.")
-            else:
-                try:
-                    for index, row in df.iterrows():
-                        result = update_audio_file(row.get('trackID', ''), row.get('artistName', ''), row.get('trackName', ''), row.get('fileUrl', ''))
-                        if result['success']:
-                            st.success(f"Updated audio file with ID {row.get('trackID', '')}")
-                        else:
-                            st.error(f"Could not update audio file with ID {row.get('trackID', '')} — check if the ID is correct.")
-                except Exception as e:
-                    st.error(f"Failed to update audio files: {e}")
+            run_bulk_csv(edit_file, 'edit', "Editing")
 
     with tab4:
         st.header("Delete Audio File")
         id_to_delete = st.text_input("Track ID to Delete", key="delete_id")
+        url_to_delete = st.text_input("File URL (optional: also deletes the stored audio file)", key="delete_url") or None
         delete_button = st.button("Delete Audio File", disabled=not id_to_delete)
         
         if delete_button:
-            result = delete_audio_file(id_to_delete)
-            if result['success']:
+            result = submit_delete(id_to_delete, file_url=url_to_delete)
+            if result.get('pending'):
+                st.info(f"Delete for ID {id_to_delete} saved; it will be sent to the server in the background.")
+            elif result['success']:
                 st.success(f"Deleted audio file with ID {id_to_delete}")
+                if url_to_delete:
+                    if result.get('blobs_deleted'):
+                        st.info(f"Removed {result['blobs_deleted']} stored file(s)")
+                    else:
+                        st.info("The stored file was kept (still used by another track, or not in our bucket)")
             else:
                 st.error(result['message'])
         
         st.header("Bulk Delete via .csv")
-        delete_file = st.file_uploader("Upload a .csv file with a a single column named 'trackID' to delete multiple audio files.")
+        delete_file = st.file_uploader("Upload a .csv file with a a single column named 'trackID' to delete multiple audio files. Add a 'fileUrl' column to also delete the stored audio files.")
         delete_button = st.button("Delete Audio Files", disabled=not delete_file)
 
         if delete_button:
-            df = pd.read_csv(delete_file)
-            if 'trackID' not in df.columns:
-                st.error("Please make sure the .csv file has a column named 'trackID'.")
+            run_bulk_csv(delete_file, 'delete', "Deleting")
+
+        st.header("Clean Up Orphaned Files")
+        st.markdown("Finds stored audio files (and their previews) that no track refers to any more, "
+                    "e.g. after deletes or edits that replaced the file URL.")
+        gc_dry_run = st.checkbox("Dry run (only report)", value=True, key="gc_dry_run")
+        gc_min_age = st.number_input("Only files older than (hours)", min_value=1.0, value=GC_MIN_AGE_HOURS, key="gc_min_age")
+        gc_rate = st.number_input("Deletes per second", min_value=1.0, value=GC_DELETES_PER_SECOND, key="gc_rate")
+        gc_button = st.button("Find Orphaned Files" if gc_dry_run else "Delete Orphaned Files", key="gc_run")
+
+        if gc_button:
+            status = st.empty()
+
+            def show_gc_progress(report):
+                status.text(f"Checked {report.scanned:,} stored files against {report.referenced:,} referenced; "
+                            f"{report.orphan_count:,} orphaned, {report.deleted:,} deleted")
+
+            try:
+                with st.spinner("Reading catalog and bucket..."):
+                    report = collect_orphans(dry_run=gc_dry_run, min_age_hours=gc_min_age,
+                                             deletes_per_second=gc_rate, progress=show_gc_progress)
+            except Exception as e:
+                st.error(f"Clean up failed: {e}")
             else:
-                try:
-                    for index, row in df.iterrows():
-                        result = delete_audio_file(row.get('trackID', ''))
-                        if result['success']:
-                            st.success(f"Deleted audio file with ID {row.get('trackID', '')}")
-                        else:
-                            st.error(f"Could not delete audio file with ID {row.get('trackID', '')} — check if the ID is correct.")
-                except Exception as e:
-                    st.error(f"Failed to delete audio files: {e}")
\ No newline at end of file
+                verb = "Would delete" if report.dry_run else "Deleted"
+                count = report.orphan_count if report.dry_run else report.deleted
+                st.success(f"{verb} {count:,} file(s), {report.orphan_bytes / 1024 / 1024:,.1f} MB, "
+                           f"in {report.elapsed:.1f}s ({report.skipped_recent:,} recent file(s) skipped, "
+                           f"{report.kept_on_recheck:,} kept after a second catalog check)")
+                if report.failed:
+                    st.error(f"{len(report.failed)} file(s) could not be deleted")
+                if report.orphans:
+                    orphan_rows = "name,size,timeCreated\n" + "".join(f"{n},{size},{created}\n" for n, size, created in report.orphans)
+                    st.download_button("Download orphan list", orphan_rows, "orphaned_files.csv", "text/csv")
+
+end_rerun()
@@ -0,0 +1,86 @@
+import streamlit as st
+import pandas as pd
+from api_calls import read_guard_stats, response_cache_stats, single_flight_stats, upload_dedup_stats
+from metrics import METRICS_PORT, registry
+from mutation_journal import WRITE_BEHIND, journal_stats
+from profiling import begin_rerun, end_rerun
+
+st.set_page_config(
+    page_title="Diagnostics",
+    page_icon="📊",
+)
+# Per-rerun timings when profiling is on (JAARVIS_PROFILE=1 or ?profile=1)
+begin_rerun("diagnostics")
+
+st.title("📊 Diagnostics")
+
+if not st.session_state.get("logged_in"):
+    st.info("Log in on the Music Streaming App or Database Management page to see diagnostics.")
+    st.stop()
+
+st.markdown("Client-side timings for every API and Google Cloud Storage call made by this server process "
+            "(all sessions), since it started or since the last reset.")
+
+rows = registry.snapshot()
+col1, col2, col3 = st.columns(3)
+total = sum(row['requests'] for row in rows)
+errors = sum(row['requests'] * row['error_rate'] for row in rows)
+col1.metric("Requests", f"{total:,}")
+col2.metric("Error rate", f"{errors / total:.1%}" if total else "–")
+col3.metric("Retries", f"{sum(row['retries'] for row in rows):,}")
+
+if not rows:
+    st.info("No requests recorded yet.")
+else:
+    table = pd.DataFrame(rows)
+    table['error_rate'] = (table['error_rate'] * 100).round(2)
+    table['statuses'] = table['statuses'].map(lambda statuses: ', '.join(f"{k}: {v}" for k, v in statuses.items()))
+    table = table.rename(columns={
+        'service': 'Service', 'method': 'Method', 'endpoint': 'Endpoint', 'requests': 'Requests',
+        'error_rate': 'Errors %', 'p50_ms': 'p50 ms', 'p95_ms': 'p95 ms', 'p99_ms': 'p99 ms',
+        'mean_ms': 'Mean ms', 'retries': 'Retries', 'bytes_sent': 'Bytes Sent',
+        'bytes_received': 'Bytes Received', 'statuses': 'Statuses',
+    })
+    st.header("Endpoints")
+    st.dataframe(table, hide_index=True, use_container_width=True)
+
+    st.header("p95 Latency (ms)")
+    chart = table.assign(Call=table['Method'] + ' ' + table['Endpoint']).set_index('Call')['p95 ms']
+    st.bar_chart(chart)
+
+reads = read_guard_stats()
+if reads:
+    st.header("Read Hedging & Circuit Breakers")
+    st.dataframe(pd.DataFrame(reads), hide_index=True, use_container_width=True)
+    open_breakers = [row['endpoint'] for row in reads if row['breaker_state'] != 'closed']
+    if open_breakers:
+        st.warning(f"Failing fast (circuit open): {', '.join(open_breakers)}")
+
+st.header("Caches")
+cache_col, flight_col, dedup_col = st.columns(3)
+cache_col.subheader("Response cache")
+cache_col.json(response_cache_stats())
+flight_col.subheader("Coalesced reads")
+flight_col.json(single_flight_stats())
+dedup_col.subheader("Upload dedup")
+dedup_col.json(upload_dedup_stats())
+
+if WRITE_BEHIND:
+    st.header("Write-behind Journal")
+    st.json(journal_stats())
+
+st.header("Prometheus Export")
+metrics_text = registry.prometheus_text()
+if METRICS_PORT:
+    st.markdown(f"Scrape `http://<host>:{METRICS_PORT}/metrics`.")
+else:
+    st.markdown("Set `JAARVIS_METRICS_PORT` to serve this at `/metrics` for scraping.")
+st.download_button("Download metrics", metrics_text, "jaarvis_metrics.txt", "text/plain")
+with st.expander("Show metrics text"):
+    st.code(metrics_text, language="text")
+
+if st.button("Reset Metrics"):
+    registry.reset()
+    st.rerun()
+
+end_rerun()
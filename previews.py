@@ -0,0 +1,220 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlparse
+
+import requests
+
+from api_calls import BUCKET_NAME, stored_blob_exists, upload_blob
+from gcs_upload import AUDIO_CONTENT_TYPES, GCS_ENDPOINT, USING_EMULATOR, public_url
+from metrics import instrument_session
+from transcode import encode, output_format, resample, stream_mono
+
+# Each upload gets two small objects next to the original blob "<stem>.<ext>":
+#   <stem>.preview.<ext>  short low-bitrate clip for browsing
+#   <stem>.preview.json   {"duration", "preview", "preview_start", "peaks"}
+# Listings read the JSON (a few hundred bytes) and only load the original on demand.
+# Making them streams the upload through the decoder once for the waveform and
+# the loudest stretch, then decodes just that stretch for the clip, so memory
+# stays at a few chunks plus the clip whatever the track's length.
+PREVIEWS_ENABLED = os.environ.get('JAARVIS_PREVIEWS', '1') == '1'
+PREVIEW_SECONDS = 30
+PREVIEW_FORMAT = os.environ.get('JAARVIS_PREVIEW_FORMAT', 'mp3')
+PREVIEW_BITRATE = os.environ.get('JAARVIS_PREVIEW_BITRATE', '48k')
+PREVIEW_SAMPLE_RATE = 22050
+# Waveform resolution: one 0-255 peak per bin over the whole track
+WAVEFORM_BINS = 120
+# The analysis pass keeps one peak and one energy value per block of this length
+ANALYSIS_BLOCKS_PER_SECOND = 10
+# Fade in/out on the clip so it does not start or stop with a click
+FADE_SECONDS = 0.25
+
+MANIFEST_VERSION = 1
+# How long a fetched manifest (or its absence) is trusted
+MANIFEST_TTL = 300
+MANIFEST_CACHE_SIZE = 4096
+MANIFEST_TIMEOUT = (3.05, 5)
+
+_manifest_session = instrument_session(requests.Session(), 'gcs')
+_manifest_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='preview-manifest')
+_manifest_cache = {}
+_manifest_lock = threading.Lock()
+
+
+def waveform_peaks(magnitude, bins=WAVEFORM_BINS):
+    # Per-block loudest |sample| over the track -> list of `bins` ints, each the
+    # loudest in its slice of the track scaled to 0-255
+    import numpy as np
+
+    if len(magnitude) == 0:
+        return [0] * bins
+    edges = np.linspace(0, len(magnitude), bins + 1).astype(np.int64)[:-1]
+    edges = np.minimum(edges, len(magnitude) - 1)
+    peaks = np.maximum.reduceat(magnitude, edges)
+    return np.clip(np.round(peaks * 255), 0, 255).astype(int).tolist()
+
+
+def loudest_window(energy, seconds=PREVIEW_SECONDS, blocks_per_second=ANALYSIS_BLOCKS_PER_SECOND):
+    # Start (in blocks) of the `seconds`-long stretch with the most energy, so
+    # previews skip quiet intros
+    import numpy as np
+
+    window = int(seconds * blocks_per_second)
+    if len(energy) <= window:
+        return 0
+    totals = np.convolve(energy, np.ones(window), mode='valid')
+    return int(np.argmax(totals))
+
+
+def analyse(chunks, rate, blocks_per_second=ANALYSIS_BLOCKS_PER_SECOND):
+    # One pass over streamed mono chunks -> (frames, block length, per-block peak
+    # magnitudes, per-block mean energy)
+    import numpy as np
+
+    block = max(rate // blocks_per_second, 1)
+    peaks, energy = [], []
+    carry = np.zeros(0, dtype=np.float32)
+    frames = 0
+    for chunk in chunks:
+        frames += len(chunk)
+        data = np.concatenate([carry, chunk]) if len(carry) else chunk
+        usable = len(data) // block * block
+        blocks = data[:usable].reshape(-1, block)
+        peaks.append(np.abs(blocks).max(axis=1, initial=0.0))
+        energy.append(np.square(blocks).mean(axis=1))
+        carry = data[usable:]
+    if len(carry):
+        peaks.append(np.abs(carry).max(keepdims=True))
+        energy.append(np.square(carry).mean(keepdims=True))
+    if not peaks:
+        return 0, block, np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32)
+    return frames, block, np.concatenate(peaks), np.concatenate(energy)
+
+
+def render_preview(file, fmt=PREVIEW_FORMAT, bitrate=PREVIEW_BITRATE, seconds=PREVIEW_SECONDS):
+    # Returns (clip bytes, extension, manifest)
+    import numpy as np
+
+    fmt = output_format(fmt)
+    rate, chunks = stream_mono(file, PREVIEW_SAMPLE_RATE)
+    frames, block, magnitude, energy = analyse(chunks, rate)
+    peaks = waveform_peaks(magnitude)
+    start = loudest_window(energy, seconds) * block / rate
+    rate, chunks = stream_mono(file, PREVIEW_SAMPLE_RATE, start=start, seconds=seconds)
+    clip = np.concatenate(list(chunks) or [np.zeros(0, dtype=np.float32)])[:, None]
+    clip_rate = min(PREVIEW_SAMPLE_RATE, rate)
+    clip = resample(clip, rate, clip_rate)
+    fade = min(int(FADE_SECONDS * clip_rate), len(clip) // 2)
+    if fade:
+        ramp = np.linspace(0.0, 1.0, fade, dtype=np.float32)[:, None]
+        clip[:fade] *= ramp
+        clip[-fade:] *= ramp[::-1]
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'duration': round(frames / rate, 2),
+        'preview_start': round(start, 2),
+        'peaks': peaks,
+    }
+    return encode(clip, clip_rate, fmt, bitrate), fmt, manifest
+
+
+def blob_name_from_url(file_url):
+    # Only blobs in our bucket have previews; returns None for anything else
+    parsed = urlparse(file_url or '')
+    prefix = f'/{BUCKET_NAME}/'
+    if parsed.netloc != 'storage.googleapis.com' or not parsed.path.startswith(prefix):
+        return None
+    return unquote(parsed.path[len(prefix):])
+
+
+def preview_names(blob_name):
+    stem = os.path.splitext(blob_name)[0]
+    return f'{stem}.preview', f'{stem}.preview.json'
+
+
+def create_preview(file, file_url):
+    # Builds and stores the preview clip and manifest for an uploaded file. Content
+    # addressed uploads share previews, so an existing manifest is left alone.
+    # Returns the manifest, or None if the audio could not be decoded.
+    blob_name = blob_name_from_url(file_url)
+    if blob_name is None:
+        return None
+    clip_stem, manifest_name = preview_names(blob_name)
+    if stored_blob_exists(manifest_name):
+        return None
+    try:
+        clip, extension, manifest = render_preview(file)
+    finally:
+        file.seek(0)
+    clip_name = f'{clip_stem}.{extension}'
+    manifest['preview'] = clip_name
+    # Clip first: a manifest is only ever visible once its clip exists
+    upload_blob(clip, clip_name, AUDIO_CONTENT_TYPES[extension])
+    upload_blob(json.dumps(manifest, separators=(',', ':')).encode('utf-8'), manifest_name, 'application/json')
+    return manifest
+
+
+def _object_url(blob_name):
+    # Objects are public; emulators serve them through the JSON API instead
+    if USING_EMULATOR:
+        return f"{GCS_ENDPOINT}/storage/v1/b/{BUCKET_NAME}/o/{requests.utils.quote(blob_name, safe='')}?alt=media"
+    return public_url(BUCKET_NAME, blob_name)
+
+
+def _fetch_manifest(blob_name):
+    _, manifest_name = preview_names(blob_name)
+    try:
+        response = _manifest_session.get(_object_url(manifest_name), timeout=MANIFEST_TIMEOUT)
+    except requests.RequestException:
+        return None
+    if response.status_code != 200:
+        return None
+    try:
+        manifest = response.json()
+    except ValueError:
+        return None
+    manifest['preview_url'] = public_url(BUCKET_NAME, manifest['preview'])
+    return manifest
+
+
+def load_preview(file_url):
+    # Manifest for a track (with 'preview_url' added), or None when it has no preview
+    blob_name = blob_name_from_url(file_url)
+    if blob_name is None:
+        return None
+    now = time.monotonic()
+    with _manifest_lock:
+        cached = _manifest_cache.get(blob_name)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    manifest = _fetch_manifest(blob_name)
+    with _manifest_lock:
+        if len(_manifest_cache) >= MANIFEST_CACHE_SIZE:
+            for key, (expires, _) in list(_manifest_cache.items()):
+                if expires <= now:
+                    del _manifest_cache[key]
+            while len(_manifest_cache) >= MANIFEST_CACHE_SIZE:
+                del _manifest_cache[next(iter(_manifest_cache))]
+        _manifest_cache[blob_name] = (now + MANIFEST_TTL, manifest)
+    return manifest
+
+
+def load_previews(file_urls):
+    # Fetches the manifests for a page of tracks concurrently, in order
+    return list(_manifest_pool.map(load_preview, file_urls))
+
+
+def waveform_svg(peaks, width=600, height=48, color='#ff4b4b'):
+    # Mirrored bar waveform, drawn as inline SVG (no extra request)
+    if not peaks:
+        return ''
+    top = max(peaks) or 1
+    bar = width / len(peaks)
+    bars = []
+    for i, peak in enumerate(peaks):
+        h = max(1.0, peak / top * (height - 2))
+        bars.append(f'<rect x="{i * bar:.1f}" y="{(height - h) / 2:.1f}" width="{max(bar - 1, 1):.1f}" height="{h:.1f}"/>')
+    return (f'<svg viewBox="0 0 {width} {height}" width="100%" height="{height}" '
+            f'preserveAspectRatio="none" fill="{color}">{"".join(bars)}</svg>')
@@ -0,0 +1,231 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from logging.handlers import RotatingFileHandler
+
+from metrics import registry
+
+# Opt-in rerun profiling. Switch it on for the whole server with JAARVIS_PROFILE=1,
+# or for one browser tab by adding ?profile=1 to the URL. Every page run then
+# appends a JSON line with its section timings to <dir>/reruns.jsonl (rotated),
+# and runs slower than JAARVIS_PROFILE_SLOW_MS also get a sampled call-stack
+# profile in collapsed ("folded") format, ready for flamegraph.pl or speedscope.
+PROFILE_ENABLED = os.environ.get('JAARVIS_PROFILE') == '1'
+PROFILE_QUERY_PARAM = 'profile'
+PROFILE_DIR = os.environ.get('JAARVIS_PROFILE_DIR', './profiles')
+SLOW_RERUN_MS = float(os.environ.get('JAARVIS_PROFILE_SLOW_MS', 500))
+# Stack sampling period for the script thread while a profiled run is active
+SAMPLE_INTERVAL = 0.005
+TIMINGS_MAX_BYTES = 5 * 1024 * 1024
+TIMINGS_BACKUPS = 5
+# Newest sampled profiles kept on disk
+MAX_PROFILE_FILES = 50
+
+_active = {}
+_active_lock = threading.Lock()
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def _timings_logger():
+    global _logger
+    if _logger is None:
+        with _logger_lock:
+            if _logger is None:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                logger = logging.getLogger('jaarvis.profiling')
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                handler = RotatingFileHandler(os.path.join(PROFILE_DIR, 'reruns.jsonl'),
+                                              maxBytes=TIMINGS_MAX_BYTES, backupCount=TIMINGS_BACKUPS)
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                logger.addHandler(handler)
+                _logger = logger
+    return _logger
+
+
+class StackSampler:
+    # Samples one thread's Python stack every `interval` seconds from a daemon
+    # thread and counts identical stacks (outermost frame first)
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rerun-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+                frame = frame.f_back
+            key = ';'.join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.stacks.items()))
+
+
+class RerunProfile:
+    def __init__(self, page, thread_id, sample=True):
+        self.page = page
+        self.thread_id = thread_id
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.sections = {}
+        self._stack = []
+        self.requests = 0
+        self.request_seconds = 0.0
+        self.sampler = StackSampler(thread_id) if sample else None
+        self.finished = False
+        self._lock = threading.Lock()
+        if self.sampler:
+            self.sampler.start()
+
+    @contextmanager
+    def section(self, name):
+        # Nested sections are recorded as "outer/inner"; repeated names add up
+        self._stack.append(name)
+        path = '/'.join(self._stack)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.sections[path] = self.sections.get(path, 0.0) + time.perf_counter() - started
+            self._stack.pop()
+
+    def note_request(self, seconds):
+        self.requests += 1
+        self.request_seconds += seconds
+
+    def finish(self, ended):
+        # ended: 'end' (reached end_rerun), 'rerun' (replaced by the next run on the
+        # same thread, e.g. after st.rerun()) or 'exit' (script thread finished
+        # without reaching end_rerun, e.g. after st.stop())
+        with self._lock:
+            if self.finished:
+                return
+            self.finished = True
+        total = time.perf_counter() - self.started
+        if self.sampler:
+            self.sampler.stop()
+        record = {
+            'ts': round(self.started_at, 3),
+            'page': self.page,
+            'total_ms': round(total * 1000, 2),
+            'sections_ms': {name: round(seconds * 1000, 2) for name, seconds in self.sections.items()},
+            # Top-level sections only, so nested time is not counted twice
+            'unaccounted_ms': round((total - sum(s for n, s in self.sections.items() if '/' not in n)) * 1000, 2),
+            'requests': self.requests,
+            'request_ms': round(self.request_seconds * 1000, 2),
+            'ended': ended,
+        }
+        if self.sampler and total * 1000 >= SLOW_RERUN_MS and self.sampler.samples:
+            record['profile'] = self._write_profile()
+        try:
+            _timings_logger().info(json.dumps(record))
+        except OSError as e:
+            print(f"Could not write rerun timings: {e}")
+
+    def _write_profile(self):
+        name = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started_at))}-{self.page}-{self.thread_id}.folded"
+        path = os.path.join(PROFILE_DIR, name.replace(' ', '_').replace(os.sep, '_'))
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(self.sampler.folded())
+            _prune_profiles()
+        except OSError as e:
+            print(f"Could not write rerun profile: {e}")
+            return None
+        return os.path.basename(path)
+
+
+def _prune_profiles():
+    files = sorted((f for f in os.listdir(PROFILE_DIR) if f.endswith('.folded')),
+                   key=lambda f: os.path.getmtime(os.path.join(PROFILE_DIR, f)))
+    for name in files[:-MAX_PROFILE_FILES]:
+        os.remove(os.path.join(PROFILE_DIR, name))
+
+
+def _query_flag():
+    try:
+        import streamlit as st
+
+        return st.query_params.get(PROFILE_QUERY_PARAM) in ('1', 'true')
+    except Exception:
+        return False
+
+
+def _watch(thread, profile):
+    # Finishes a run that never reached end_rerun once its script thread exits
+    thread.join()
+    with _active_lock:
+        if _active.get(profile.thread_id) is profile:
+            del _active[profile.thread_id]
+    profile.finish('exit')
+
+
+def begin_rerun(page):
+    # Call first thing in a page script. Returns the run's profile, or None when
+    # profiling is off for this run.
+    thread_id = threading.get_ident()
+    with _active_lock:
+        previous = _active.pop(thread_id, None)
+    if previous is not None:
+        previous.finish('rerun')
+    if not (PROFILE_ENABLED or _query_flag()):
+        return None
+    profile = RerunProfile(page, thread_id)
+    with _active_lock:
+        _active[thread_id] = profile
+    threading.Thread(target=_watch, args=(threading.current_thread(), profile), daemon=True).start()
+    return profile
+
+
+def end_rerun():
+    # Call last thing in a page script
+    with _active_lock:
+        profile = _active.pop(threading.get_ident(), None)
+    if profile is not None:
+        profile.finish('end')
+
+
+def current_profile():
+    return _active.get(threading.get_ident())
+
+
+def section(name):
+    # `with section("view: dataframe"):` times a block of a profiled run; a no-op
+    # (nullcontext) when the current run is not being profiled
+    profile = _active.get(threading.get_ident())
+    return profile.section(name) if profile is not None else nullcontext()
+
+
+def _note_request(service, method, endpoint, status, seconds):
+    # Requests made on the script thread itself block the rerun; prefetches and
+    # other background threads do not count
+    profile = _active.get(threading.get_ident())
+    if profile is not None:
+        profile.note_request(seconds)
+
+
+registry.add_observer(_note_request)
@@ -0,0 +1,275 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+from metrics import endpoint_label, registry
+
+# Tail-latency and failure control for catalog reads (list, search):
+# - Hedging: if the first request has not answered after the endpoint's recent
+#   HEDGE_PERCENTILE latency, an identical second request is sent and whichever
+#   answers first is used. At most HEDGE_BUDGET of reads are hedged, so a slow
+#   server never sees its load doubled.
+# - Deadline: a read gives up after READ_DEADLINE seconds in total, retries and
+#   hedges included, instead of holding the page script.
+# - Circuit breaker, per endpoint: after BREAKER_FAILURES failures in a row, or
+#   a failure rate of BREAKER_FAILURE_RATE over the last BREAKER_WINDOW reads,
+#   reads fail at once for BREAKER_COOLDOWN seconds; then one trial read decides
+#   whether it closes again. Callers fall back to the last cached answer.
+HEDGE_ENABLED = os.environ.get('JAARVIS_HEDGE_READS', '1') == '1'
+HEDGE_PERCENTILE = float(os.environ.get('JAARVIS_HEDGE_PERCENTILE', 0.95))
+# Delay used until an endpoint has HEDGE_MIN_SAMPLES timings, and the bounds
+# applied to the percentile-based delay
+HEDGE_DEFAULT_DELAY = 1.0
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = float(os.environ.get('JAARVIS_HEDGE_MIN_DELAY', 0.05))
+HEDGE_MAX_DELAY = 5.0
+HEDGE_BUDGET = float(os.environ.get('JAARVIS_HEDGE_BUDGET', 0.1))
+READ_DEADLINE = float(os.environ.get('JAARVIS_READ_DEADLINE', 10))
+
+BREAKER_FAILURES = int(os.environ.get('JAARVIS_BREAKER_FAILURES', 5))
+BREAKER_FAILURE_RATE = float(os.environ.get('JAARVIS_BREAKER_FAILURE_RATE', 0.5))
+BREAKER_WINDOW = 20
+BREAKER_COOLDOWN = float(os.environ.get('JAARVIS_BREAKER_COOLDOWN', 30))
+
+FAILURE_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+class CircuitOpenError(requests.RequestException):
+    pass
+
+
+class ReadTimeout(requests.Timeout):
+    pass
+
+
+class CircuitBreaker:
+    # closed -> open (after too many failures) -> half_open (after the cooldown,
+    # one trial request) -> closed on success, open again on failure
+    def __init__(self, failures=BREAKER_FAILURES, failure_rate=BREAKER_FAILURE_RATE, window=BREAKER_WINDOW,
+                 cooldown=BREAKER_COOLDOWN):
+        self.failure_threshold = failures
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self.consecutive_failures = 0
+        self.recent = deque(maxlen=window)
+        self.trips = 0
+        self.rejected = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = 'half_open'
+            if self.state == 'closed':
+                return True
+            if self.state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, ok):
+        with self._lock:
+            self.recent.append(ok)
+            if self.state == 'half_open':
+                self._trial_running = False
+                if ok:
+                    self._close()
+                else:
+                    self._open()
+                return
+            if ok:
+                self.consecutive_failures = 0
+                return
+            self.consecutive_failures += 1
+            failures = self.recent.count(False)
+            if self.state == 'closed' and (
+                    self.consecutive_failures >= self.failure_threshold
+                    or (len(self.recent) == self.recent.maxlen and failures / len(self.recent) >= self.failure_rate)):
+                self._open()
+
+    def _open(self):
+        self.state = 'open'
+        self.opened_at = time.monotonic()
+        self.trips += 1
+
+    def _close(self):
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.recent.clear()
+
+    def snapshot(self):
+        with self._lock:
+            retry_in = self.cooldown - (time.monotonic() - self.opened_at) if self.state == 'open' else 0.0
+            return {'state': self.state, 'trips': self.trips, 'rejected': self.rejected,
+                    'retry_in_s': round(max(retry_in, 0.0), 1)}
+
+
+class EndpointReadStats:
+    def __init__(self):
+        self.reads = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.hedges_skipped = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.stale_served = 0
+
+
+class GuardedReader:
+    # Sends GET requests through an ApiClient with hedging, an overall deadline
+    # and a per-endpoint circuit breaker
+    def __init__(self, client, hedge=HEDGE_ENABLED, deadline=READ_DEADLINE, budget=HEDGE_BUDGET,
+                 percentile=HEDGE_PERCENTILE, max_workers=16):
+        self.client = client
+        self.hedge = hedge
+        self.deadline = deadline
+        self.budget = budget
+        self.percentile = percentile
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='api-read')
+        self._breakers = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _endpoint(self, path):
+        label = endpoint_label('GET', self.client.url(path))
+        with self._lock:
+            if label not in self._breakers:
+                self._breakers[label] = CircuitBreaker()
+                self._stats[label] = EndpointReadStats()
+            return label, self._breakers[label], self._stats[label]
+
+    def hedge_delay(self, endpoint):
+        seconds = registry.latency_percentile('api', 'GET', endpoint, self.percentile, min_count=HEDGE_MIN_SAMPLES)
+        if seconds is None:
+            return HEDGE_DEFAULT_DELAY
+        return min(max(seconds, HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+
+    def _attempt(self, path, params, headers):
+        # Timeouts per attempt are capped by the deadline so a hung connection
+        # does not keep a pool thread for the client's full read timeout
+        connect, read = self.client.timeout
+        return self.client.get(path, params=params, headers=headers, timeout=(connect, min(read, self.deadline)))
+
+    def get(self, path, params=None, headers=None):
+        # Returns the first usable response (anything but 429/5xx). Raises
+        # CircuitOpenError while the endpoint's breaker is open, ReadTimeout when
+        # nothing answered within the deadline, or the error of the last attempt;
+        # a 429/5xx response is returned when that is all there was.
+        endpoint, breaker, stats = self._endpoint(path)
+        if not breaker.allow():
+            raise CircuitOpenError(f'{endpoint} is failing; not calling it for now')
+        started = time.monotonic()
+        with self._lock:
+            stats.reads += 1
+        # No hedging while the endpoint's last read failed: a slow attempt is then
+        # most likely sitting out urllib3's retry backoff, and a hedge only adds load
+        hedging = self.hedge and breaker.consecutive_failures == 0
+        hedge_at = started + self.hedge_delay(endpoint) if hedging else None
+        attempts = {self._pool.submit(self._attempt, path, params, headers): 'first'}
+        winner = failed_response = error = None
+
+        while attempts and winner is None:
+            now = time.monotonic()
+            remaining = started + self.deadline - now
+            if remaining <= 0:
+                break
+            timeout = remaining if hedge_at is None else min(remaining, max(hedge_at - now, 0))
+            done, _ = wait(list(attempts), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if hedge_at is not None and time.monotonic() >= hedge_at:
+                    # The first attempt is slow: race an identical one against it,
+                    # budget permitting
+                    hedge_at = None
+                    with self._lock:
+                        allowed = stats.hedged < self.budget * stats.reads
+                        if allowed:
+                            stats.hedged += 1
+                        else:
+                            stats.hedges_skipped += 1
+                    if allowed:
+                        attempts[self._pool.submit(self._attempt, path, params, headers)] = 'hedge'
+                continue
+            for future in done:
+                kind = attempts.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if response.status_code in FAILURE_STATUSES:
+                    failed_response = response
+                    continue
+                winner = (response, kind)
+                break
+            # A fast failure is not hedged; urllib3 has already retried it
+
+        # Attempts still running are left to finish on their own
+        if winner is not None:
+            breaker.record(True)
+            if winner[1] == 'hedge':
+                with self._lock:
+                    stats.hedge_wins += 1
+            return winner[0]
+        breaker.record(False)
+        with self._lock:
+            if attempts:
+                stats.timeouts += 1
+            else:
+                stats.failures += 1
+        if attempts:
+            raise ReadTimeout(f'{endpoint} did not answer within {self.deadline:g}s')
+        if failed_response is not None:
+            return failed_response
+        raise error
+
+    def note_stale(self, path):
+        # Called by callers that answered from their cache instead
+        _, _, stats = self._endpoint(path)
+        with self._lock:
+            stats.stale_served += 1
+
+    def snapshot(self):
+        # One row per endpoint read through this reader
+        with self._lock:
+            items = sorted(self._stats.items())
+        rows = []
+        for endpoint, stats in items:
+            rows.append(dict({
+                'endpoint': endpoint,
+                'reads': stats.reads,
+                'hedged': stats.hedged,
+                'hedge_wins': stats.hedge_wins,
+                'hedges_skipped': stats.hedges_skipped,
+                'hedge_delay_ms': round(self.hedge_delay(endpoint) * 1000, 1),
+                'timeouts': stats.timeouts,
+                'failures': stats.failures,
+                'stale_served': stats.stale_served,
+            }, **{f'breaker_{k}': v for k, v in self._breakers[endpoint].snapshot().items()}))
+        return rows
+
+    def prometheus_families(self):
+        # For metrics.MetricsRegistry.add_collector
+        rows = self.snapshot()
+        counters = [
+            ('read_hedges_total', 'hedged', 'Reads that sent a hedge request.'),
+            ('read_hedge_wins_total', 'hedge_wins', 'Hedged reads answered first by the hedge.'),
+            ('read_timeouts_total', 'timeouts', 'Reads abandoned at the deadline.'),
+            ('read_stale_served_total', 'stale_served', 'Reads answered from the cache after a failure.'),
+            ('circuit_breaker_trips_total', 'breaker_trips', 'Times the circuit breaker opened.'),
+            ('circuit_breaker_rejected_total', 'breaker_rejected', 'Reads failed fast by an open breaker.'),
+        ]
+        families = []
+        for name, key, help_text in counters:
+            families.append((name, 'counter', help_text, [({'endpoint': row['endpoint']}, row[key]) for row in rows]))
+        families.append(('circuit_breaker_open', 'gauge', '1 while the breaker is open or half open.',
+                         [({'endpoint': row['endpoint']}, int(row['breaker_state'] != 'closed')) for row in rows]))
+        return families
+
@@ -0,0 +1,194 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Catalog read cache defaults; a TTL of 0 disables caching
+CACHE_TTL = float(os.environ.get('JAARVIS_CACHE_TTL', 30))
+CACHE_MAX_ENTRIES = int(os.environ.get('JAARVIS_CACHE_MAX_ENTRIES', 512))
+CACHE_MAX_BYTES = int(os.environ.get('JAARVIS_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+# Expired entries whose response carried an ETag or Last-Modified are checked
+# with a conditional GET; a 304 renews them without downloading the body again
+CACHE_REVALIDATE = os.environ.get('JAARVIS_CACHE_REVALIDATE', '1') == '1'
+
+
+class CacheEntry:
+    __slots__ = ('body', 'expires_at', 'audio_ids', 'etag', 'last_modified')
+
+    def __init__(self, body, expires_at, audio_ids, etag=None, last_modified=None):
+        self.body = body
+        self.expires_at = expires_at
+        self.audio_ids = audio_ids
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class ResponseCache:
+    # Process-wide TTL + LRU cache of raw JSON response bodies. Bodies are stored
+    # as bytes so the memory cap is exact and every hit hands back a fresh object
+    # (pages mutate the dicts they get). Each entry remembers the audio_ids it
+    # contains so mutations can drop just the entries that show that track.
+    #
+    # Keys are tuples whose first item is the kind of read, e.g.
+    # ('list', page, sort_by, order, limit) or ('search', artist_name, track_name).
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.revalidations = 0
+        self.revalidated_bytes = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
+
+    def get(self, key, decode=json.loads):
+        # decode turns the stored body into the value returned (see
+        # columnar.decode_list_response for a DataFrame instead of dicts)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= time.monotonic():
+                # Expired entries stay (until evicted or invalidated) as the
+                # fallback get_stale() serves while the API is failing
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            body = entry.body
+        return decode(body)
+
+    def get_stale(self, key, decode=json.loads):
+        # Last answer stored under key, however old; None if there is none
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self.stale_hits += 1
+            body = entry.body
+        return decode(body)
+
+    def conditional_headers(self, key):
+        # If-None-Match / If-Modified-Since for the entry under key (expired or
+        # not), or None when there is nothing to revalidate
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            headers = {}
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+            return headers or None
+
+    def revalidated(self, key, decode=json.loads):
+        # The server answered 304 for key: the stored body is current for another
+        # TTL. None if the entry was dropped meanwhile (e.g. by a mutation).
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry.expires_at = time.monotonic() + self.ttl
+            self._entries.move_to_end(key)
+            self.revalidations += 1
+            self.revalidated_bytes += len(entry.body)
+            body = entry.body
+        return decode(body)
+
+    def put(self, key, body, data, etag=None, last_modified=None, audio_ids=None):
+        # audio_ids: the tracks the body shows, when data is not the plain
+        # response.json() dict they can be read from
+        if not self.enabled or len(body) > self.max_bytes:
+            return
+        if audio_ids is None:
+            items = data.get('data') if isinstance(data, dict) else None
+            audio_ids = frozenset(item.get('audio_id') for item in items or [] if isinstance(item, dict))
+        entry = CacheEntry(bytes(body), time.monotonic() + self.ttl, audio_ids, etag, last_modified)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += len(entry.body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, predicate):
+        # Drops every entry for which predicate(key, entry) is true
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if predicate(key, entry)]
+            for key in stale:
+                self._remove(key)
+            self.invalidations += len(stale)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'stale_hits': self.stale_hits,
+                'revalidations': self.revalidations,
+                'revalidated_bytes': self.revalidated_bytes,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+def _matches_search(key, artist_name, track_name):
+    # Whether a cached search could now include a track with these names
+    _, search_artist, search_track = key
+    if search_artist and artist_name and search_artist.lower() in artist_name.lower():
+        return True
+    if search_track and track_name and search_track.lower() in track_name.lower():
+        return True
+    return False
+
+
+def invalidate_for_upload(cache, artist_name, track_name):
+    # A new track can land on any list page (and shifts the ones after it), and
+    # shows up in searches its names match
+    return cache.invalidate(lambda key, entry: key[0] == 'list' or (
+        key[0] == 'search' and _matches_search(key, artist_name, track_name)))
+
+
+def invalidate_for_update(cache, audio_id, fields):
+    # Entries showing the track are stale, lists sorted by a changed field may
+    # reorder, and searches matching the new names may now include it
+    def affected(key, entry):
+        if audio_id in entry.audio_ids:
+            return True
+        if key[0] == 'list':
+            return key[2] in fields
+        return key[0] == 'search' and _matches_search(key, fields.get('artistName'), fields.get('trackName'))
+
+    return cache.invalidate(affected)
+
+
+def invalidate_for_delete(cache, audio_id):
+    # Removing a track shifts every later list page; searches only change if they showed it
+    return cache.invalidate(lambda key, entry: key[0] == 'list' or audio_id in entry.audio_ids)
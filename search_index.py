@@ -0,0 +1,350 @@
+import heapq
+import os
+import string
+import threading
+import time
+import unicodedata
+from array import array
+from collections import Counter
+from functools import lru_cache
+
+from api_calls import add_mutation_listener, remove_mutation_listener
+
+# Fraction of the query's trigrams a name has to share to count as a match;
+# lower is more typo tolerant but noisier
+MIN_SIMILARITY = 0.4
+# Tombstoned slots are reclaimed once they make up this share of the index
+COMPACT_RATIO = 0.25
+BUILD_PAGE_SIZE = 100
+# Mutations made through api_calls reach the index at once; other clients' changes
+# are picked up by a delta refresh (new uploads, at most this often) and by a
+# full rebuild (edits and deletes) swapped in once this old
+REFRESH_INTERVAL = float(os.environ.get('JAARVIS_SEARCH_REFRESH_INTERVAL', 30))
+REBUILD_INTERVAL = float(os.environ.get('JAARVIS_SEARCH_REBUILD_INTERVAL', 3600))
+# Query cost bounds: how many posting entries are counted to find candidates,
+# and how many of the best candidates are re-scored exactly
+SCAN_BUDGET = 20_000
+RERANK_LIMIT = 200
+
+
+_PUNCTUATION = str.maketrans({c: ' ' for c in string.punctuation})
+
+
+def normalize(text):
+    # Lowercase, strip accents and punctuation so "Beyoncé!" matches "beyonce"
+    text = str(text or '').lower()
+    if text.isascii():
+        return text.translate(_PUNCTUATION)
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(c if c.isalnum() else ' ' for c in text if not unicodedata.combining(c))
+
+
+def padded(text):
+    # "Taylor Swift" -> "  taylor   swift ", the same padding trigrams() uses per word
+    return ''.join(f'  {word} ' for word in normalize(text).split())
+
+
+def trigrams(text, prefix=False):
+    # Word-level trigrams padded so word starts are anchored ("  t", " ta", "tay").
+    # With prefix=True the last word is treated as still being typed and gets no
+    # closing gram, so "tay" matches "taylor" fully.
+    words = normalize(text).split()
+    grams = set()
+    for i, word in enumerate(words):
+        padded = f'  {word}' if prefix and i == len(words) - 1 else f'  {word} '
+        grams.update(padded[j:j + 3] for j in range(len(padded) - 2))
+    return grams
+
+
+@lru_cache(maxsize=4096)
+def artist_keys(name):
+    # Artist names repeat across many tracks, so their keys are worth caching
+    return frozenset('a' + g for g in trigrams(name))
+
+
+def track_keys(name):
+    return {'t' + g for g in trigrams(name)}
+
+
+class SearchIndex:
+    # In-memory trigram index over artistName and trackName. Postings are compact
+    # unsigned int arrays of track slots, keyed by field + trigram ('a' or 't'
+    # followed by the gram), so artist and track queries only hit their own field.
+    # Edits and deletes tombstone the old slot; compact() rebuilds once enough
+    # slots are dead.
+
+    def __init__(self, min_similarity=MIN_SIMILARITY):
+        self.min_similarity = min_similarity
+        self.postings = {}
+        self.audio_ids = []
+        self.artists = []
+        self.tracks = []
+        self.urls = []
+        self.slot_by_id = {}
+        self.dead = set()
+        self._names = {}
+        self._lock = threading.RLock()
+        self.ready = False
+        # created_at of the newest record seen, for refresh()
+        self.cursor = None
+        self.built_at = 0.0
+        self.refreshed_at = 0.0
+
+    def __len__(self):
+        return len(self.slot_by_id)
+
+    def _intern(self, name):
+        # Artist names repeat across tracks; keep one string per distinct name
+        name = name or ''
+        return self._names.setdefault(name, name)
+
+    def _add(self, record):
+        audio_id = record.get('audio_id')
+        if not audio_id:
+            return
+        if audio_id in self.slot_by_id:
+            self._remove(audio_id)
+        slot = len(self.audio_ids)
+        artist = self._intern(record.get('artistName'))
+        track = record.get('trackName') or ''
+        self.audio_ids.append(audio_id)
+        self.artists.append(artist)
+        self.tracks.append(track)
+        self.urls.append(record.get('fileUrl'))
+        keys = self._keys(artist, track)
+        for key in keys:
+            posting = self.postings.get(key)
+            if posting is None:
+                posting = self.postings[key] = array('I')
+            posting.append(slot)
+        self.slot_by_id[audio_id] = slot
+
+    def _remove(self, audio_id):
+        slot = self.slot_by_id.pop(audio_id, None)
+        if slot is not None:
+            self.dead.add(slot)
+
+    def add(self, records):
+        with self._lock:
+            for record in records:
+                self._add(record)
+
+    def remove(self, audio_id):
+        with self._lock:
+            self._remove(audio_id)
+            if len(self.dead) > COMPACT_RATIO * max(len(self.audio_ids), 1):
+                self.compact()
+
+    def update(self, audio_id, fields):
+        with self._lock:
+            slot = self.slot_by_id.get(audio_id)
+            if slot is None:
+                return
+            record = {
+                'audio_id': audio_id,
+                'artistName': self.artists[slot],
+                'trackName': self.tracks[slot],
+                'fileUrl': self.urls[slot],
+            }
+            record.update({k: v for k, v in fields.items() if k in record})
+            self._add(record)
+            if len(self.dead) > COMPACT_RATIO * len(self.audio_ids):
+                self.compact()
+
+    def compact(self):
+        with self._lock:
+            live = [self._record(slot) for slot in sorted(self.slot_by_id.values())]
+            self.postings = {}
+            self.audio_ids, self.artists, self.tracks, self.urls = [], [], [], []
+            self.slot_by_id = {}
+            self.dead = set()
+            self._names = {}
+            for record in live:
+                self._add(record)
+
+    def _keys(self, artist, track):
+        return artist_keys(artist) | track_keys(track)
+
+    def _record(self, slot):
+        return {
+            'audio_id': self.audio_ids[slot],
+            'artistName': self.artists[slot],
+            'trackName': self.tracks[slot],
+            'fileUrl': self.urls[slot],
+        }
+
+    def search(self, artist_name='', track_name='', limit=20):
+        # Ranked, typo-tolerant lookup; either field may be empty. Results use the
+        # same keys as API records plus a 'score' between 0 and 1.
+        query = {'a' + g for g in trigrams(artist_name, prefix=True)}
+        query |= {'t' + g for g in trigrams(track_name, prefix=True)}
+        if not query:
+            return []
+
+        with self._lock:
+            # Candidates come from the rarest grams first, stopping once SCAN_BUDGET
+            # posting entries have been counted, so very common grams ("  t", "the")
+            # cost nothing. A posting too big for what is left of the budget only
+            # contributes its newest tracks. The best candidates are re-scored exactly.
+            postings = sorted((self.postings[key] for key in query if key in self.postings), key=len)
+            hits = Counter()
+            remaining = SCAN_BUDGET
+            for posting in postings:
+                if remaining <= 0:
+                    break
+                if len(posting) > remaining:
+                    posting = posting[-remaining:]
+                hits.update(posting)
+                remaining -= len(posting)
+            for slot in self.dead.intersection(hits):
+                del hits[slot]
+
+            # A query gram is in a name exactly when it is a substring of the name's
+            # padded form, which is much cheaper than rebuilding its gram set
+            artist_grams = [key[1:] for key in query if key[0] == 'a']
+            track_grams = [key[1:] for key in query if key[0] == 't']
+            results = []
+            for slot, _ in hits.most_common(RERANK_LIMIT):
+                artist = padded(self.artists[slot])
+                track = padded(self.tracks[slot])
+                matched = sum(g in artist for g in artist_grams) + sum(g in track for g in track_grams)
+                similarity = matched / len(query)
+                if similarity >= self.min_similarity:
+                    # Nudge towards shorter names, i.e. less unmatched text
+                    results.append((similarity - 0.001 * (len(artist) + len(track)), slot, similarity))
+            best = heapq.nlargest(limit, results)
+            return [dict(self._record(slot), score=round(similarity, 3)) for _, slot, similarity in best]
+
+    def build(self, fetch, page_size=BUILD_PAGE_SIZE):
+        # Fills the index from a paged catalog reader with fetch_audio_files' signature
+        page = 1
+        while True:
+            result = fetch(page, sort_by='created_at', order='desc', limit=page_size)
+            if result is None:
+                raise RuntimeError(f'Could not load catalog page {page} for the search index')
+            records = result.get('data') or []
+            if page == 1 and records:
+                self.cursor = records[0].get('created_at')
+            self.add(records)
+            if len(records) < page_size:
+                break
+            page += 1
+        self.built_at = self.refreshed_at = time.monotonic()
+        self.ready = True
+        return len(self)
+
+    def refresh(self, fetch, page_size=BUILD_PAGE_SIZE):
+        # Adds records uploaded since the cursor, by any client: walks created_at
+        # desc and stops at the first record older than the cursor. Returns how
+        # many were added.
+        from catalog_mirror import created_timestamp
+
+        cursor_ts = created_timestamp(self.cursor)
+        added = 0
+        page = 1
+        newest = self.cursor
+        while True:
+            result = fetch(page, sort_by='created_at', order='desc', limit=page_size)
+            if result is None:
+                raise RuntimeError(f'Could not load catalog page {page} for the search index')
+            records = result.get('data') or []
+            if page == 1 and records:
+                newest = records[0].get('created_at')
+            fresh = [r for r in records if created_timestamp(r.get('created_at')) >= cursor_ts]
+            with self._lock:
+                new = [r for r in fresh if r.get('audio_id') not in self.slot_by_id]
+                self.add(new)
+            added += len(new)
+            if len(fresh) < len(records) or len(records) < page_size:
+                break
+            page += 1
+        self.cursor = newest
+        self.refreshed_at = time.monotonic()
+        return added
+
+    def apply_mutation(self, kind, audio_id, fields, result):
+        # api_calls mutation listener
+        if not isinstance(result, dict) or not result.get('success'):
+            return
+        if kind == 'upload' and isinstance(result.get('data'), dict):
+            self.add([result['data']])
+        elif kind == 'update' and audio_id:
+            self.update(audio_id, fields)
+        elif kind == 'delete' and audio_id:
+            self.remove(audio_id)
+
+
+_index = None
+_index_lock = threading.Lock()
+_refreshing = False
+
+
+def get_search_index():
+    # Process-wide index, built from the catalog on a background thread the first
+    # time it is asked for; check `.ready` before relying on it
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                from catalog_mirror import fetch_catalog_page
+
+                index = SearchIndex()
+                add_mutation_listener(index.apply_mutation)
+
+                def build():
+                    global _index
+                    try:
+                        index.build(fetch_catalog_page)
+                    except Exception as e:
+                        print(f"Search index build failed: {e}")
+                        # Let the next caller try again
+                        remove_mutation_listener(index.apply_mutation)
+                        with _index_lock:
+                            _index = None
+
+                threading.Thread(target=build, name='search-index-build', daemon=True).start()
+                _index = index
+    index = _index
+    _schedule_refresh(index)
+    return index
+
+
+def _schedule_refresh(index):
+    # Refreshes (or, once REBUILD_INTERVAL has passed, rebuilds and swaps) the
+    # index on a background thread when it is due; callers never wait for it
+    global _refreshing
+    now = time.monotonic()
+    if not index.ready or now - index.refreshed_at < REFRESH_INTERVAL:
+        return
+    with _index_lock:
+        if _refreshing:
+            return
+        _refreshing = True
+    rebuild = now - index.built_at >= REBUILD_INTERVAL
+
+    def run():
+        global _index, _refreshing
+        from catalog_mirror import fetch_catalog_page
+
+        try:
+            if rebuild:
+                fresh = SearchIndex(index.min_similarity)
+                add_mutation_listener(fresh.apply_mutation)
+                try:
+                    fresh.build(fetch_catalog_page)
+                except Exception:
+                    remove_mutation_listener(fresh.apply_mutation)
+                    raise
+                with _index_lock:
+                    _index = fresh
+                remove_mutation_listener(index.apply_mutation)
+            else:
+                index.refresh(fetch_catalog_page)
+        except Exception as e:
+            print(f"Search index refresh failed: {e}")
+            # Try again after another interval rather than on every rerun
+            index.refreshed_at = time.monotonic()
+        finally:
+            _refreshing = False
+
+    threading.Thread(target=run, name='search-index-refresh', daemon=True).start()
@@ -0,0 +1,92 @@
+import os
+import threading
+
+# Request coalescing for catalog reads. Streamlit runs every session's script on
+# its own thread in one process, so when many users open the Stream tab at once
+# they all miss the response cache together and send the same GET. Here the
+# first caller for a key makes the call and everyone who asks for the same key
+# while it is in flight waits for it and gets the same result. Only reads go
+# through this; mutations are never coalesced.
+SINGLE_FLIGHT = os.environ.get('JAARVIS_SINGLE_FLIGHT', '1') == '1'
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, enabled=SINGLE_FLIGHT):
+        self.enabled = enabled
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+        self.peak_waiters = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        # fn(*args, **kwargs), unless a call for key is already running, in which
+        # case its result is returned (or its exception raised) instead. The
+        # result is shared between callers, so it must not be mutated.
+        if not self.enabled:
+            return fn(*args, **kwargs)
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+                leader = True
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+                self.peak_waiters = max(self.peak_waiters, call.waiters)
+                leader = False
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def forget(self):
+        # Calls already in flight keep their waiters, but later callers start a
+        # new call; used after a mutation, whose effect a running read may miss
+        with self._lock:
+            self._calls.clear()
+
+    def snapshot(self):
+        with self._lock:
+            requested = self.calls + self.coalesced
+            return {
+                'calls': self.calls,
+                'coalesced': self.coalesced,
+                'saved_rate': self.coalesced / requested if requested else 0.0,
+                'in_flight': len(self._calls),
+                'peak_waiters': self.peak_waiters,
+            }
+
+    def prometheus_families(self):
+        # For metrics.MetricsRegistry.add_collector
+        stats = self.snapshot()
+        return [
+            ('single_flight_calls_total', 'counter', 'Catalog reads sent to the API by single-flight.',
+             [({}, stats['calls'])]),
+            ('single_flight_coalesced_total', 'counter',
+             'Catalog reads answered by joining an identical read already in flight.', [({}, stats['coalesced'])]),
+            ('single_flight_in_flight', 'gauge', 'Distinct catalog reads in flight.', [({}, stats['in_flight'])]),
+        ]
@@ -0,0 +1,147 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from api_calls import add_mutation_listener
+from catalog_mirror import fetch_catalog_page
+from response_cache import CACHE_TTL
+
+PAGE_SIZE = 10
+# Pages further than this from the one on screen are dropped, so at most
+# 2 * KEEP_RADIUS + 1 pages are held per sort order
+KEEP_RADIUS = 2
+# A held page is asked for again once it is this old, so changes made by other
+# clients show up; the read is usually answered by the response cache or a 304
+PAGE_MAX_AGE = CACHE_TTL
+
+# Shared by every session; prefetches are small and short-lived
+_prefetch_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='stream-prefetch')
+
+# Bumped on every upload, edit or delete made in this process (any session,
+# write-behind journal included); pagers holding pages from before drop them
+_generation = 0
+
+
+def _on_mutation(kind, audio_id, fields, result):
+    global _generation
+    _generation += 1
+
+
+add_mutation_listener(_on_mutation)
+
+
+class StreamPager:
+    # Page-by-page view of the catalog for one sort order. Lives in
+    # st.session_state, so pages already seen are served from memory when the user
+    # goes back, and the next page is fetched in the background while the current
+    # one is on screen.
+
+    def __init__(self, sort_by='created_at', order='desc', limit=PAGE_SIZE, keep_radius=KEEP_RADIUS):
+        self.sort_by = sort_by
+        self.order = order
+        self.limit = limit
+        self.keep_radius = keep_radius
+        self.current = 1
+        self.pages = {}
+        self.pending = {}
+        # Pages answered from the response cache while the API was failing; they
+        # are fetched again each time they are shown until a fresh copy arrives
+        self.stale = set()
+        self.loaded_at = {}
+        self.generation = _generation
+        self.requests = 0
+
+    def _fetch(self, page):
+        result = fetch_catalog_page(page, sort_by=self.sort_by, order=self.order, limit=self.limit, stale_ok=True)
+        if result is None or not result.get('success', True):
+            return None
+        if result.get('stale'):
+            self.stale.add(page)
+        else:
+            self.stale.discard(page)
+        return result['data']
+
+    def _collect(self, page):
+        # Moves a finished (or still running) prefetch into the loaded pages
+        future = self.pending.pop(page, None)
+        if future is not None:
+            try:
+                data = future.result()
+            except Exception:
+                data = None
+            if data is not None:
+                self.pages[page] = data
+                self.loaded_at[page] = time.monotonic()
+
+    def _expired(self, page):
+        return time.monotonic() - self.loaded_at.get(page, 0.0) > PAGE_MAX_AGE
+
+    def get(self, page):
+        if self.generation != _generation:
+            # The catalog changed since these pages were loaded
+            self.generation = _generation
+            self._drop()
+        self._collect(page)
+        if page not in self.pages or page in self.stale or self._expired(page):
+            self.requests += 1
+            data = self._fetch(page)
+            if data is None:
+                return self.pages.get(page)
+            self.pages[page] = data
+            self.loaded_at[page] = time.monotonic()
+        return self.pages[page]
+
+    def is_stale(self, page=None):
+        return (self.current if page is None else page) in self.stale
+
+    def prefetch(self, page):
+        if page < 1 or (page in self.pages and not self._expired(page)) or page in self.pending:
+            return
+        self.requests += 1
+        self.pending[page] = _prefetch_pool.submit(self._fetch, page)
+
+    def _evict(self):
+        for page in list(self.pages):
+            if abs(page - self.current) > self.keep_radius:
+                del self.pages[page]
+                self.loaded_at.pop(page, None)
+                self.stale.discard(page)
+        for page in list(self.pending):
+            if abs(page - self.current) > self.keep_radius:
+                self.pending.pop(page).cancel()
+
+    def show(self, page=None):
+        # Returns the tracks for `page` (default: the current one) and starts
+        # loading the page after it
+        if page is not None:
+            self.current = max(1, page)
+        data = self.get(self.current)
+        if data is not None and len(data) == self.limit:
+            self.prefetch(self.current + 1)
+        self._evict()
+        return data
+
+    def has_next(self):
+        data = self.pages.get(self.current)
+        if data is None or len(data) < self.limit:
+            return False
+        # If the next page has already arrived empty there is nothing more to show
+        future = self.pending.get(self.current + 1)
+        if future is not None and future.done():
+            self._collect(self.current + 1)
+        next_page = self.pages.get(self.current + 1)
+        return next_page is None or len(next_page) > 0
+
+    def go(self, step):
+        self.current = max(1, self.current + step)
+
+    def _drop(self):
+        self.pages.clear()
+        self.loaded_at.clear()
+        self.stale.clear()
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+
+    def reset(self):
+        self.current = 1
+        self._drop()
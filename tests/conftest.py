@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_gcs import FakeBucketStore, FakeGcsServer
+from benchmarks.stub_server import StubApiServer
+
+# api_calls and gcs_upload read their endpoints at import, so the stand-ins are
+# started and pointed at before any test module imports them. Local state
+# (digest index, journal, mirror) goes to a scratch directory, and failed
+# requests are retried without backoff.
+_stub = StubApiServer().start()
+_gcs = FakeGcsServer(store=FakeBucketStore()).start()
+_scratch = tempfile.mkdtemp(prefix='jaarvis-tests-')
+os.environ.update({
+    'JAARVIS_API_BASE_URL': _stub.base_url,
+    'STORAGE_EMULATOR_HOST': _gcs.endpoint,
+    'JAARVIS_DIGEST_INDEX': os.path.join(_scratch, 'digests.sqlite3'),
+    'JAARVIS_JOURNAL_PATH': os.path.join(_scratch, 'journal.sqlite3'),
+    'JAARVIS_MIRROR_PATH': os.path.join(_scratch, 'mirror.sqlite3'),
+    'JAARVIS_BACKOFF_FACTOR': '0',
+})
+
+
+@pytest.fixture
+def stub():
+    # The stand-in API with an empty catalog, and an empty response cache
+    import api_calls
+
+    with _stub.catalog.lock:
+        _stub.catalog.records.clear()
+    api_calls.response_cache.clear()
+    return _stub
+
+
+@pytest.fixture
+def gcs():
+    # The stand-in bucket, emptied. The emulator takes anonymous requests, so no
+    # service account is loaded for the GCS session.
+    import api_calls
+    from gcs_upload import upload_session
+
+    if api_calls._gcs_session is None:
+        api_calls._gcs_session = upload_session(None)
+    with _gcs.store.lock:
+        _gcs.store.objects.clear()
+    return _gcs
@@ -0,0 +1,99 @@
+import asyncio
+import io
+import os
+import time
+
+import pytest
+
+from async_client import AsyncJaarvisClient
+from gcs_upload import CHUNK_ALIGNMENT, ResumableUploadError
+
+BUCKET = 'dsci551-project'
+
+
+def audio(size):
+    file = io.BytesIO(os.urandom(size))
+    file.name = 'track.wav'
+    return file
+
+
+def run(coroutine_fn, **kwargs):
+    async def main():
+        async with AsyncJaarvisClient(**kwargs) as client:
+            return await coroutine_fn(client)
+
+    return asyncio.run(main())
+
+
+def test_concurrency_is_bounded(stub, monkeypatch):
+    stub.catalog.seed(5)
+    monkeypatch.setattr(stub.faults, 'latency', 0.05)
+    started = time.perf_counter()
+    pages = run(lambda client: client.fetch_pages(range(1, 13), limit=1), max_concurrency=3)
+    # 12 requests of at least 50 ms, three at a time
+    assert time.perf_counter() - started >= 4 * 0.05
+    assert [len(page['data']) for page in pages] == [1] * 5 + [0] * 7
+
+
+def test_per_call_timeout(stub, monkeypatch):
+    monkeypatch.setattr(stub.faults, 'latency', 0.5)
+    with pytest.raises(asyncio.TimeoutError):
+        run(lambda client: client.fetch_audio_files(timeout=0.1))
+
+
+def test_upload_streams_in_chunks(gcs):
+    file = audio(2 * CHUNK_ALIGNMENT + 1000)
+    chunk_puts = gcs.store.chunk_puts
+    file_url = run(lambda client: client.upload_file_to_gcs(file, chunk_size=CHUNK_ALIGNMENT))
+    assert gcs.store.chunk_puts - chunk_puts == 3
+    name = file_url.rsplit('/', 1)[-1]
+    assert name.endswith('.wav') and gcs.store.objects[(BUCKET, name)]['size'] == str(len(file.getvalue()))
+
+
+def test_upload_and_register_stores_the_blob_first(stub, gcs, monkeypatch):
+    seen = []
+
+    async def upload_and_register(client):
+        send_to_api = client.send_to_api
+
+        async def checked_send(track_info, timeout=None):
+            # The blob must be in the bucket before the track is registered
+            seen.append((BUCKET, track_info['file_url'].rsplit('/', 1)[-1]) in gcs.store.objects)
+            return await send_to_api(track_info, timeout=timeout)
+
+        client.send_to_api = checked_send
+        return await client.upload_and_register(audio(1000), 'Artist', 'Track')
+
+    monkeypatch.setattr(gcs.store, 'latency', 0.05)
+    file_url, result = run(upload_and_register)
+    assert seen == [True]
+    assert stub.catalog.records[result['data']['audio_id']]['fileUrl'] == file_url
+
+
+def test_failed_upload_registers_nothing(stub, gcs, monkeypatch):
+    import async_client
+
+    monkeypatch.setattr(gcs.store, 'fail_every_n_chunks', 1)
+    monkeypatch.setattr(async_client, 'MAX_CHUNK_RETRIES', 1)
+    with pytest.raises(ResumableUploadError):
+        run(lambda client: client.upload_and_register(audio(1000), 'Artist', 'Track'))
+    assert stub.catalog.records == {} and gcs.store.objects == {}
+
+
+def test_repeat_uploads_are_not_transferred_again(stub, gcs):
+    import api_calls
+
+    file = audio(1000)
+    before = api_calls.upload_dedup_stats()
+    first, _ = run(lambda client: client.upload_and_register(file, 'Artist', 'One'))
+    chunk_puts = gcs.store.chunk_puts
+    second, _ = run(lambda client: client.upload_and_register(file, 'Artist', 'Two'))
+    assert second == first and gcs.store.chunk_puts == chunk_puts
+
+    # Not in the local index any more, but already in the bucket
+    api_calls.get_digest_index().discard(first.rsplit('/', 1)[-1].split('.')[0])
+    third, _ = run(lambda client: client.upload_and_register(file, 'Artist', 'Three'))
+    assert third == first and gcs.store.chunk_puts == chunk_puts
+    after = api_calls.upload_dedup_stats()
+    assert (after['local_hits'] - before['local_hits'], after['remote_hits'] - before['remote_hits']) == (1, 1)
+    assert len(stub.catalog.records) == 3
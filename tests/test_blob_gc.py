@@ -0,0 +1,112 @@
+import io
+
+import pytest
+
+BUCKET = 'dsci551-project'
+
+
+def url(name):
+    return f'https://storage.googleapis.com/{BUCKET}/{name}'
+
+
+class Catalog:
+    # A fetch function for blob_gc that serves one list of records per catalog
+    # walk (the last one repeats), to stand in for records moving between pages
+    # while a walk is running
+    def __init__(self, *walks):
+        self.walks = [list(records) for records in walks]
+        self.started = 0
+
+    def __call__(self, page, sort_by='created_at', order='asc', limit=100):
+        if page == 1:
+            self.started += 1
+        records = self.walks[min(max(self.started, 1), len(self.walks)) - 1]
+        return {'success': True, 'data': records[(page - 1) * limit:page * limit]}
+
+
+def record(name, n=0):
+    return {'audio_id': f'{name}-{n}', 'fileUrl': url(name)}
+
+
+def store(gcs, *names):
+    for name in names:
+        gcs.store.put_object(BUCKET, name, b'x' * 10, 'audio/wav')
+
+
+def stored(gcs):
+    return sorted(name for _, name in gcs.store.objects)
+
+
+@pytest.fixture
+def bucket(gcs):
+    store(gcs, 'live.wav', 'live.preview.mp3', 'live.preview.json',
+          'gone.wav', 'gone.preview.mp3', 'gone.preview.json', 'stray.mp3')
+    return gcs
+
+
+def test_collect_orphans_deletes_only_unreferenced_blobs(bucket):
+    import blob_gc
+
+    catalog = Catalog([record('live.wav')])
+    report = blob_gc.collect_orphans(dry_run=False, min_age_hours=0, deletes_per_second=0, fetch=catalog)
+    assert report.orphan_count == 4 and report.deleted == 4 and not report.failed
+    assert stored(bucket) == ['live.preview.json', 'live.preview.mp3', 'live.wav']
+
+
+def test_collect_orphans_dry_run_and_recent_blobs_delete_nothing(bucket):
+    import blob_gc
+
+    catalog = Catalog([record('live.wav')])
+    report = blob_gc.collect_orphans(dry_run=True, min_age_hours=0, fetch=catalog)
+    assert report.orphan_count == 4 and report.deleted == 0
+    report = blob_gc.collect_orphans(dry_run=False, min_age_hours=1, fetch=catalog)
+    assert report.skipped_recent == 4 and report.deleted == 0
+    assert len(stored(bucket)) == 7
+
+
+def test_collect_orphans_keeps_blobs_the_second_walk_finds(bucket):
+    import blob_gc
+
+    # 'gone.wav' moved to an earlier page during the first walk, which missed it
+    catalog = Catalog([record('live.wav')], [record('gone.wav'), record('live.wav')])
+    report = blob_gc.collect_orphans(dry_run=False, min_age_hours=0, deletes_per_second=0, fetch=catalog)
+    assert catalog.started == 2
+    assert report.kept_on_recheck == 3 and report.deleted == 1
+    assert 'gone.wav' in stored(bucket) and 'stray.mp3' not in stored(bucket)
+
+
+def test_delete_unreferenced_blobs_keeps_shared_blobs(bucket):
+    import blob_gc
+
+    catalog = Catalog([record('live.wav', 1), record('live.wav', 2)])
+    deleted = blob_gc.delete_unreferenced_blobs([url('live.wav'), url('gone.wav')], fetch=catalog)
+    assert deleted == 3
+    assert stored(bucket) == ['live.preview.json', 'live.preview.mp3', 'live.wav', 'stray.mp3']
+
+
+def test_delete_unreferenced_blobs_needs_two_walks_to_agree(bucket):
+    import blob_gc
+
+    catalog = Catalog([], [record('gone.wav')])
+    assert blob_gc.unreferenced_urls([url('gone.wav'), 'https://example.com/elsewhere.mp3'], fetch=catalog) == set()
+    assert catalog.started == 2
+    assert blob_gc.delete_unreferenced_blobs([url('gone.wav')], fetch=catalog) == 0
+    assert 'gone.wav' in stored(bucket)
+
+
+def test_bulk_delete_checks_references_once(stub, bucket, monkeypatch):
+    import blob_gc
+    from bulk_ops import run_bulk
+
+    live = stub.catalog.add('A', 'Live', url('live.wav'))
+    doomed = [stub.catalog.add('A', f'Gone {n}', url('gone.wav' if n else 'live.wav')) for n in range(3)]
+    checks = []
+    check = blob_gc.delete_unreferenced_blobs
+    monkeypatch.setattr(blob_gc, 'delete_unreferenced_blobs', lambda urls: checks.append(set(urls)) or check(urls))
+
+    rows = ''.join(f"{r['audio_id']},{r['fileUrl']}\n" for r in doomed)
+    report = run_bulk(io.BytesIO(f'trackID,fileUrl\n{rows}'.encode()), 'delete', planned=False)
+    assert report.blobs_deleted == 3 and report.blob_error is None
+    assert checks == [{url('live.wav'), url('gone.wav')}]
+    assert live['audio_id'] in stub.catalog.records
+    assert stored(bucket) == ['live.preview.json', 'live.preview.mp3', 'live.wav', 'stray.mp3']
@@ -0,0 +1,62 @@
+import bulk_planner
+from bulk_planner import UNKNOWN, BulkPlan, hash_function, plan_bulk
+
+
+def test_hash_function_sums_first_and_last_initials():
+    # D + P + O + T = 68 + 80 + 79 + 84 = 311, odd
+    assert hash_function('Daft Punk', 'One More Time') == 1
+    # A single word counts its initial twice: A + A + B + B = 262, even
+    assert hash_function('Abba', 'B') == 0
+    assert hash_function('A', 'Brown Cow') == 1
+    assert hash_function(None, None) == 0
+
+
+def test_uploads_are_grouped_by_the_collection_they_hash_to():
+    plan = plan_bulk('upload', ())
+    assert plan.collection({'artistName': 'Daft Punk', 'trackName': 'One More Time'}) == 1
+    assert plan.collection({'artistName': 'A', 'trackName': 'A'}) == 0
+
+
+def test_edits_are_grouped_by_each_track_s_current_collection(stub, monkeypatch):
+    monkeypatch.setattr(bulk_planner, 'PLAN_SCAN_MIN_ROWS', 1)
+    even = stub.catalog.add('A', 'A', 'https://example.com/a.mp3')
+    odd = stub.catalog.add('Daft Punk', 'One More Time', 'https://example.com/b.mp3')
+    rows = [(1, {'trackID': even['audio_id']}), (2, {'trackID': odd['audio_id']}), (3, {'trackID': 'missing'})]
+    plan = plan_bulk('edit', rows)
+    assert [plan.collection(row) for _, row in rows] == [0, 1, UNKNOWN]
+
+
+def test_the_scan_for_missing_ids_is_capped(stub, monkeypatch):
+    monkeypatch.setattr(bulk_planner, 'PLAN_SCAN_PAGE_SIZE', 10)
+    monkeypatch.setattr(bulk_planner, 'PLAN_SCAN_MAX_PAGES', 3)
+    stub.catalog.seed(100)
+    first = min(stub.catalog.records.values(), key=lambda r: r['created_at'])
+    pages = []
+    walk = bulk_planner.iter_catalog_pages
+
+    def iter_catalog_pages(page_size):
+        for records in walk(page_size):
+            pages.append(records)
+            yield records
+
+    monkeypatch.setattr(bulk_planner, 'iter_catalog_pages', iter_catalog_pages)
+    tags = bulk_planner.collection_tags([first['audio_id'], 'not in the catalog'])
+    # Three of the ten pages are read; the missing ID runs in the unknown group
+    assert len(pages) == 3 and tags == {first['audio_id']: first['collection_tag']}
+
+
+def test_small_files_without_the_mirror_are_not_scanned(stub):
+    record = stub.catalog.add('A', 'A', 'https://example.com/a.mp3')
+    plan = plan_bulk('delete', [(1, {'trackID': record['audio_id']})])
+    assert plan.tags == {} and plan.collection({'trackID': record['audio_id']}) == UNKNOWN
+
+
+def test_each_collection_gets_its_own_limiter_and_stats():
+    plan = BulkPlan('upload')
+    assert plan.limiter(0) is plan.limiter(0) and plan.limiter(0) is not plan.limiter(1)
+    plan.started(0)
+    plan.finished(0, None)
+    plan.finished(0, 'boom')
+    plan.started(1)
+    plan.finished(1, None)
+    assert [(row['collection'], row['rows'], row['failed']) for row in plan.summary()] == [('0', 2, 1), ('1', 1, 0)]
@@ -0,0 +1,31 @@
+import csv
+
+import pytest
+
+import catalog_export
+from catalog_export import export_catalog, export_formats
+
+
+def test_parquet_is_offered_only_with_pyarrow(monkeypatch):
+    monkeypatch.setattr(catalog_export, 'find_spec', lambda name: None)
+    assert export_formats() == ['csv']
+
+
+def test_csv_export_streams_every_page_in_order(stub, tmp_path):
+    stub.catalog.seed(250)
+    path = tmp_path / 'catalog.csv'
+    stats = export_catalog(str(path), 'csv', page_size=40, concurrency=3)
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    assert stats.rows == 250 and stats.pages == 7
+    assert [row['Track Name'] for row in rows] == [f'Track {i}' for i in range(250)]
+    if stats.peak_rss is not None:
+        assert stats.peak_rss > 0 and stats.rss_growth >= 0
+
+
+def test_parquet_export_rejects_values_outside_the_schema(stub, tmp_path):
+    pytest.importorskip('pyarrow')
+    record = stub.catalog.add('Artist', 'Track', 'https://example.com/a.mp3')
+    stub.catalog.records[record['audio_id']]['collection_tag'] = 'not a number'
+    with pytest.raises(ValueError, match='export as CSV'):
+        export_catalog(str(tmp_path / 'catalog.parquet'), 'parquet')
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+import columnar
+from columnar import COLUMN_NAMES, FrameBuilder, decode_list_response
+
+
+def record(i, tag=None):
+    return {'audio_id': f'id{i}', 'artistName': f'Artist {i}', 'trackName': f'Track {i}',
+            'collection_tag': i % 2 if tag is None else tag, 'extra': 'dropped'}
+
+
+def test_without_pyarrow_columns_are_plain_lists(monkeypatch):
+    monkeypatch.setattr(columnar, '_pyarrow', lambda: None)
+    builder = FrameBuilder()
+    builder.add([record(0), record(1)])
+    assert builder.pa is None and builder.batches == []
+    frame = builder.frame()
+    assert list(frame.columns) == list(COLUMN_NAMES.values())
+    assert list(frame['Track Name']) == ['Track 0', 'Track 1']
+    assert list(frame['Collection Number']) == [0, 1]
+    assert frame['URL'].isna().all()
+
+
+def test_a_value_outside_the_schema_falls_back_to_plain_columns():
+    pytest.importorskip('pyarrow')
+    builder = FrameBuilder()
+    builder.add([record(0), record(1)])
+    assert len(builder.batches) == 1
+    builder.add([record(2, tag='not a number'), record(3)])
+    # The Arrow batches decoded so far are moved over, in order
+    assert builder.pa is None and builder.batches == []
+    frame = builder.frame()
+    assert list(frame['Track ID']) == ['id0', 'id1', 'id2', 'id3']
+    assert list(frame['Collection Number']) == [0, 1, 'not a number', 1]
+
+
+def test_decode_matches_json_loads_across_batches():
+    body = json.dumps({'success': True, 'data': [record(i) for i in range(7)], 'total': 7})
+    result = decode_list_response(body.encode('utf-8'), batch_rows=3)
+    assert (result['success'], result['total']) == (True, 7)
+    assert list(result['data']['Artist Name']) == [f'Artist {i}' for i in range(7)]
+    assert decode_list_response('{"data": []}')['data'].empty
+    with pytest.raises(json.JSONDecodeError):
+        decode_list_response('{"data": [{"a": 1} {"b": 2}]}')
@@ -0,0 +1,65 @@
+from concurrency_limit import AdaptiveLimiter
+
+
+def run_saturated(limiter, calls, seconds=0.001):
+    # Every call is released while all slots are taken, then the slots are drained
+    for _ in range(calls):
+        while limiter.try_acquire():
+            pass
+        limiter.release(seconds)
+    while limiter.in_flight:
+        limiter.release()
+
+
+def test_healthy_saturated_calls_raise_the_limit():
+    limiter = AdaptiveLimiter(initial=4, maximum=8)
+    # +1/limit per call: five calls take a limit of 4 past 5
+    run_saturated(limiter, 5)
+    assert limiter.limit == 5 and limiter.increases == 1
+    # Calls that leave slots free say nothing about a higher limit
+    limiter.acquire()
+    limiter.release(0.001)
+    assert limiter.limit == 5
+
+
+def test_overload_statuses_halve_the_limit_once_per_round_trip():
+    limiter = AdaptiveLimiter(initial=8, minimum=1)
+    # Round trips take a minute, so the second failure falls in the same one
+    limiter.smoothed = 60
+    for _ in range(3):
+        limiter.acquire()
+    limiter.release(None, overloaded=True)
+    limiter.release(None, overloaded=True)
+    assert limiter.limit == 4 and limiter.decreases == 1 and limiter.overloads == 2
+    limiter.smoothed = 0
+    limiter.release(None, overloaded=True)
+    assert limiter.limit == 2 and limiter.history[-1][1] == 2
+
+
+def test_latency_spike_counts_as_overload():
+    limiter = AdaptiveLimiter(initial=4)
+    for _ in range(5):
+        limiter.acquire()
+        limiter.release(0.05)
+    limiter.smoothed = 0
+    limiter.acquire()
+    limiter.release(1.0)
+    assert limiter.overloads == 1 and limiter.limit == 2
+
+
+def test_calls_are_classified_from_their_api_requests(stub, monkeypatch):
+    import api_calls
+
+    record = stub.catalog.add('Artist', 'Track', 'https://example.com/a.mp3')
+    limiter = AdaptiveLimiter(initial=2, minimum=1)
+    assert limiter.try_acquire()
+    limiter.call(api_calls.update_audio_file, record['audio_id'], 'Artist', 'Renamed')
+    assert (limiter.overloads, limiter.limit) == (0, 2)
+
+    monkeypatch.setattr(stub.faults, 'error_rate', 1.0)
+    for status in (429, 503):
+        monkeypatch.setattr(stub.faults, 'error_status', status)
+        limiter.smoothed = 0
+        assert limiter.try_acquire()
+        limiter.call(api_calls.update_audio_file, record['audio_id'], 'Artist', 'Renamed')
+    assert (limiter.overloads, limiter.limit, limiter.in_flight) == (2, 1, 0)
@@ -0,0 +1,19 @@
+import io
+import os
+
+from gcs_upload import CHUNK_ALIGNMENT, ResumableUpload
+
+BUCKET = 'dsci551-project'
+
+
+def test_upload_resumes_after_the_connection_drops_midway(gcs, monkeypatch):
+    import api_calls
+
+    data = os.urandom(4 * CHUNK_ALIGNMENT + 1000)
+    monkeypatch.setattr(gcs.store, 'cut_every_n_chunks', 2)
+    upload = ResumableUpload(api_calls._gcs_session, BUCKET, 'cut.wav', chunk_size=CHUNK_ALIGNMENT)
+    upload.upload(io.BytesIO(data))
+    assert upload.retries >= 1 and upload.bytes_uploaded == len(data)
+    # Every cut leaves half a chunk behind; the rest is sent from the offset the
+    # server reports, so nothing is lost or written twice
+    assert gcs.store.objects[(BUCKET, 'cut.wav')]['data'] == data
@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+from mutation_journal import SENDING_TIMEOUT, MutationJournal
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return MutationJournal(str(tmp_path / 'journal.sqlite3'))
+
+
+def queued(journal):
+    return [(entry['kind'], entry['audio_id'], entry['payload'], entry['merged']) for entry in journal.entries()]
+
+
+def test_updates_to_one_track_fold_into_one_entry(journal):
+    first = journal.append('update', 'a', {'artistName': 'Old', 'trackName': 'Old'})
+    assert journal.append('update', 'a', {'trackName': 'New'}) == first
+    journal.append('update', 'b', {'trackName': 'Other'})
+    assert queued(journal) == [
+        ('update', 'a', {'artistName': 'Old', 'trackName': 'New'}, 1),
+        ('update', 'b', {'trackName': 'Other'}, 0),
+    ]
+    assert journal.stats.snapshot()['coalesced'] == 1
+
+
+def test_delete_drops_queued_updates_and_repeated_deletes(journal):
+    journal.append('upload', None, {'artist_name': 'A', 'track_name': 'T', 'file_url': 'u'})
+    journal.append('update', 'a', {'trackName': 'One'})
+    journal.append('update', 'b', {'trackName': 'Two'})
+    seq = journal.append('delete', 'a')
+    assert journal.append('delete', 'a') == seq
+    assert [(kind, audio_id, merged) for kind, audio_id, _, merged in queued(journal)] == [
+        ('upload', None, 0), ('update', 'b', 0), ('delete', 'a', 1)]
+    assert journal.stats.snapshot()['coalesced'] == 2
+
+
+def test_changes_after_a_delete_or_a_send_start_new_entries(journal):
+    journal.append('delete', 'a')
+    journal.append('update', 'a', {'trackName': 'After delete'})
+    assert [kind for kind, *_ in queued(journal)] == ['delete', 'update']
+
+    journal.discard(journal.entries()[0]['seq'])
+    entry, _ = journal._claim()
+    journal.append('update', 'a', {'artistName': 'While sending'})
+    assert entry['payload'] == {'trackName': 'After delete'}
+    assert [(e['state'], e['payload']) for e in journal.entries()] == [
+        ('sending', {'trackName': 'After delete'}), ('pending', {'artistName': 'While sending'})]
+
+
+def test_flush_sends_one_request_for_folded_updates(stub, journal):
+    record = stub.catalog.add('Artist', 'Track', 'https://example.com/a.mp3')
+    journal.append('update', record['audio_id'], {'artistName': 'New artist'})
+    journal.append('update', record['audio_id'], {'trackName': 'New track'})
+    assert journal.flush(timeout=5)
+    assert journal.stats.snapshot()['sent'] == 1 and journal.entries() == []
+    assert (stub.catalog.records[record['audio_id']]['artistName'],
+            stub.catalog.records[record['audio_id']]['trackName']) == ('New artist', 'New track')
+
+
+def test_server_errors_are_retried_and_rejections_fail(stub, journal, monkeypatch):
+    record = stub.catalog.add('Artist', 'Track', 'https://example.com/a.mp3')
+    journal.append('update', record['audio_id'], {'trackName': 'New'})
+    monkeypatch.setattr(stub.faults, 'error_rate', 1.0)
+    assert journal.flush_once() == 0
+    entry, = journal.entries()
+    assert (entry['state'], entry['attempts']) == ('pending', 1) and entry['last_error']
+
+    monkeypatch.setattr(stub.faults, 'error_status', 400)
+    # Skip the backoff
+    with journal._transaction() as db:
+        db.execute('UPDATE journal SET next_attempt = 0')
+    journal.flush_once()
+    assert [e['state'] for e in journal.entries()] == ['failed']
+
+
+def test_interrupted_sends_are_reclaimed_except_uploads(journal):
+    journal.append('upload', None, {'artist_name': 'A', 'track_name': 'T', 'file_url': 'u'})
+    journal.append('update', 'a', {'trackName': 'New'})
+    # A worker claimed both and was killed before finishing either
+    with journal._transaction() as db:
+        db.execute("UPDATE journal SET state = 'sending', claimed_at = ?", (time.time() - SENDING_TIMEOUT - 1,))
+    entry, _ = journal._claim()
+    assert (entry['kind'], entry['audio_id']) == ('update', 'a')
+    upload, update = journal.entries()
+    assert (upload['state'], update['state']) == ('failed', 'sending')
+    assert 'may already be registered' in upload['last_error']
+    assert journal.stats.snapshot()['failed'] == 1
@@ -0,0 +1,109 @@
+import time
+
+import pytest
+
+from read_guard import BREAKER_FAILURES, CircuitBreaker, CircuitOpenError, GuardedReader
+
+
+def fail(breaker, times):
+    for _ in range(times):
+        assert breaker.allow()
+        breaker.record(False)
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failures=3, cooldown=60)
+    fail(breaker, 2)
+    breaker.record(True)
+    fail(breaker, 2)
+    assert breaker.state == 'closed'
+    fail(breaker, 1)
+    assert breaker.state == 'open' and breaker.trips == 1
+    assert not breaker.allow() and breaker.rejected == 1
+
+
+def test_opens_on_failure_rate_over_a_full_window():
+    breaker = CircuitBreaker(failures=100, failure_rate=0.5, window=4, cooldown=60)
+    for ok in (True, False, True):
+        breaker.record(ok)
+    assert breaker.state == 'closed'
+    breaker.record(False)
+    assert breaker.state == 'open'
+
+
+def test_half_open_allows_one_trial_then_closes_on_success():
+    breaker = CircuitBreaker(failures=1, cooldown=0.05)
+    fail(breaker, 1)
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow() and breaker.state == 'half_open'
+    assert not breaker.allow()
+    breaker.record(True)
+    assert breaker.state == 'closed' and breaker.consecutive_failures == 0
+    assert breaker.allow()
+
+
+def test_failed_trial_opens_again():
+    breaker = CircuitBreaker(failures=1, cooldown=0.05)
+    fail(breaker, 1)
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == 'open' and breaker.trips == 2
+    assert not breaker.allow()
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class Client:
+    # Answers every GET with the next status in `statuses` (the last repeats)
+    timeout = (1, 1)
+
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def url(self, path):
+        return f'http://api.test{path}'
+
+    def get(self, path, params=None, headers=None, timeout=None):
+        self.calls += 1
+        return Response(self.statuses[min(self.calls, len(self.statuses)) - 1])
+
+
+def test_reader_fails_fast_while_the_breaker_is_open():
+    client = Client(503)
+    reader = GuardedReader(client, hedge=False)
+    for _ in range(BREAKER_FAILURES):
+        assert reader.get('/api/audio/list').status_code == 503
+    with pytest.raises(CircuitOpenError):
+        reader.get('/api/audio/list')
+    assert client.calls == BREAKER_FAILURES
+    row, = reader.snapshot()
+    assert (row['breaker_state'], row['breaker_trips'], row['breaker_rejected']) == ('open', 1, 1)
+
+
+def test_reader_success_resets_the_failure_count():
+    client = Client(*[503] * (BREAKER_FAILURES - 1), 200, 503)
+    reader = GuardedReader(client, hedge=False)
+    for _ in range(BREAKER_FAILURES + 1):
+        reader.get('/api/audio/search')
+    row, = reader.snapshot()
+    assert row['breaker_state'] == 'closed' and row['failures'] == BREAKER_FAILURES
+
+
+def test_stale_page_is_served_while_the_api_fails(stub, monkeypatch):
+    import api_calls
+
+    stub.catalog.add('Artist', 'Track', 'https://example.com/a.mp3')
+    assert api_calls.fetch_audio_files(limit=5)['data'][0]['trackName'] == 'Track'
+    # The page expires, then the API starts failing
+    for entry in api_calls.response_cache._entries.values():
+        entry.expires_at = 0
+    monkeypatch.setattr(stub.faults, 'error_rate', 1.0)
+    assert api_calls.fetch_audio_files(limit=5) is None
+    stale = api_calls.fetch_audio_files(limit=5, stale_ok=True)
+    assert stale['stale'] and stale['data'][0]['trackName'] == 'Track'
@@ -0,0 +1,110 @@
+import json
+
+from response_cache import ResponseCache, invalidate_for_delete, invalidate_for_update, invalidate_for_upload
+
+
+def page(*records):
+    data = {'success': True, 'data': list(records)}
+    return json.dumps(data).encode('utf-8'), data
+
+
+def track(audio_id, artist='Artist', name='Track'):
+    return {'audio_id': audio_id, 'artistName': artist, 'trackName': name}
+
+
+def filled_cache():
+    cache = ResponseCache(ttl=60)
+    for key, records in [
+        (('list', 1, 'created_at', 'desc', 10), [track('a'), track('b')]),
+        (('list', 2, 'artistName', 'asc', 10), [track('c')]),
+        (('search', 'Queen', ''), [track('q', artist='Queen')]),
+        (('search', '', 'Blue'), [track('b', name='Blue Monday')]),
+    ]:
+        cache.put(key, *page(*records))
+    return cache
+
+
+def keys(cache):
+    return sorted(cache._entries, key=repr)
+
+
+def test_hit_returns_a_fresh_copy():
+    cache = ResponseCache(ttl=60)
+    cache.put(('list', 1), *page(track('a')))
+    first = cache.get(('list', 1))
+    first['data'].clear()
+    assert cache.get(('list', 1))['data'] == [track('a')]
+    assert cache.stats()['hits'] == 2
+
+
+def test_expired_entry_misses_but_stays_for_stale_reads():
+    cache = ResponseCache(ttl=60)
+    cache.put(('list', 1), *page(track('a')))
+    cache._entries[('list', 1)].expires_at = 0
+    assert cache.get(('list', 1)) is None
+    assert cache.get_stale(('list', 1))['data'] == [track('a')]
+
+
+def test_lru_eviction_by_entries_and_bytes():
+    cache = ResponseCache(ttl=60, max_entries=2)
+    for n in range(3):
+        cache.put(('list', n), *page(track(str(n))))
+    assert keys(cache) == [('list', 1), ('list', 2)]
+
+    body, data = page(track('x'))
+    cache = ResponseCache(ttl=60, max_bytes=len(body) * 2)
+    for n in range(3):
+        cache.put(('list', n), body, data)
+    assert len(cache._entries) == 2 and cache.stats()['bytes'] <= len(body) * 2
+
+
+def test_upload_drops_lists_and_matching_searches():
+    cache = filled_cache()
+    assert invalidate_for_upload(cache, 'Queen', 'Bohemian Rhapsody') == 3
+    assert keys(cache) == [('search', '', 'Blue')]
+
+
+def test_update_drops_entries_showing_the_track():
+    cache = filled_cache()
+    invalidate_for_update(cache, 'b', {'fileUrl': 'https://example.com/b.mp3'})
+    # Page 1 and the Blue search show track b; the artist-sorted page does not
+    # sort by fileUrl and does not show it
+    assert keys(cache) == [('list', 2, 'artistName', 'asc', 10), ('search', 'Queen', '')]
+
+
+def test_update_drops_lists_sorted_by_a_changed_field_and_matching_searches():
+    cache = filled_cache()
+    invalidate_for_update(cache, 'z', {'artistName': 'Queen'})
+    assert keys(cache) == [('list', 1, 'created_at', 'desc', 10), ('search', '', 'Blue')]
+
+
+def test_delete_drops_lists_and_searches_showing_the_track():
+    cache = filled_cache()
+    invalidate_for_delete(cache, 'q')
+    assert keys(cache) == [('search', '', 'Blue')]
+
+
+def test_mutations_through_api_calls_invalidate_reads(stub):
+    import api_calls
+
+    record = stub.catalog.add('Artist', 'Old name', 'https://example.com/a.mp3')
+    assert api_calls.fetch_audio_files(limit=10)['data'][0]['trackName'] == 'Old name'
+    assert api_calls.search_audio_files(track_name='name')['data'][0]['trackName'] == 'Old name'
+
+    api_calls.update_audio_file(record['audio_id'], track_name='New name')
+    assert api_calls.fetch_audio_files(limit=10)['data'][0]['trackName'] == 'New name'
+    assert api_calls.search_audio_files(track_name='name')['data'][0]['trackName'] == 'New name'
+
+    api_calls.delete_audio_file(record['audio_id'])
+    assert api_calls.fetch_audio_files(limit=10)['data'] == []
+
+
+def test_async_mutations_invalidate_reads(stub):
+    import api_calls
+
+    record = stub.catalog.add('Artist', 'Track', 'https://example.com/a.mp3')
+    assert len(api_calls.fetch_audio_files(limit=10)['data']) == 1
+    # As async_client reports a delete it sent itself
+    stub.catalog.records.pop(record['audio_id'])
+    api_calls.mutation_sent('delete', record['audio_id'], None, {'success': True})
+    assert api_calls.fetch_audio_files(limit=10)['data'] == []
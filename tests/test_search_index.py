@@ -0,0 +1,77 @@
+import search_index
+from search_index import SearchIndex
+
+
+def fetch(page, **kwargs):
+    # The catalog as the API has it now, past the response cache
+    import api_calls
+
+    return api_calls.fetch_audio_files(page, fresh=True, **kwargs)
+
+
+def record(audio_id, artist, track):
+    return {'audio_id': audio_id, 'artistName': artist, 'trackName': track, 'fileUrl': f'https://example.com/{audio_id}'}
+
+
+def ids(results):
+    return [result['audio_id'] for result in results]
+
+
+def test_search_is_typo_tolerant_and_ranked():
+    index = SearchIndex()
+    index.add([record('1', 'Taylor Swift', 'Shake It Off'), record('2', 'Tailor Made', 'Other'),
+               record('3', 'Daft Punk', 'One More Time')])
+    assert ids(index.search('taylr swift'))[0] == '1'
+    assert ids(index.search(track_name='one more')) == ['3']
+    assert index.search() == []
+
+
+def test_edits_and_deletes_tombstone_the_old_slot(monkeypatch):
+    monkeypatch.setattr(search_index, 'COMPACT_RATIO', 1.0)
+    index = SearchIndex()
+    index.add([record(str(i), f'Artist {i}', f'Track {i}') for i in range(4)])
+    index.update('1', {'trackName': 'Renamed'})
+    index.remove('2')
+    assert index.dead == {1, 2} and len(index) == 3 and len(index.audio_ids) == 5
+    # The old name is still in the postings, but its slot is never returned
+    assert 'Track 1' not in [result['trackName'] for result in index.search('Artist 1', 'Track 1')]
+    assert ids(index.search('Artist 1', 'Renamed'))[0] == '1'
+    assert '2' not in ids(index.search('Artist 2'))
+
+
+def test_compact_drops_tombstones_and_keeps_live_tracks():
+    index = SearchIndex()
+    index.add([record(str(i), f'Artist {i}', f'Track {i}') for i in range(8)])
+    index.remove('0')
+    assert index.dead == {0}
+    # A third of the slots dead is past COMPACT_RATIO: the remove compacts
+    index.remove('1')
+    index.remove('2')
+    assert index.dead == set() and len(index.audio_ids) == len(index) == 5
+    assert sorted(index.slot_by_id) == ['3', '4', '5', '6', '7']
+    assert ids(index.search('Artist 5', 'Track 5'))[0] == '5'
+    assert all(slot < 5 for posting in index.postings.values() for slot in posting)
+
+
+def test_refresh_adds_only_tracks_newer_than_the_cursor(stub):
+    stub.catalog.seed(3)
+    index = SearchIndex()
+    assert index.build(fetch) == 3
+    cursor = index.cursor
+    assert cursor == max(r['created_at'] for r in stub.catalog.records.values())
+
+    stub.catalog.seed(5)
+    # Walks newest first across pages and stops at the first record it already has
+    assert index.refresh(fetch, page_size=2) == 5
+    assert len(index) == 8 and index.cursor > cursor
+    assert index.refresh(fetch, page_size=2) == 0 and len(index) == 8
+
+
+def test_mutations_reach_the_index():
+    index = SearchIndex()
+    index.apply_mutation('upload', None, None, {'success': True, 'data': record('1', 'Artist', 'Track')})
+    index.apply_mutation('update', '1', {'artistName': 'New'}, {'success': True})
+    index.apply_mutation('delete', '1', None, {'success': False})
+    assert ids(index.search('New')) == ['1']
+    index.apply_mutation('delete', '1', None, {'success': True})
+    assert len(index) == 0
@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def start_waiters(flight, key, fn, count):
+    # Calls flight.do(key, fn) from `count` threads at once; returns the threads
+    # and a list that each fills with its result or error
+    outcomes = []
+
+    def call():
+        try:
+            outcomes.append(flight.do(key, fn))
+        except Exception as e:
+            outcomes.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+
+def wait_for_waiters(flight, count):
+    deadline = time.monotonic() + 5
+    while flight.snapshot()['coalesced'] < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_waiters_share_the_leader_s_result():
+    flight = SingleFlight(enabled=True)
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {'data': ['page']}
+
+    threads, outcomes = start_waiters(flight, 'page-1', fetch, 5)
+    wait_for_waiters(flight, 4)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1 and len(outcomes) == 5
+    assert all(outcome is outcomes[0] for outcome in outcomes)
+    stats = flight.snapshot()
+    assert (stats['calls'], stats['coalesced'], stats['in_flight'], stats['peak_waiters']) == (1, 4, 0, 4)
+
+
+def test_the_leader_s_error_is_raised_in_every_waiter():
+    flight = SingleFlight(enabled=True)
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise RuntimeError('API down')
+
+    threads, outcomes = start_waiters(flight, 'page-1', fail, 3)
+    wait_for_waiters(flight, 2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(outcomes) == 3 and all(isinstance(e, RuntimeError) and str(e) == 'API down' for e in outcomes)
+    # The failed call is not remembered: the next caller tries again
+    assert flight.do('page-1', lambda: 'ok') == 'ok'
+
+
+def test_different_keys_and_later_calls_are_not_coalesced():
+    flight = SingleFlight(enabled=True)
+    assert flight.do('a', lambda: 1) == 1
+    assert flight.do('a', lambda: 2) == 2
+    assert flight.do('b', lambda: 3) == 3
+    assert flight.snapshot()['coalesced'] == 0
+
+
+def test_forget_starts_a_new_call_for_later_callers():
+    flight = SingleFlight(enabled=True)
+    release = threading.Event()
+    threads, outcomes = start_waiters(flight, 'page-1', lambda: release.wait(5) and 'before', 1)
+    deadline = time.monotonic() + 5
+    while flight.snapshot()['in_flight'] == 0:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    flight.forget()
+    assert flight.do('page-1', lambda: 'after') == 'after'
+    release.set()
+    threads[0].join(5)
+    assert outcomes == ['before'] and flight.snapshot()['calls'] == 2
+
+
+def test_disabled_runs_every_call():
+    flight = SingleFlight(enabled=False)
+    with pytest.raises(ValueError):
+        flight.do('a', int, 'not a number')
+    assert flight.do('a', int, '7') == 7 and flight.snapshot()['calls'] == 0
@@ -0,0 +1,46 @@
+import io
+import os
+
+from upload_pipeline import UploadJob, guess_names, run_uploads
+
+
+class Upload(io.BytesIO):
+    # What st.file_uploader hands over: a file object with a name and a size
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+def job(data, track, name='track.wav'):
+    return UploadJob(Upload(data, name), 'Artist', track, transcode=False, preview=False)
+
+
+def test_guess_names():
+    assert guess_names('Daft Punk - One More Time.mp3') == ('Daft Punk', 'One More Time')
+    assert guess_names('some_track.wav') == ('', 'some track')
+
+
+def test_jobs_report_their_own_dedup_outcome(stub, gcs):
+    import api_calls
+
+    known, in_bucket = os.urandom(5000), os.urandom(4000)
+    first = run_uploads([job(known, 'First'), job(in_bucket, 'Second')])
+    assert [(j.dedup_outcome, j.reused_bytes) for j in first] == [('uploaded', 0), ('uploaded', 0)]
+    # Stored by another machine: in the bucket, but not in the local digest index
+    api_calls.get_digest_index().discard(first[1].file_url.rsplit('/', 1)[-1].split('.')[0])
+
+    batch = run_uploads([job(known, 'Again'), job(in_bucket, 'Again'), job(os.urandom(3000), 'New')])
+    assert [j.state for j in batch] == ['done'] * 3
+    assert [(j.dedup_outcome, j.reused_bytes) for j in batch] == [('local', 5000), ('remote', 4000), ('uploaded', 0)]
+    assert [j.file_url for j in batch[:2]] == [j.file_url for j in first]
+    assert len(stub.catalog.records) == 5
+
+
+def test_preview_failure_is_reported_but_the_upload_goes_through(stub, gcs):
+    # Not decodable (and without ffmpeg, MP3 is not decodable at all)
+    failing = UploadJob(Upload(os.urandom(2000), 'broken.mp3'), 'Artist', 'Broken', transcode=False, preview=True)
+    run_uploads([failing])
+    assert failing.state == 'done' and failing.error is None
+    assert failing.preview_error
+    assert failing.result['data']['fileUrl'] == failing.file_url
@@ -0,0 +1,299 @@
+import io
+import multiprocessing
+import os
+import shutil
+import subprocess
+import threading
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from math import gcd
+
+from gcs_upload import AUDIO_CONTENT_TYPES
+
+# Optional stage in front of uploads: decode, downmix/resample with NumPy and
+# re-encode to a compact format. Off unless JAARVIS_TRANSCODE=1 (or the Upload
+# tab's checkbox); compressed output needs an ffmpeg binary on PATH, without it
+# audio is written as 16-bit PCM WAV at the target rate and channel count.
+# NumPy is imported by the functions that use it, so importing this module (as
+# the upload form does for TRANSCODE_ENABLED) stays cheap.
+TRANSCODE_ENABLED = os.environ.get('JAARVIS_TRANSCODE') == '1'
+TARGET_FORMAT = os.environ.get('JAARVIS_TRANSCODE_FORMAT', 'mp3')
+TARGET_BITRATE = os.environ.get('JAARVIS_TRANSCODE_BITRATE', '128k')
+TARGET_SAMPLE_RATE = int(os.environ.get('JAARVIS_TRANSCODE_RATE', 44100))
+TARGET_CHANNELS = int(os.environ.get('JAARVIS_TRANSCODE_CHANNELS', 2))
+TRANSCODE_WORKERS = int(os.environ.get('JAARVIS_TRANSCODE_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+
+FFMPEG = shutil.which('ffmpeg')
+
+# format -> (ffmpeg codec, ffmpeg muxer, file extension)
+FORMATS = {
+    'mp3': ('libmp3lame', 'mp3', 'mp3'),
+    'ogg': ('libvorbis', 'ogg', 'ogg'),
+    'wav': (None, None, 'wav'),
+}
+
+# Windowed-sinc resampler taps per output sample (before widening for downsampling)
+RESAMPLE_TAPS = 16
+# Frames per chunk, and bytes per write to ffmpeg, when decoding as a stream
+STREAM_FRAMES = 1 << 16
+STREAM_FEED_BYTES = 1 << 18
+
+
+class TranscodeError(Exception):
+    pass
+
+
+class TranscodedFile(io.BytesIO):
+    # Stands in for the Streamlit UploadedFile downstream (name, type, size)
+    def __init__(self, data, name, content_type):
+        super().__init__(data)
+        self.name = name
+        self.type = content_type
+        self.size = len(data)
+
+
+def _ffmpeg(args, data):
+    result = subprocess.run([FFMPEG, '-hide_banner', '-loglevel', 'error', *args],
+                            input=data, capture_output=True)
+    if result.returncode != 0:
+        raise TranscodeError(result.stderr.decode('utf-8', 'replace').strip() or 'ffmpeg failed')
+    return result.stdout
+
+
+def pcm_to_float(frames, width):
+    # Interleaved little-endian PCM bytes -> flat float32 array in [-1, 1]
+    import numpy as np
+
+    if width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(frames, dtype='<i2').astype(np.float32) / 32768
+    elif width == 3:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        ints = np.where(ints >= 1 << 23, ints - (1 << 24), ints)
+        samples = ints.astype(np.float32) / (1 << 23)
+    elif width == 4:
+        samples = (np.frombuffer(frames, dtype='<i4') / float(1 << 31)).astype(np.float32)
+    else:
+        raise TranscodeError(f'Unsupported WAV sample width {width}')
+    return samples
+
+
+def decode_wav(data):
+    # PCM WAV -> (float32 array of shape (frames, channels) in [-1, 1], sample rate)
+    with wave.open(io.BytesIO(data)) as reader:
+        channels = reader.getnchannels()
+        width = reader.getsampwidth()
+        rate = reader.getframerate()
+        frames = reader.readframes(reader.getnframes())
+    return pcm_to_float(frames, width).reshape(-1, channels), rate
+
+
+def decode(data):
+    try:
+        return decode_wav(data)
+    except (wave.Error, EOFError, TranscodeError):
+        if FFMPEG is None:
+            raise TranscodeError('Only PCM WAV can be decoded without ffmpeg')
+    # Anything else (MP3, OGG, float/extensible WAV) is unpacked to PCM WAV by ffmpeg
+    return decode_wav(_ffmpeg(['-i', 'pipe:0', '-f', 'wav', '-c:a', 'pcm_s16le', 'pipe:1'], data))
+
+
+def _wav_chunks(reader, start, seconds, frames):
+    with reader:
+        rate = reader.getframerate()
+        total = reader.getnframes()
+        first = min(int(start * rate), total)
+        reader.setpos(first)
+        remaining = total - first if seconds is None else min(int(seconds * rate), total - first)
+        while remaining > 0:
+            data = reader.readframes(min(frames, remaining))
+            if not data:
+                break
+            samples = pcm_to_float(data, reader.getsampwidth()).reshape(-1, reader.getnchannels())
+            remaining -= len(samples)
+            yield downmix(samples, 1)[:, 0]
+
+
+def _ffmpeg_chunks(file, rate, start, seconds, frames):
+    import numpy as np
+
+    args = [FFMPEG, '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0']
+    if start:
+        args += ['-ss', f'{start:.3f}']
+    if seconds is not None:
+        args += ['-t', f'{seconds:.3f}']
+    args += ['-f', 's16le', '-ac', '1', '-ar', str(rate), '-c:a', 'pcm_s16le', 'pipe:1']
+    process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def feed():
+        # ffmpeg stops reading once it has the stretch it was asked for
+        try:
+            file.seek(0)
+            while True:
+                block = file.read(STREAM_FEED_BYTES)
+                if not block:
+                    break
+                process.stdin.write(block)
+        except (BrokenPipeError, OSError):
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        while True:
+            data = process.stdout.read(frames * 2)
+            if not data:
+                break
+            yield np.frombuffer(data[:len(data) // 2 * 2], dtype='<i2').astype(np.float32) / 32768
+        feeder.join()
+        error = process.stderr.read()
+        if process.wait() != 0:
+            raise TranscodeError(error.decode('utf-8', 'replace').strip() or 'ffmpeg failed')
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        feeder.join()
+        process.stdout.close()
+        process.stderr.close()
+
+
+def stream_mono(file, rate, start=0.0, seconds=None, frames=STREAM_FRAMES):
+    # Decodes an uploaded file chunk by chunk, so neither the file nor the track
+    # is held in memory whole. Returns (sample rate, iterator of 1-D float32 mono
+    # chunks). PCM WAV is read at its own rate; anything else goes through ffmpeg
+    # at `rate`. start/seconds pick out a stretch of the track.
+    file.seek(0)
+    try:
+        reader = wave.open(file)
+    except (wave.Error, EOFError):
+        reader = None
+    if reader is not None:
+        if reader.getsampwidth() in (1, 2, 3, 4):
+            return reader.getframerate(), _wav_chunks(reader, start, seconds, frames)
+        reader.close()
+    if FFMPEG is None:
+        raise TranscodeError('Only PCM WAV can be decoded without ffmpeg')
+    return rate, _ffmpeg_chunks(file, rate, start, seconds, frames)
+
+
+def downmix(samples, channels):
+    if samples.shape[1] <= channels:
+        return samples
+    if channels == 1:
+        return samples.mean(axis=1, keepdims=True)
+    # Keep the first two channels as left/right and fold the rest into both
+    extra = samples[:, 2:].mean(axis=1, keepdims=True) if samples.shape[1] > 2 else 0
+    return samples[:, :2] * 0.7071 + extra * 0.5
+
+
+def resample(samples, src_rate, dst_rate, taps=RESAMPLE_TAPS):
+    # Polyphase band-limited interpolation with a Hann-windowed sinc. Output sample
+    # j sits j * down / up samples into the source, so only `up` distinct filter
+    # phases exist; they are computed once and applied one tap at a time across
+    # the whole signal. When downsampling the kernel is widened to cut off at the
+    # new Nyquist frequency, so there is no aliasing.
+    import numpy as np
+
+    if src_rate == dst_rate or len(samples) == 0:
+        return samples
+    common = gcd(src_rate, dst_rate)
+    up, down = dst_rate // common, src_rate // common
+    cutoff = min(1.0, up / down)
+    half = int(np.ceil(taps / 2 / cutoff))
+    offsets = np.arange(-half + 1, half + 1)
+    distance = (np.arange(up) / up)[:, None] - offsets[None, :]
+    table = np.sinc(cutoff * distance) * (0.5 + 0.5 * np.cos(np.pi * np.clip(distance / half, -1, 1)))
+    table = (table / table.sum(axis=1, keepdims=True)).astype(np.float32)
+
+    total = len(samples) * up // down
+    steps = np.arange(total, dtype=np.int64) * down
+    base, phase = steps // up + half, steps % up
+    padded = np.pad(samples.astype(np.float32), ((half, half), (0, 0)))
+    out = np.zeros((total, samples.shape[1]), dtype=np.float32)
+    for k, offset in enumerate(offsets):
+        out += table[phase, k][:, None] * padded[base + offset]
+    return out
+
+
+def to_pcm16(samples):
+    import numpy as np
+
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+
+
+def encode(samples, rate, fmt=TARGET_FORMAT, bitrate=TARGET_BITRATE):
+    codec, muxer, _ = FORMATS[fmt]
+    pcm = to_pcm16(samples)
+    if codec is None:
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as writer:
+            writer.setnchannels(samples.shape[1])
+            writer.setsampwidth(2)
+            writer.setframerate(rate)
+            writer.writeframes(pcm)
+        return buffer.getvalue()
+    # bitexact keeps the output identical for identical input, so content-hash
+    # dedup still matches re-uploads of the same source file
+    return _ffmpeg(['-f', 's16le', '-ar', str(rate), '-ac', str(samples.shape[1]), '-i', 'pipe:0',
+                    '-map_metadata', '-1', '-fflags', '+bitexact', '-flags:a', '+bitexact',
+                    '-c:a', codec, '-b:a', bitrate, '-f', muxer, 'pipe:1'], pcm)
+
+
+def output_format(fmt=TARGET_FORMAT):
+    # Compressed formats need ffmpeg; fall back to (smaller) PCM WAV without it
+    return fmt if FORMATS[fmt][0] is None or FFMPEG else 'wav'
+
+
+def transcode_bytes(data, fmt=TARGET_FORMAT, bitrate=TARGET_BITRATE, rate=TARGET_SAMPLE_RATE,
+                    channels=TARGET_CHANNELS):
+    # Runs in a worker process. Returns (encoded bytes, extension).
+    fmt = output_format(fmt)
+    samples, src_rate = decode(data)
+    samples = downmix(samples, channels)
+    # Never upsample; only reduce the rate
+    dst_rate = min(rate, src_rate)
+    samples = resample(samples, src_rate, dst_rate)
+    return encode(samples, dst_rate, fmt, bitrate), FORMATS[fmt][2]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_transcode_pool():
+    # spawn rather than fork: the Streamlit server is multi-threaded
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=TRANSCODE_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def transcode_file(file, fmt=TARGET_FORMAT, bitrate=TARGET_BITRATE, rate=TARGET_SAMPLE_RATE,
+                   channels=TARGET_CHANNELS):
+    # Transcodes an uploaded file in the process pool and returns a file-like
+    # object ready for upload_file_to_gcs. The original is returned when it cannot
+    # be decoded here or the result would not be smaller.
+    file.seek(0)
+    data = file.read()
+    file.seek(0)
+    try:
+        encoded, extension = get_transcode_pool().submit(
+            transcode_bytes, data, fmt, bitrate, rate, channels).result()
+    except TranscodeError as e:
+        print(f"Skipping transcode of {getattr(file, 'name', 'upload')}: {e}")
+        return file
+    if len(encoded) >= len(data):
+        return file
+    stem = os.path.splitext(getattr(file, 'name', None) or 'audio')[0]
+    return TranscodedFile(encoded, f'{stem}.{extension}', AUDIO_CONTENT_TYPES[extension])
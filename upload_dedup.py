@@ -0,0 +1,98 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+# Uploads are keyed by a SHA-256 of their bytes; identical audio maps to one blob
+DIGEST_ALGORITHM = 'sha256'
+DIGEST_INDEX_PATH = os.environ.get('JAARVIS_DIGEST_INDEX', './upload_digests.sqlite3')
+# Bytes read per step while hashing; only this much of the file is in memory
+HASH_BLOCK_SIZE = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS digests (
+    digest TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    size INTEGER,
+    stored_at REAL
+);
+"""
+
+
+def content_digest(file, block_size=HASH_BLOCK_SIZE):
+    # Hashes a seekable file object from the start in one streaming pass and
+    # returns (hex digest, size); the file is rewound afterwards
+    file.seek(0)
+    digest = hashlib.new(DIGEST_ALGORITHM)
+    size = 0
+    while True:
+        block = file.read(block_size)
+        if not block:
+            break
+        digest.update(block)
+        size += len(block)
+    file.seek(0)
+    return digest.hexdigest(), size
+
+
+class DigestIndex:
+    # Local digest -> public URL map of blobs this machine has stored or seen in
+    # the bucket, so repeat uploads skip GCS without any network call
+
+    def __init__(self, path=DIGEST_INDEX_PATH):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        with self._lock:
+            row = self._db.execute('SELECT url FROM digests WHERE digest = ?', (digest,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, digest, url, size):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?)',
+                             (digest, url, size, time.time()))
+
+    def discard(self, digest):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM digests WHERE digest = ?', (digest,))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM digests').fetchone()[0]
+
+
+class DedupStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.local_hits = 0
+        self.remote_hits = 0
+        self.bytes_uploaded = 0
+        self.bytes_saved = 0
+
+    def record(self, outcome, size):
+        # outcome: 'uploaded', 'local' (digest index hit) or 'remote' (blob existed)
+        with self._lock:
+            self.uploads += 1
+            if outcome == 'uploaded':
+                self.bytes_uploaded += size
+                return
+            self.bytes_saved += size
+            if outcome == 'local':
+                self.local_hits += 1
+            else:
+                self.remote_hits += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'uploads': self.uploads,
+                'local_hits': self.local_hits,
+                'remote_hits': self.remote_hits,
+                'bytes_uploaded': self.bytes_uploaded,
+                'bytes_saved': self.bytes_saved,
+            }
@@ -0,0 +1,91 @@
+import streamlit as st
+
+from previews import PREVIEWS_ENABLED
+from transcode import FFMPEG, TRANSCODE_ENABLED
+from upload_pipeline import UploadJob, guess_names, has_allowed_extension, run_uploads
+
+STATE_LABELS = {
+    'queued': 'Waiting',
+    'transcoding': 'Compressing',
+    'uploading': 'Uploading',
+    'previewing': 'Making preview',
+    'registering': 'Saving track info',
+    'done': 'Done',
+    'failed': 'Failed',
+}
+
+
+def upload_form(key):
+    # Multi-file upload shared by the Upload tabs of both pages. Every file gets its
+    # own artist/track fields (pre-filled from "Artist - Track.ext" names), and the
+    # files are uploaded and registered in parallel with one progress bar each.
+    uploaded_files = st.file_uploader("Choose files", accept_multiple_files=True, key=f"{key}_files")
+    default_artist = st.text_input('Artist Name (applies to every file unless changed below)', key=f"{key}_artist")
+
+    entries = []
+    for i, uploaded_file in enumerate(uploaded_files or []):
+        guessed_artist, guessed_track = guess_names(uploaded_file.name)
+        artist_col, track_col = st.columns(2)
+        artist_name = artist_col.text_input(
+            f'Artist Name — {uploaded_file.name}', value=default_artist or guessed_artist,
+            key=f"{key}_artist_{i}_{uploaded_file.name}")
+        track_name = track_col.text_input(
+            f'Track Name — {uploaded_file.name}', value=guessed_track,
+            key=f"{key}_track_{i}_{uploaded_file.name}")
+        entries.append((uploaded_file, artist_name, track_name))
+
+    if PREVIEWS_ENABLED and FFMPEG is None and any(not f.name.lower().endswith('.wav') for f, _, _ in entries):
+        st.info("ffmpeg is not installed on the server, so MP3 and OGG files get no preview clip or waveform; "
+                "they play in full instead.")
+
+    compress = st.checkbox('Compress audio before upload', value=TRANSCODE_ENABLED, key=f"{key}_compress")
+
+    ready = bool(entries) and all(artist and track for _, artist, track in entries)
+    submit_button = st.button('Submit Songs', disabled=not ready, key=f"{key}_submit")
+    if not submit_button:
+        return
+
+    invalid = [f.name for f, _, _ in entries if not has_allowed_extension(f.name)]
+    if invalid:
+        st.warning(f"Please choose files with .mp3, .ogg, or .wav extension: {', '.join(invalid)}")
+        return
+
+    jobs = [UploadJob(f, artist, track, transcode=compress) for f, artist, track in entries]
+    bars = [st.progress(0.0, text=f"{job.name}: {STATE_LABELS[job.state]}") for job in jobs]
+
+    def redraw(jobs):
+        for job, bar in zip(jobs, bars):
+            label = STATE_LABELS[job.state]
+            if job.error:
+                label = f"{label} ({job.error})"
+            elif job.preview_error:
+                label = f"{label} (no preview)"
+            bar.progress(job.fraction, text=f"{job.name}: {label}")
+
+    run_uploads(jobs, on_update=redraw)
+
+    succeeded = [job for job in jobs if job.state == 'done']
+    if succeeded:
+        slowest = max(job.elapsed for job in jobs)
+        st.success(f"Uploaded {len(succeeded)} of {len(jobs)} files (slowest file took {slowest:.1f}s)")
+        pending = sum(job.pending for job in succeeded)
+        if pending:
+            st.info(f"Track info for {pending} file(s) is saved locally and will be sent to the server in the "
+                    "background; the tracks appear in listings once it has been sent.")
+        for job in succeeded:
+            st.markdown(f"**{job.artist_name} — {job.track_name}**")
+            if job.source_bytes and job.total_bytes < job.source_bytes:
+                st.caption(f"Compressed {job.source_bytes / 1024 / 1024:.1f} MB to {job.total_bytes / 1024 / 1024:.1f} MB")
+            if job.preview_error:
+                st.warning(f"No preview or waveform for {job.name}: {job.preview_error}. "
+                           "The track plays in full instead.")
+            st.audio(job.file_url)
+    # Counted per job: the process-wide dedup counters also move with other
+    # sessions' uploads
+    reused = [job for job in jobs if job.dedup_outcome in ('local', 'remote')]
+    if reused:
+        saved = sum(job.reused_bytes for job in reused)
+        st.info(f"{len(reused)} file(s) were already stored; skipped {saved / 1024 / 1024:.1f} MB of upload")
+    for job in jobs:
+        if job.state == 'failed':
+            st.error(f"Failed to upload {job.name}: {job.error}")
@@ -0,0 +1,131 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from api_calls import store_upload
+from mutation_journal import submit_upload
+from previews import PREVIEWS_ENABLED, create_preview
+from transcode import TRANSCODE_ENABLED, transcode_file
+
+ALLOWED_EXTENSIONS = ['mp3', 'ogg', 'wav']
+# Files uploaded at the same time
+UPLOAD_WORKERS = int(os.environ.get('JAARVIS_UPLOAD_WORKERS', 4))
+
+
+def guess_names(filename):
+    # "Artist - Track.wav" -> ("Artist", "Track"); otherwise ("", "<file stem>")
+    stem = os.path.splitext(os.path.basename(filename))[0].replace('_', ' ')
+    if ' - ' in stem:
+        artist, track = stem.split(' - ', 1)
+        return artist.strip(), track.strip()
+    return '', stem.strip()
+
+
+def has_allowed_extension(filename):
+    return filename.rsplit('.', 1)[-1].lower() in ALLOWED_EXTENSIONS
+
+
+class UploadJob:
+    # One file's trip through GCS upload and metadata registration. Workers update
+    # it in place; the page thread reads it to draw progress.
+
+    def __init__(self, file, artist_name, track_name, transcode=TRANSCODE_ENABLED, preview=PREVIEWS_ENABLED):
+        # file is replaced by the compressed copy when transcoding is on
+        self.source_file = file
+        self.file = file
+        self.artist_name = artist_name
+        self.track_name = track_name
+        self.transcode = transcode
+        self.preview = preview
+        self.preview_error = None
+        self.total_bytes = getattr(file, 'size', None) or 0
+        self.source_bytes = None
+        self.bytes_sent = 0
+        self.state = 'queued'
+        self.file_url = None
+        # 'uploaded', or 'local'/'remote' when the content was already stored and
+        # reused_bytes were not sent (see api_calls.store_upload)
+        self.dedup_outcome = None
+        self.reused_bytes = 0
+        self.result = None
+        # Track info saved to the mutation journal, not yet sent to the API
+        self.pending = False
+        self.error = None
+        self.elapsed = 0.0
+
+    @property
+    def name(self):
+        return getattr(self.source_file, 'name', self.track_name)
+
+    @property
+    def done(self):
+        return self.state in ('done', 'failed')
+
+    @property
+    def fraction(self):
+        if self.state == 'done':
+            return 1.0
+        if not self.total_bytes:
+            return 0.0
+        # Leave the last slice of the bar for metadata registration
+        return 0.95 * min(self.bytes_sent / self.total_bytes, 1.0)
+
+    def _on_progress(self, sent, total):
+        self.bytes_sent = sent
+        self.total_bytes = total
+
+    def _create_preview(self):
+        # Runs before registration, so listings never see a track whose preview is
+        # still being made. A track without a preview still plays in full.
+        try:
+            create_preview(self.file, self.file_url)
+        except Exception as e:
+            self.preview_error = str(e) or e.__class__.__name__
+
+    def run(self):
+        started = time.perf_counter()
+        try:
+            if self.transcode:
+                # CPU-bound; runs in the transcode process pool, this thread just waits
+                self.state = 'transcoding'
+                self.source_bytes = self.total_bytes
+                self.file = transcode_file(self.file)
+                self.total_bytes = getattr(self.file, 'size', None) or self.total_bytes
+            self.state = 'uploading'
+            self.file_url, self.dedup_outcome, size = store_upload(self.file, progress=self._on_progress)
+            if self.dedup_outcome != 'uploaded':
+                self.reused_bytes = size
+            if self.preview:
+                self.state = 'previewing'
+                self._create_preview()
+            self.state = 'registering'
+            # Returns at once with 'pending' set when write-behind is on
+            self.result = submit_upload({
+                "artist_name": self.artist_name,
+                "track_name": self.track_name,
+                "file_url": self.file_url,
+            })
+            if not self.result['success']:
+                raise RuntimeError(self.result['message'])
+            self.pending = bool(self.result.get('pending'))
+            self.state = 'done'
+        except Exception as e:
+            self.error = str(e) or e.__class__.__name__
+            self.state = 'failed'
+        finally:
+            self.elapsed = time.perf_counter() - started
+        return self
+
+
+def run_uploads(jobs, max_workers=UPLOAD_WORKERS, on_update=None, poll_interval=0.2):
+    # Runs every job on a bounded thread pool, so the total time tracks the slowest
+    # file rather than the sum. on_update(jobs) is called from the calling thread
+    # every poll_interval seconds and once at the end, e.g. to redraw progress bars.
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='upload') as pool:
+        futures = [pool.submit(job.run) for job in jobs]
+        pending = set(futures)
+        while pending:
+            _, pending = wait(pending, timeout=poll_interval)
+            if on_update:
+                on_update(jobs)
+    return jobs